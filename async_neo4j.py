@@ -0,0 +1,168 @@
+import asyncio
+import os
+import re
+import time
+
+from neo4j import AsyncGraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+
+from instrumentation import instrumented
+from neo4j_loader import MERGE_CASE_METADATA, MERGE_EDGES, MERGE_EVENTS, SCHEMA_QUERIES, Neo4jBulkLoader
+from prefix_table import PrefixTableBuilder
+from queries import add_prefix_record, projected_prefix_query
+
+MAX_ACTIVITY_QUERY = "MATCH (n:Event) RETURN max(n.activity_id) AS max_activity_id"
+TRACKS_QUERY = "MATCH (e:Event) RETURN DISTINCT e.track_id AS track_id ORDER BY track_id"
+
+# la query di create_prefixes con k (ed eventualmente il gruppo di casi) come parametri, con le proiezioni e i
+# tempi interi di queries.STREAM_PREFIX_QUERY
+TRACK_FILTER = " AND e.track_id IN $track_ids"
+PREFIX_QUERY = projected_prefix_query()
+TRACK_PREFIX_QUERY = projected_prefix_query(TRACK_FILTER)
+
+RETRYABLE_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
+
+
+class AsyncActiveCaseGeneration:
+    # stesse operazioni di ActiveCaseGeneration con il driver asyncio: al più concurrency query in volo, su un
+    # pool di pool_size connessioni; i deadlock e gli altri errori transitori vengono ritentati con backoff
+
+    def __init__(self, uri=None, user=None, password=None, driver=None, database="neo4j", pool_size=50,
+                 concurrency=8, retries=5, backoff=0.1, batch_size=5000):
+        self.driver = AsyncGraphDatabase.driver(uri, auth=(user, password), max_connection_pool_size=pool_size) \
+            if driver is None else driver
+        self.database = database
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.semaphore = None
+
+    async def close(self):
+        await self.driver.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def limit(self):
+        # il semaforo va creato dentro il loop che lo usa
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.semaphore
+
+    async def run(self, query, parameters=None):
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.limit():
+                    return await self.driver.execute_query(query, parameters_=parameters, database_=self.database)
+            except RETRYABLE_ERRORS as error:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print(f"{error.__class__.__name__}, retry {attempt + 1}/{self.retries} in {delay:.2f} seconds")
+                await asyncio.sleep(delay)
+
+    async def create_schema(self):
+        for query in SCHEMA_QUERIES:
+            await self.run(query)
+        await self.run("CALL db.awaitIndexes()")
+
+    async def write_batches(self, query, batches):
+        # la lettura dei batch (CSV, .g) è sincrona: si fa in un thread per non fermare le altre query
+        iterator = iter(batches)
+        pending = set()
+        loaded = 0
+        while True:
+            rows = await asyncio.to_thread(next, iterator, None)
+            if rows is None:
+                break
+            pending.add(asyncio.create_task(self.run(query, {'rows': rows})))
+            loaded += len(rows)
+            if len(pending) >= 2 * self.concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        await asyncio.gather(*pending)
+        return loaded
+
+    async def import_file(self, log_path):
+        start_time = time.time()
+        loader = Neo4jBulkLoader(None, self.database, self.batch_size)
+        loaded = await self.write_batches(MERGE_EVENTS, loader.read_batches(log_path))
+        print(f"{time.time() - start_time:.6f} seconds ({loaded} events from {log_path})")
+        return loaded
+
+    async def import_files(self, paths):
+        # un task per file: il tempo totale è vicino a quello del file più lento, non alla somma
+        await self.create_schema()
+        return await asyncio.gather(*(self.import_file(path) for path in paths))
+
+    async def import_edges(self, graphs_path='data/graphs.g'):
+        loader = Neo4jBulkLoader(None, self.database, self.batch_size)
+        loaded = await self.write_batches(MERGE_EDGES, loader.read_edge_batches(graphs_path))
+        await self.write_batches(MERGE_CASE_METADATA, loader.read_case_batches(graphs_path))
+        return loaded
+
+    async def track_groups(self, shards):
+        records = (await self.run(TRACKS_QUERY))[0]
+        track_ids = [record['track_id'] for record in records]
+        size = -(-len(track_ids) // shards) if track_ids else 1
+        return [track_ids[first:first + size] for first in range(0, len(track_ids), size)]
+
+    async def prefix_records(self, k, track_ids=None):
+        if track_ids is None:
+            return (await self.run(PREFIX_QUERY, {'k': k}))[0]
+        return (await self.run(TRACK_PREFIX_QUERY, {'k': k, 'track_ids': track_ids}))[0]
+
+    async def create_prefixes(self, output_path='data/prefixes.csv', fan_out='k', shards=4):
+        # fan_out='k': una query per lunghezza; fan_out='track': una query per lunghezza e gruppo di casi.
+        # I risultati arrivano in ordine sparso ma vengono scritti in ordine (k, gruppo)
+        start = time.time()
+        max_len = (await self.run(MAX_ACTIVITY_QUERY))[0][0][0] or 0
+        groups = [None] if fan_out == 'k' else await self.track_groups(shards)
+
+        async def task(key):
+            k, group = key
+            return key, await self.prefix_records(k, groups[group])
+
+        keys = [(k, group) for k in range(1, max_len - 1) for group in range(len(groups))]
+        prefixes = PrefixTableBuilder(output_path)
+        ready = {}
+        next_key = 0
+        for finished in asyncio.as_completed([task(key) for key in keys]):
+            key, records = await finished
+            ready[key] = records
+            while next_key < len(keys) and keys[next_key] in ready:
+                for record in ready.pop(keys[next_key]):
+                    add_prefix_record(prefixes, keys[next_key][0], record)
+                next_key += 1
+        prefixes.close()
+        print(f"Time for async prefix generation ({fan_out}, {len(keys)} queries): {time.time() - start:.6f} seconds")
+        return prefixes.rows_written
+
+
+def split_files(output_dir='data/output_files/500', count=None):
+    # stessi file di import_data: filtered_prefix_log_*.csv in ordine numerico
+    files = sorted([file for file in os.listdir(output_dir) if file.startswith('filtered_prefix_log_')
+                    and file.endswith('.csv')], key=lambda file: int(re.findall(r'\d+', file)[0]))
+    return [os.path.join(output_dir, file) for file in files[:count]]
+
+
+@instrumented('import')
+def import_split_files(output_dir='data/output_files/500', count=None, **connection_args):
+    # connection_args: gli argomenti di AsyncActiveCaseGeneration; driver e semaforo vivono nel loop di asyncio.run
+    async def main():
+        async with AsyncActiveCaseGeneration(**connection_args) as connection:
+            return await connection.import_files(split_files(output_dir, count))
+    return asyncio.run(main())
+
+
+@instrumented('prefix')
+def create_prefixes(output_path='data/prefixes.csv', fan_out='k', shards=4, **connection_args):
+    async def main():
+        async with AsyncActiveCaseGeneration(**connection_args) as connection:
+            return await connection.create_prefixes(output_path, fan_out, shards)
+    return asyncio.run(main())
@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import psutil
+from dotenv import load_dotenv
+from neo4j import GraphDatabase
+
+from instrumentation import disabled, percentiles, stage
+from neo4j_loader import Neo4jBulkLoader
+from out_of_core import active_case_and_final_activity_dbs_chunked, generate_prefixes_chunked
+from parallel_prefixes import active_case_and_final_activity_dbs_parallel, generate_prefixes_parallel
+from prefix_engine import LOG_COLUMNS, generate_prefixes, load_cases
+from queries import ActiveCaseGeneration, active_case_and_final_activity_dbs
+from snapshot_query import SnapshotQueryService
+from standin_driver import StandInDriver
+from tensor_export import build_tensors
+from timestamps import NAT, from_epoch_us, to_epoch_us
+
+OUTPUT_DIR = os.path.join('data', 'output_files', 'benchmark')
+THRESHOLDS_PATH = os.path.join('config', 'benchmark_thresholds.json')
+STAGES = ['import', 'prefix', 'tensors', 'active_case', 'query']
+PATHS = ['python', 'parallel', 'chunked', 'neo4j']
+SUMMARY_COLUMNS = ['dataset', 'cases', 'events', 'path', 'stage', 'driver', 'runs', 'min_s', 'p50_s', 'mean_s',
+                   'max_s', 'rss_mb_max']
+
+
+def discover_datasets(prefix_dir='data/prefixes', split_dir='data/output_files'):
+    # prefix_log_<casi>.csv e filtered_prefix_log_<n>percent.csv, in ordine di dimensione; i file mancanti si saltano
+    datasets = []
+    for directory, pattern in [(prefix_dir, r'prefix_log_(\d+)\.csv$'),
+                               (split_dir, r'filtered_prefix_log_(\d+)percent\.csv$')]:
+        if not os.path.isdir(directory):
+            continue
+        found = [(int(match.group(1)), file) for file in os.listdir(directory)
+                 for match in [re.match(pattern, file)] if match]
+        datasets.extend((file[:-4], os.path.join(directory, file)) for _, file in sorted(found))
+    return datasets
+
+
+def log_to_graphs(log_path, graphs_path):
+    # i log non hanno archi: ogni caso diventa una catena 1 -> 2 -> ... nel formato di graphs.g
+    log = pd.read_csv(log_path, header=None, names=LOG_COLUMNS, dtype=str)
+    log['activity_id'] = log['activity_id'].astype(int)
+    with open(graphs_path, 'w') as file:
+        for track_id, case in log.groupby('track_id', sort=False):
+            case = case.sort_values('activity_id')
+            file.write('XP\n')
+            for activity_id, event_name, finish_time in case[['activity_id', 'event_name', 'finish_time']].itertuples(
+                    index=False, name=None):
+                file.write(f"v {activity_id}  {event_name} {finish_time[:10]}{finish_time[11:]} {track_id}\n")
+            names = case['event_name'].tolist()
+            for node in range(1, len(names)):
+                file.write(f"e {node} {node + 1} {names[node - 1]}__{names[node]}\n")
+            file.write('\n')
+    return log['track_id'].nunique(), len(log)
+
+
+def standin_driver():
+    # il sostituto in-process esegue solo le query note della pipeline, i suoi tempi non sono quelli di Neo4j (la
+    # colonna driver dei risultati lo distingue)
+    return StandInDriver()
+
+
+def connect(driver_kind='auto', config_path='config/database_conf.env'):
+    # auto: il server di database_conf.env se risponde, altrimenti il driver di test
+    if driver_kind == 'standin':
+        return standin_driver(), 'standin'
+    load_dotenv(config_path)
+    try:
+        driver = GraphDatabase.driver(os.getenv("DATABASE_URI"),
+                                      auth=(os.getenv("USERNAME_NEO4J"), os.getenv("PASSWORD_NEO4J")))
+        driver.verify_connectivity()
+        return driver, 'neo4j'
+    except Exception as error:
+        if driver_kind == 'neo4j':
+            raise
+        print(f"Neo4j not reachable ({error.__class__.__name__}), using the stand-in test driver")
+        return standin_driver(), 'standin'
+
+
+def query_instants(active_path, count, seed=0):
+    # istanti distribuiti sull'intervallo coperto dal log, sempre gli stessi a parità di seed
+    finish = to_epoch_us(pd.read_csv(active_path)['finish_time_last_activity'])
+    finish = finish[finish != NAT]
+    rng = np.random.default_rng(seed)
+    return list(from_epoch_us(rng.integers(finish.min(), finish.max() + 1, size=count)))
+
+
+def python_stages(dataset_dir, graphs_path, log_path, queries):
+    prefixes_path = os.path.join(dataset_dir, 'prefixes_python.csv')
+    active_path = os.path.join(dataset_dir, 'active_activities.csv')
+    final_path = os.path.join(dataset_dir, 'final_activities.csv')
+
+    def query():
+        service = SnapshotQueryService(active_path, final_path, prefixes_path)
+        instants = query_instants(active_path, queries)
+        service.active_prefixes_at(instants)
+        for instant in instants[:10]:
+            service.get_prefix_information(instant, instant)
+
+    return {
+        'import': (None, lambda: load_cases(graphs_path, log_path)),
+        'prefix': (None, lambda: generate_prefixes(graphs_path, log_path, prefixes_path)),
+        'tensors': (None, lambda: build_tensors(graphs_path, log_path, os.path.join(dataset_dir, 'tensors'))),
+        'active_case': (None, lambda: active_case_and_final_activity_dbs(graphs_path, dataset_dir)),
+        'query': (None, query),
+    }
+
+
+def parallel_stages(dataset_dir, graphs_path, log_path, workers):
+    # stessi file del percorso python, prodotti da un pool di processi
+    return {
+        'prefix': (None, lambda: generate_prefixes_parallel(graphs_path, log_path,
+                                                            os.path.join(dataset_dir, 'prefixes_parallel.csv'),
+                                                            workers)),
+        'active_case': (None, lambda: active_case_and_final_activity_dbs_parallel(
+            graphs_path, os.path.join(dataset_dir, 'parallel'), workers)),
+    }
+
+
+def chunked_stages(dataset_dir, graphs_path, log_path, memory_budget_mb):
+    # stessi file del percorso python, un gruppo di casi alla volta entro il budget di memoria
+    return {
+        'prefix': (None, lambda: generate_prefixes_chunked(graphs_path, log_path,
+                                                           os.path.join(dataset_dir, 'prefixes_chunked.csv'),
+                                                           memory_budget_mb)),
+        'active_case': (None, lambda: active_case_and_final_activity_dbs_chunked(
+            graphs_path, os.path.join(dataset_dir, 'chunked'), memory_budget_mb)),
+    }
+
+
+def neo4j_stages(dataset_dir, graphs_path, log_path, driver, batch_size, queries):
+    connection = ActiveCaseGeneration(driver=driver)
+    loader = Neo4jBulkLoader(driver, batch_size=batch_size)
+    active_path = os.path.join(dataset_dir, 'active_activities_Neo4j.csv')
+
+    def reset():
+        driver.execute_query("MATCH (n:Event) DETACH DELETE n", database_="neo4j")
+
+    def load():
+        loader.load_events(log_path)
+        loader.load_edges(graphs_path)
+
+    def query():
+        # stessi istanti del percorso Python, una query parametrizzata per istante (il piano resta in cache)
+        for instant in query_instants(active_path, queries)[:10]:
+            connection.generate_active_case(instant, instant)
+
+    return {
+        'import': (reset, load),
+        'prefix': (None, lambda: connection.create_prefixes(os.path.join(dataset_dir, 'prefixes_neo4j.csv'))),
+        'active_case': (None, lambda: connection.active_activity_neo4j(active_path)),
+        'query': (None, query),
+    }
+
+
+def measure(setup, function, repeats, warmup, sample, **fields):
+    # warmup esecuzioni scartate, poi repeats esecuzioni misurate; setup resta fuori dal tempo misurato
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        with disabled():
+            function()
+    runs = []
+    for repeat in range(repeats):
+        if setup is not None:
+            setup()
+        # le funzioni misurate non scrivono i propri record: scansione dei processi e avvio del campionatore
+        # restano fuori dal tempo (e dalle soglie di regressione)
+        with stage('benchmark', label=f"{fields['path']}/{fields['stage']}", sample=sample, repeat=repeat,
+                   **fields), disabled():
+            start = time.perf_counter()
+            function()
+            duration = time.perf_counter() - start
+        runs.append({'type': 'benchmark', 'repeat': repeat, 'duration_s': duration,
+                     'rss_mb': psutil.Process(os.getpid()).memory_info().rss / (1024 ** 2), **fields})
+    return runs
+
+
+def summarize_runs(runs):
+    groups = {}
+    for run in runs:
+        key = tuple(run[column] for column in SUMMARY_COLUMNS[:6])
+        groups.setdefault(key, []).append(run)
+    rows = []
+    for key, group in groups.items():
+        durations = np.array([run['duration_s'] for run in group])
+        rows.append(key + (len(group), durations.min(), float(np.percentile(durations, 50)), durations.mean(),
+                           durations.max(), max(run['rss_mb'] for run in group)))
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+def load_thresholds(path=THRESHOLDS_PATH):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def check_regressions(summary, baseline, thresholds):
+    # regressione: p50 oltre la baseline di più della tolleranza dello stadio e del rumore minimo in secondi
+    merged = summary.merge(baseline[['dataset', 'path', 'stage', 'driver', 'p50_s']],
+                           on=['dataset', 'path', 'stage', 'driver'], suffixes=('', '_baseline'))
+    regressions = []
+    for row in merged.itertuples(index=False):
+        limits = dict(thresholds, **thresholds.get('stages', {}).get(f"{row.path}/{row.stage}", {}))
+        allowed = row.p50_s_baseline * (1 + limits['tolerance'])
+        if row.p50_s > allowed and row.p50_s - row.p50_s_baseline > limits['min_delta_s']:
+            regressions.append({'dataset': row.dataset, 'path': row.path, 'stage': row.stage, 'driver': row.driver,
+                                'p50_s': row.p50_s, 'baseline_p50_s': row.p50_s_baseline,
+                                'ratio': row.p50_s / row.p50_s_baseline if row.p50_s_baseline else None})
+    return regressions
+
+
+def run_benchmark(datasets, paths=PATHS, stages=STAGES, repeats=3, warmup=1, driver_kind='auto',
+                  reset_database=False, queries=100, batch_size=5000, output_dir=OUTPUT_DIR, sample=False, workers=None,
+                  memory_budget_mb=1024):
+    os.makedirs(output_dir, exist_ok=True)
+    driver, driver_name = connect(driver_kind) if 'neo4j' in paths else (None, None)
+    if driver_name == 'neo4j' and not reset_database:
+        # l'import cancella i nodi :Event a ogni ripetizione, su un server vero serve il consenso esplicito
+        print("Skipping the Neo4j path: it needs --reset-database on a real server")
+        paths = [path for path in paths if path != 'neo4j']
+
+    machine = {'python': platform.python_version(), 'platform': platform.platform(),
+               'cpus': os.cpu_count(), 'memory_gb': round(psutil.virtual_memory().total / 1024 ** 3, 1)}
+    runs = []
+    try:
+        for name, log_path in datasets:
+            dataset_dir = os.path.join(output_dir, name)
+            os.makedirs(os.path.join(dataset_dir, 'parallel'), exist_ok=True)
+            os.makedirs(os.path.join(dataset_dir, 'chunked'), exist_ok=True)
+            graphs_path = os.path.join(dataset_dir, 'graphs.g')
+            cases, events = log_to_graphs(log_path, graphs_path)
+            for path in paths:
+                if path == 'python':
+                    path_stages = python_stages(dataset_dir, graphs_path, log_path, queries)
+                elif path == 'parallel':
+                    path_stages = parallel_stages(dataset_dir, graphs_path, log_path, workers)
+                elif path == 'chunked':
+                    path_stages = chunked_stages(dataset_dir, graphs_path, log_path, memory_budget_mb)
+                else:
+                    path_stages = neo4j_stages(dataset_dir, graphs_path, log_path, driver, batch_size, queries)
+                # l'ordine degli stadi resta quello della pipeline: ognuno usa i file prodotti dai precedenti
+                for stage_name in STAGES:
+                    if stage_name not in stages or stage_name not in path_stages:
+                        continue
+                    setup, function = path_stages[stage_name]
+                    fields = {'dataset': name, 'cases': cases, 'events': events, 'path': path, 'stage': stage_name,
+                              'driver': driver_name if path == 'neo4j' else 'none'}
+                    measured = measure(setup, function, repeats, warmup, sample, **fields)
+                    for run in measured:
+                        run['machine'] = machine
+                    runs.extend(measured)
+                    print(f"{name} {path}/{stage_name}: "
+                          f"{percentiles([run['duration_s'] for run in measured])['p50']:.6f} seconds (p50)")
+    finally:
+        if driver is not None:
+            driver.close()
+
+    with open(os.path.join(output_dir, 'results.jsonl'), 'a') as file:
+        file.writelines(json.dumps(run) + '\n' for run in runs)
+    summary = summarize_runs(runs)
+    summary.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the prefix pipeline")
+    parser.add_argument('--datasets', nargs='*', help="dataset names (default: all the logs found)")
+    parser.add_argument('--paths', nargs='*', default=PATHS, choices=PATHS)
+    parser.add_argument('--stages', nargs='*', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--driver', default='auto', choices=['auto', 'neo4j', 'standin'])
+    parser.add_argument('--reset-database', action='store_true',
+                        help="allow deleting the :Event nodes of a real server before every import")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, help="processes of the parallel path (default: all the cores)")
+    parser.add_argument('--memory-budget', type=float, default=1024,
+                        help="MB of RSS allowed to the chunked path (default: 1024)")
+    parser.add_argument('--sample', action='store_true', help="sample CPU/memory during every run")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--baseline', help="summary.csv of a previous run to check for regressions")
+    parser.add_argument('--save-baseline', help="copy the new summary to this path")
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH)
+    args = parser.parse_args(argv)
+
+    datasets = discover_datasets()
+    if args.datasets:
+        datasets = [dataset for dataset in datasets if dataset[0] in args.datasets]
+    summary = run_benchmark(datasets, args.paths, args.stages, args.repeats, args.warmup, args.driver,
+                            args.reset_database, args.queries, args.batch_size, args.output_dir, args.sample,
+                            args.workers, args.memory_budget)
+    if args.save_baseline:
+        summary.to_csv(args.save_baseline, index=False)
+
+    if args.baseline:
+        baseline = pd.read_csv(args.baseline)
+        regressions = check_regressions(summary, baseline, load_thresholds(args.thresholds))
+        with open(os.path.join(args.output_dir, 'regressions.json'), 'w') as file:
+            json.dump(regressions, file, indent=2)
+        for regression in regressions:
+            print(f"REGRESSION {regression['dataset']} {regression['path']}/{regression['stage']}: "
+                  f"{regression['p50_s']:.6f} s vs {regression['baseline_p50_s']:.6f} s")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from timestamps import NAT, from_epoch_us, to_epoch_us
+
+NULL_CODE = -1
+
+ACTIVE_SCHEMA = {'track_id': 'category', 'index': 'int', 'start_time_prefix': 'time',
+                 'finish_time_last_activity': 'time'}
+FINAL_SCHEMA = {'track_id': 'category', 'index': 'int', 'event_name': 'category', 'finish': 'time', 'start': 'time'}
+PREFIX_SCHEMA = {'prefix_id': 'category', 'e_v': 'category', 'start_time': 'time', 'resource': 'category',
+                 'track_id': 'category', 'event_name': 'category', 'finish_time': 'time', 'node1': 'int',
+                 'node2': 'int'}
+
+
+def encode_column(values, kind):
+    # restituisce (array numerico, dizionario o None)
+    if kind == 'time':
+        return to_epoch_us(values), None
+    if kind == 'int':
+        return pd.to_numeric(values).fillna(NULL_CODE).to_numpy(np.int64), None
+    codes, dictionary = pd.factorize(values.astype('string'))
+    return codes.astype(np.int32), np.asarray(dictionary, dtype=str)
+
+
+def write_table(frame, path, schema, chunk_rows=1000000):
+    # una cartella per tabella: meta.json, un dizionario .npy per colonna categorica e un .npy per colonna e chunk
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    columns = {}
+    meta = {'schema': schema, 'rows': len(frame), 'chunks': []}
+    for column, kind in schema.items():
+        values, dictionary = encode_column(frame[column], kind)
+        columns[column] = values
+        if dictionary is not None:
+            np.save(os.path.join(path, f'{column}.dict.npy'), dictionary)
+
+    for number, first in enumerate(range(0, max(len(frame), 1), chunk_rows)):
+        last = min(first + chunk_rows, len(frame))
+        chunk = {'rows': last - first, 'stats': {}}
+        for column, kind in schema.items():
+            values = columns[column][first:last]
+            np.save(os.path.join(path, f'chunk_{number:05d}.{column}.npy'), values)
+            # min/max per chunk per saltare i chunk che non possono soddisfare i filtri
+            if (column == 'track_id' or kind == 'time') and len(values):
+                valid = values[values != (NAT if kind == 'time' else NULL_CODE)]
+                if len(valid):
+                    chunk['stats'][column] = [int(valid.min()), int(valid.max())]
+        meta['chunks'].append(chunk)
+
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+
+
+class ColumnarTable:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            self.meta = json.load(file)
+        self.schema = self.meta['schema']
+        self.dictionaries = {column: np.load(os.path.join(path, f'{column}.dict.npy'), mmap_mode='r')
+                             for column, kind in self.schema.items() if kind == 'category'}
+        self.codes = {column: {value: code for code, value in enumerate(dictionary)}
+                      for column, dictionary in self.dictionaries.items() if column == 'track_id'}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def chunk_column(self, number, column):
+        return np.load(os.path.join(self.path, f'chunk_{number:05d}.{column}.npy'), mmap_mode='r')
+
+    def read_arrays(self, columns=None, track_ids=None, time_column=None, start=None, end=None):
+        # proiezione sulle colonne richieste e filtri su track_id e sull'intervallo [start, end] di time_column;
+        # senza filtri e con un solo chunk gli array restituiti sono direttamente i memmap dei file
+        columns = list(self.schema) if columns is None else list(columns)
+        track_codes = None
+        if track_ids is not None:
+            track_codes = np.array(sorted(self.codes['track_id'][str(track_id)] for track_id in track_ids
+                                          if str(track_id) in self.codes['track_id']), dtype=np.int32)
+        start = NAT + 1 if start is None else start
+        end = np.iinfo(np.int64).max if end is None else end
+
+        parts = {column: [] for column in columns}
+        for number, chunk in enumerate(self.meta['chunks']):
+            stats = chunk['stats']
+            if track_codes is not None and (len(track_codes) == 0 or 'track_id' not in stats or not np.any(
+                    (track_codes >= stats['track_id'][0]) & (track_codes <= stats['track_id'][1]))):
+                continue
+            if time_column is not None and (time_column not in stats or stats[time_column][1] < start
+                                            or stats[time_column][0] > end):
+                continue
+            mask = None
+            if track_codes is not None:
+                mask = np.isin(self.chunk_column(number, 'track_id'), track_codes)
+            if time_column is not None:
+                times = self.chunk_column(number, time_column)
+                time_mask = (times >= start) & (times <= end)
+                mask = time_mask if mask is None else mask & time_mask
+            for column in columns:
+                values = self.chunk_column(number, column)
+                parts[column].append(values if mask is None else values[mask])
+
+        arrays = {}
+        for column in columns:
+            if len(parts[column]) == 1:
+                arrays[column] = parts[column][0]
+            elif parts[column]:
+                arrays[column] = np.concatenate(parts[column])
+            else:
+                arrays[column] = np.empty(0, dtype=np.int64 if self.schema[column] != 'category' else np.int32)
+        return arrays
+
+    def take(self, rows, columns=None):
+        # righe per posizione (ordinate), lette solo dai chunk che le contengono
+        columns = list(self.schema) if columns is None else list(columns)
+        rows = np.asarray(rows, dtype=np.int64)
+        bounds = np.r_[0, np.cumsum([chunk['rows'] for chunk in self.meta['chunks']])]
+        parts = {column: [] for column in columns}
+        for number in np.unique(np.searchsorted(bounds, rows, side='right') - 1).tolist():
+            local = rows[(rows >= bounds[number]) & (rows < bounds[number + 1])] - bounds[number]
+            for column in columns:
+                parts[column].append(self.chunk_column(number, column)[local])
+        arrays = {column: np.concatenate(values) if values else
+                  np.empty(0, dtype=np.int64 if self.schema[column] != 'category' else np.int32)
+                  for column, values in parts.items()}
+        return self.to_frame(arrays)
+
+    def decode(self, column, codes):
+        # codici -> valori del dizionario, None per NULL_CODE
+        codes = np.asarray(codes)
+        values = np.asarray(self.dictionaries[column], dtype=object)[np.maximum(codes, 0)] if len(
+            self.dictionaries[column]) else np.full(len(codes), None, dtype=object)
+        values[codes == NULL_CODE] = None
+        return values
+
+    def read(self, columns=None, track_ids=None, time_column=None, start=None, end=None):
+        return self.to_frame(self.read_arrays(columns, track_ids, time_column, start, end))
+
+    def to_frame(self, arrays):
+        frame = {}
+        for column, values in arrays.items():
+            kind = self.schema[column]
+            if kind == 'category':
+                frame[column] = pd.Categorical.from_codes(values, categories=self.dictionaries[column])
+            elif kind == 'time':
+                frame[column] = from_epoch_us(values).array
+            else:
+                values = np.asarray(values)
+                frame[column] = pd.arrays.IntegerArray(values, values == NULL_CODE)
+        return pd.DataFrame(frame)
+
+
+def is_table(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def store_active_activities(csv_path='data/active_activities.csv', path='data/db/active_activities', **kwargs):
+    write_table(pd.read_csv(csv_path, dtype={'track_id': str}), path, ACTIVE_SCHEMA, **kwargs)
+
+
+def store_final_activities(csv_path='data/final_activities.csv', path='data/db/final_activities', **kwargs):
+    write_table(pd.read_csv(csv_path, dtype={'track_id': str}), path, FINAL_SCHEMA, **kwargs)
+
+
+def store_prefixes(csv_path='data/prefixes.csv', path='data/db/prefixes', **kwargs):
+    # le righe vuote e le righe XP diventano la colonna prefix_id
+    prefixes = pd.read_csv(csv_path, dtype=str)
+    prefixes = prefixes[prefixes['prefix_id'].notna()]
+    write_table(prefixes, path, PREFIX_SCHEMA, **kwargs)
+
+
+def prefixes_to_csv(table, csv_path):
+    # ricostruisce prefixes.csv inserendo la riga vuota e la riga XP prima di ogni prefix_id
+    prefixes = table.read()
+    prefix_codes = table.read_arrays(['prefix_id'])['prefix_id']
+    starts = np.flatnonzero(np.r_[True, prefix_codes[1:] != prefix_codes[:-1]]) if len(prefix_codes) else []
+    markers = pd.DataFrame({'e_v': np.tile([None, 'XP'], len(starts))})
+    markers['position'] = np.repeat(starts, 2)
+    markers['order'] = np.tile([0, 1], len(starts))
+    prefixes['position'] = np.arange(len(prefixes))
+    prefixes['order'] = 2
+    frame = pd.concat([markers, prefixes.astype({'e_v': object})], ignore_index=True)
+    frame = frame.sort_values(['position', 'order'], kind='stable')
+    frame[['e_v', 'start_time', 'resource', 'track_id', 'event_name', 'finish_time', 'node1', 'prefix_id',
+           'node2']].to_csv(csv_path, index=False)
+
+
+if __name__ == "__main__":
+    store_active_activities()
+    store_final_activities()
+    store_prefixes()
@@ -0,0 +1,252 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar_store import NULL_CODE, ColumnarTable, write_table
+from prefix_engine import load_cases
+from prefix_table import PrefixTableBuilder
+from timestamps import instant_to_epoch_us, to_epoch_us
+
+NO_RESOURCE = NULL_CODE
+
+# ogni grafo d'istanza è salvato una sola volta (nodi in ordine di activity_id, archi nell'ordine del .g);
+# il prefisso k di un caso è la vista "primi k nodi + archi tra questi + nodo k + 1 come etichetta".
+# Le righe nel formato di prefixes.csv si generano solo quando servono.
+# Su disco sono tre tabelle di columnar_store (cases, nodes, edges) più meta.json con max_k
+CASE_SCHEMA = {'track_id': 'category', 'nodes': 'int', 'edges': 'int'}
+NODE_SCHEMA = {'event_name': 'category', 'resource': 'category', 'start_time': 'time', 'finish_time': 'time'}
+EDGE_SCHEMA = {'node1': 'int', 'node2': 'int'}
+
+
+def encode(values, dictionary):
+    codes = []
+    for value in values:
+        if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+            codes.append(NO_RESOURCE)
+        else:
+            codes.append(dictionary.setdefault(value, len(dictionary)))
+    return codes
+
+
+def store_arrays(cases):
+    # cases: [(track_id, nodes[(start_time, resource, event_name, finish_time)], edges[(node1, node2)])]
+    event_names = {}
+    resources = {}
+    node_counts = np.array([len(nodes) for _, nodes, _ in cases], dtype=np.int64)
+    edge_counts = np.array([len(edges) for _, _, edges in cases], dtype=np.int64)
+    nodes = [node for _, case_nodes, _ in cases for node in case_nodes]
+    edges = [edge for _, _, case_edges in cases for edge in case_edges]
+    return {
+        'track_id': np.array([track_id for track_id, _, _ in cases], dtype=str),
+        'node_offsets': np.r_[0, np.cumsum(node_counts)].astype(np.int64),
+        'edge_offsets': np.r_[0, np.cumsum(edge_counts)].astype(np.int64),
+        'start_time': np.array([instant_to_epoch_us(node[0]) for node in nodes], dtype=np.int64),
+        'resource': np.array(encode([node[1] for node in nodes], resources), dtype=np.int32),
+        'event_name': np.array(encode([node[2] for node in nodes], event_names), dtype=np.int32),
+        'finish_time': np.array([instant_to_epoch_us(node[3]) for node in nodes], dtype=np.int64),
+        'node1': np.array([edge[0] for edge in edges], dtype=np.int32),
+        'node2': np.array([edge[1] for edge in edges], dtype=np.int32),
+        'event_names': np.array(list(event_names), dtype=str),
+        'resources': np.array(list(resources), dtype=str),
+    }
+
+
+def write_store(cases, path, max_k):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    # i dizionari di write_table seguono l'ordine di prima apparizione, come encode: stessi codici di store_arrays
+    nodes = [node for _, case_nodes, _ in cases for node in case_nodes]
+    edges = [edge for _, _, case_edges in cases for edge in case_edges]
+    write_table(pd.DataFrame({'track_id': [track_id for track_id, _, _ in cases],
+                              'nodes': [len(case_nodes) for _, case_nodes, _ in cases],
+                              'edges': [len(case_edges) for _, _, case_edges in cases]}, dtype=object),
+                os.path.join(path, 'cases'), CASE_SCHEMA)
+    write_table(pd.DataFrame({'event_name': [node[2] for node in nodes], 'resource': [node[1] for node in nodes],
+                              'start_time': np.array([instant_to_epoch_us(node[0]) for node in nodes], dtype=np.int64),
+                              'finish_time': np.array([instant_to_epoch_us(node[3]) for node in nodes],
+                                                      dtype=np.int64)}),
+                os.path.join(path, 'nodes'), NODE_SCHEMA)
+    write_table(pd.DataFrame({'node1': np.array([edge[0] for edge in edges], dtype=np.int64),
+                              'node2': np.array([edge[1] for edge in edges], dtype=np.int64)}),
+                os.path.join(path, 'edges'), EDGE_SCHEMA)
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump({'cases': len(cases), 'nodes': len(nodes), 'edges': len(edges), 'max_k': int(max_k)}, file)
+
+
+def load_store_arrays(path='data/db/prefix_store'):
+    # gli stessi array di store_arrays letti dalle tabelle (memmap dei file quando la tabella ha un solo chunk)
+    with open(os.path.join(path, 'meta.json'), 'r') as file:
+        max_k = json.load(file)['max_k']
+    cases, nodes, edges = (ColumnarTable(os.path.join(path, name)) for name in ('cases', 'nodes', 'edges'))
+    case_arrays, node_arrays, edge_arrays = cases.read_arrays(), nodes.read_arrays(), edges.read_arrays()
+    arrays = {
+        'track_id': np.asarray(cases.dictionaries['track_id'])[case_arrays['track_id']],
+        'node_offsets': np.r_[0, np.cumsum(case_arrays['nodes'])].astype(np.int64),
+        'edge_offsets': np.r_[0, np.cumsum(case_arrays['edges'])].astype(np.int64),
+        'event_names': nodes.dictionaries['event_name'],
+        'resources': nodes.dictionaries['resource'],
+    }
+    arrays.update({column: node_arrays[column] for column in NODE_SCHEMA})
+    arrays.update({column: edge_arrays[column] for column in EDGE_SCHEMA})
+    return arrays, max_k
+
+
+def build_store(graphs_path='data/graphs.g', log_path='data/prefixes/prefix_log_100.csv', path='data/db/prefix_store',
+                max_len=None):
+    # stessi casi e stesso max_len di prefix_engine.generate_prefixes
+    start = time.time()
+    cases = load_cases(graphs_path, log_path)
+    if max_len is None:
+        max_len = max((len(nodes) for _, nodes, _ in cases), default=0)
+    write_store(cases, path, max(max_len - 2, 0))
+    print(f"Prefix store of {len(cases)} cases: {time.time() - start:.6f} seconds")
+
+
+def store_from_prefixes_csv(csv_path='data/prefixes.csv', path='data/db/prefix_store'):
+    # il prefisso più lungo di ogni caso contiene tutti i nodi e gli archi usati dagli altri prefissi
+    prefixes = pd.read_csv(csv_path, dtype=str)
+    prefixes = prefixes[prefixes['prefix_id'].notna()]
+    k = prefixes['prefix_id'].str.rsplit('_', n=1).str[1].astype(int)
+    track_ids = prefixes['prefix_id'].str.rsplit('_', n=1).str[0]
+    longest = k == k.groupby(track_ids).transform('max')
+    # i casi restano nell'ordine in cui compaiono in prefixes.csv
+    order = {track_id: position for position, track_id in enumerate(pd.unique(track_ids))}
+    prefixes = prefixes[longest]
+    starts = pd.Series(to_epoch_us(prefixes['start_time']), index=prefixes.index)
+    finishes = pd.Series(to_epoch_us(prefixes['finish_time']), index=prefixes.index)
+
+    cases = []
+    for track_id, rows in prefixes.groupby(track_ids[longest], sort=False):
+        vertices = rows[rows['e_v'] != 'e'].sort_values('node1', key=lambda column: column.astype(int))
+        nodes = [(starts[row], resource, event_name, finishes[row]) for row, resource, event_name in
+                 zip(vertices.index, vertices['resource'], vertices['event_name'])]
+        edges = [(int(node1), int(node2)) for node1, node2 in rows.loc[rows['e_v'] == 'e', ['node1', 'node2']]
+                 .itertuples(index=False, name=None)]
+        cases.append((track_id, nodes, edges))
+    cases.sort(key=lambda case: order[case[0]])
+    write_store(cases, path, k.max() if len(k) else 0)
+
+
+class PrefixView:
+    # il prefisso k del caso case: nessuna riga materializzata finché non si chiede write/to_frame
+    __slots__ = ('store', 'case', 'k')
+
+    def __init__(self, store, case, k):
+        self.store = store
+        self.case = case
+        self.k = k
+
+    @property
+    def track_id(self):
+        return str(self.store.track_ids[self.case])
+
+    @property
+    def prefix_id(self):
+        return self.track_id + "_" + str(self.k)
+
+    def nodes(self):
+        # (activity_id, event_name, start_time, finish_time, resource) dei nodi 1..k
+        first = self.store.node_offsets[self.case]
+        return [self.store.node(first + position, position + 1) for position in range(self.k)]
+
+    def label(self):
+        return self.store.node(self.store.node_offsets[self.case] + self.k, self.k + 1)
+
+    def edges(self):
+        first, last = self.store.edge_offsets[self.case], self.store.edge_offsets[self.case + 1]
+        node1 = self.store.node1[first:last]
+        node2 = self.store.node2[first:last]
+        inside = np.maximum(node1, node2) <= self.k
+        return list(zip(node1[inside].tolist(), node2[inside].tolist()))
+
+    def write(self, builder):
+        builder.add_prefix(self.track_id, self.k, self.nodes(), self.edges(), self.label())
+
+    def to_frame(self):
+        builder = PrefixTableBuilder()
+        self.write(builder)
+        return builder.to_frame()
+
+
+class CompactPrefixStore:
+
+    def __init__(self, path='data/db/prefix_store'):
+        self.path = path
+        arrays, self.max_k = load_store_arrays(path)
+        self.track_ids = arrays['track_id']
+        self.node_offsets = arrays['node_offsets']
+        self.edge_offsets = arrays['edge_offsets']
+        self.start_time = arrays['start_time']
+        self.finish_time = arrays['finish_time']
+        self.event_code = arrays['event_name']
+        self.resource_code = arrays['resource']
+        self.node1 = arrays['node1']
+        self.node2 = arrays['node2']
+        self.event_names = arrays['event_names']
+        self.resources = arrays['resources']
+        self.cases = {str(track_id): case for case, track_id in enumerate(self.track_ids)}
+        # numero di prefissi di ogni caso: k = 1 .. min(n - 1, max_k)
+        self.prefix_counts = np.minimum(np.diff(self.node_offsets) - 1, self.max_k).clip(min=0)
+
+    def __len__(self):
+        return int(self.prefix_counts.sum())
+
+    def node(self, position, activity_id):
+        resource = self.resource_code[position]
+        return (activity_id, str(self.event_names[self.event_code[position]]), int(self.start_time[position]),
+                int(self.finish_time[position]), None if resource == NO_RESOURCE else str(self.resources[resource]))
+
+    def __iter__(self):
+        # stesso ordine di prefixes.csv: per lunghezza k, poi per caso
+        for k in range(1, self.max_k + 1):
+            for case in np.flatnonzero(self.prefix_counts >= k):
+                yield PrefixView(self, int(case), k)
+
+    def __contains__(self, prefix_id):
+        return self.view(prefix_id) is not None
+
+    def view(self, prefix_id):
+        track_id, _, k = str(prefix_id).rpartition('_')
+        case = self.cases.get(track_id)
+        if case is None or not k.isdigit() or not 1 <= int(k) <= self.prefix_counts[case]:
+            return None
+        return PrefixView(self, case, int(k))
+
+    def __getitem__(self, prefix_id):
+        view = self.view(prefix_id)
+        if view is None:
+            raise KeyError(prefix_id)
+        return view
+
+    def to_frame(self, prefix_ids):
+        # righe dei prefissi richiesti, nel formato di prefixes.csv
+        builder = PrefixTableBuilder()
+        for prefix_id in prefix_ids:
+            self[prefix_id].write(builder)
+        return builder.to_frame()
+
+    def export_csv(self, output_path='data/prefixes.csv', chunk_size=100000):
+        start = time.time()
+        builder = PrefixTableBuilder(output_path, chunk_size)
+        for view in self:
+            view.write(builder)
+        builder.close()
+        print(f"Export of {len(self)} prefixes: {time.time() - start:.6f} seconds")
+        return builder.rows_written
+
+
+def disk_usage(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, file)) for folder, _, files in os.walk(path) for file in files)
+
+
+if __name__ == "__main__":
+    build_store()
+    print(f"prefixes.csv: {disk_usage('data/prefixes.csv')} bytes, "
+          f"prefix store: {disk_usage('data/db/prefix_store')} bytes")
@@ -1,8 +1,15 @@
+import json
+
 import matplotlib.pyplot as plt
+import pandas as pd
 
-def plot2d():
-    y = [2.988961, 7.877312, 21.569412, 128.600391, 498.800449, 1555.826346]
-    x = [223, 2385, 4859, 12409, 23902, 46452]
+def plot2d(summary_path='data/output_files/benchmark/summary.csv', path='neo4j', stage='import'):
+    # tempi p50 misurati da benchmark.py sui log prefix_log_*.csv
+    summary = pd.read_csv(summary_path)
+    summary = summary[(summary['path'] == path) & (summary['stage'] == stage) &
+                      summary['dataset'].str.match(r'prefix_log_\d+$')].sort_values('events')
+    y = summary['p50_s'].tolist()
+    x = summary['events'].tolist()
 
     plt.plot(x, y, label='Tempo di Caricamento in funzione del numero di nodi')
 
@@ -38,6 +45,19 @@ def plot_data(cpu_values, memory_values, prova, file):
     plt.tight_layout()
     plt.savefig("data/output_files/cpu_monitor/"+file + ", prova: " + str(prova))
 
+def plot_metrics(path='data/output_files/metrics.jsonl', process='neo4j'):
+    # stessi grafici a partire dai campioni JSONL di instrumentation.py, uno per stadio
+    samples = {}
+    with open(path, "r") as metrics:
+        for record in map(json.loads, metrics):
+            if record.get('type') == 'sample' and record['process'] == process:
+                values = samples.setdefault(record['stage'], ([], []))
+                values[0].append(record['cpu_percent'])
+                values[1].append(record['rss_mb'])
+    for prova, (stage_name, (cpu_values, memory_values)) in enumerate(samples.items(), start=1):
+        plot_data(cpu_values, memory_values, prova, stage_name)
+
+
 file_name = "memory_cpu_opt_4G"
 file = "memory_cpu_opt_4G.txt"
 # Reading data from file and plotting for each "Prova"
@@ -0,0 +1,103 @@
+import numpy as np
+
+from graph_reader import EventNames, read_graphs
+from timestamps import US_PER_MINUTE
+
+
+class CaseGraphs:
+    # tutti i grafi d'istanza in formato CSR: array globali dei nodi e degli archi, offset per caso.
+    # Dentro ogni caso gli archi sono ordinati per max(node1, node2), così gli archi del prefisso k sono
+    # la fetta iniziale [edge_offsets[c], edge_offsets[c] + numero di archi con max <= k)
+
+    def __init__(self, graphs, event_names=None):
+        self.event_names = EventNames() if event_names is None else event_names
+        track_ids = []
+        node_counts = []
+        edge_counts = []
+        activity_id, event_code, finish, utc_offset, edges = [], [], [], [], []
+        for graph in graphs:
+            # i codici evento del grafo vanno riportati sul dizionario condiviso
+            codes = np.array([self.event_names.encode(name) for name in graph.event_names.names], dtype=np.int32)
+            track_ids.append(graph.track_id)
+            node_counts.append(len(graph))
+            edge_counts.append(len(graph.edges) // 2)
+            activity_id.append(np.frombuffer(graph.activity_id, dtype=np.int32))
+            event_code.append(codes[np.frombuffer(graph.event_code, dtype=np.int32)] if len(graph) else
+                              np.empty(0, dtype=np.int32))
+            finish.append(np.frombuffer(graph.finish, dtype=np.int64))
+            utc_offset.append(np.frombuffer(graph.utc_offset, dtype=np.int16))
+            edges.append(np.frombuffer(graph.edges, dtype=np.int32).reshape(-1, 2))
+
+        concat = lambda parts, dtype: np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype=dtype)
+        self.track_ids = np.array(track_ids, dtype=object)
+        self.node_offsets = np.r_[0, np.cumsum(node_counts, dtype=np.int64)]
+        self.edge_offsets = np.r_[0, np.cumsum(edge_counts, dtype=np.int64)]
+        self.activity_id = concat(activity_id, np.int64)
+        self.event_code = concat(event_code, np.int32)
+        self.finish = concat(finish, np.int64)
+        self.utc_offset = concat(utc_offset, np.int64)
+        pairs = np.concatenate(edges) if edges else np.empty((0, 2), dtype=np.int32)
+
+        # ordinamento stabile per (caso, max(node1, node2)); edge_rank conserva l'ordine del file .g
+        case_of_edge = np.repeat(np.arange(len(track_ids)), edge_counts)
+        edge_max = np.maximum(pairs[:, 0], pairs[:, 1]).astype(np.int64)
+        order = np.lexsort((edge_max, case_of_edge))
+        self.node1 = pairs[order, 0].astype(np.int64)
+        self.node2 = pairs[order, 1].astype(np.int64)
+        self.edge_max = edge_max[order]
+        self.edge_rank = (np.arange(len(pairs)) - np.repeat(self.edge_offsets[:-1], edge_counts))[order]
+
+        # chiavi ordinate (caso, activity_id) -> posizione globale del nodo, e (caso, max) per i prefissi
+        self.key_base = int(max(self.activity_id.max(initial=0), self.edge_max.max(initial=0))) + 1
+        case_of_node = np.repeat(np.arange(len(track_ids)), node_counts)
+        node_keys = case_of_node * self.key_base + self.activity_id
+        self.node_order = np.argsort(node_keys, kind='stable')
+        self.node_keys = node_keys[self.node_order]
+        self.case_of_edge = case_of_edge[order] if len(pairs) else case_of_edge
+        self.edge_keys = self.case_of_edge * self.key_base + self.edge_max
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def node_positions(self, cases, activity_ids):
+        # posizione negli array globali del nodo activity_id del caso; -1 se non esiste
+        keys = np.asarray(cases, dtype=np.int64) * self.key_base + np.asarray(activity_ids, dtype=np.int64)
+        found = np.searchsorted(self.node_keys, keys)
+        found = np.minimum(found, max(len(self.node_keys) - 1, 0))
+        valid = (len(self.node_keys) > 0) & (self.node_keys[found] == keys)
+        return np.where(valid, self.node_order[found], -1)
+
+    def local_finish(self):
+        # orario locale del file .g (offset non applicato), in microsecondi
+        return self.finish + self.utc_offset * US_PER_MINUTE
+
+    def prefix_edge_counts(self, k):
+        # numero di archi del prefisso k per tutti i casi, con una sola searchsorted
+        cases = np.arange(len(self))
+        last = np.searchsorted(self.edge_keys, cases * self.key_base + k, side='right')
+        # con k >= key_base la chiave supera il blocco del caso: si resta dentro i suoi archi
+        last = np.minimum(last, self.edge_offsets[1:])
+        return np.maximum(last - self.edge_offsets[:-1], 0)
+
+    def prefix_edges(self, case, k):
+        # archi (node1, node2) del prefisso k nell'ordine del file .g
+        first = self.edge_offsets[case]
+        last = min(np.searchsorted(self.edge_keys, case * self.key_base + k, side='right'),
+                   self.edge_offsets[case + 1])
+        rows = np.arange(first, max(first, last))
+        rows = rows[np.argsort(self.edge_rank[rows], kind='stable')]
+        return list(zip(self.node1[rows].tolist(), self.node2[rows].tolist()))
+
+    def out_degree(self):
+        sources = self.node_positions(self.case_of_edge, self.node1)
+        return np.bincount(sources[sources >= 0], minlength=len(self.activity_id))
+
+    def parallel_edges(self):
+        # archi che partono da un nodo con più di un successore (attività parallele)
+        sources = self.node_positions(self.case_of_edge, self.node1)
+        degree = self.out_degree()
+        return (sources >= 0) & (degree[np.maximum(sources, 0)] > 1)
+
+
+def read_case_graphs(graphs_path='data/graphs.g'):
+    return CaseGraphs(read_graphs(graphs_path))
@@ -0,0 +1,136 @@
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+
+from graph_reader import EventNames, parse_graph
+
+INDEX_COLUMNS = ['offset', 'length', 'track_id', 'nodes', 'edges']
+
+
+def build_index(graphs_path):
+    # una sola scansione del file: offset in byte, case id e numero di nodi/archi di ogni blocco XP
+    entries = []
+    offset = 0
+    current = None
+    with open(graphs_path, 'rb') as file:
+        for line in file:
+            if line.startswith(b'XP'):
+                if current is not None:
+                    current[1] = offset - current[0]
+                    entries.append(current)
+                current = [offset, 0, None, 0, 0]
+            elif current is not None and line.startswith(b'v'):
+                current[2] = line.split()[4].decode()
+                current[3] += 1
+            elif current is not None and line.startswith(b'e'):
+                current[4] += 1
+            offset += len(line)
+    if current is not None:
+        current[1] = offset - current[0]
+        entries.append(current)
+    return pd.DataFrame(entries, columns=INDEX_COLUMNS).astype({'track_id': str})
+
+
+class GraphIndex:
+
+    def __init__(self, graphs_path='data/graphs.g', index_path=None):
+        self.graphs_path = graphs_path
+        self.index_path = index_path if index_path is not None else graphs_path + '.idx'
+        self.entries = self.load_or_build()
+        self.positions = {track_id: position for position, track_id in enumerate(self.entries['track_id'])}
+        self.offsets = self.entries['offset'].to_numpy()
+        self.lengths = self.entries['length'].to_numpy()
+        self.file = open(self.graphs_path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(graphs_path) else b''
+
+    def load_or_build(self):
+        size = os.path.getsize(self.graphs_path)
+        if (os.path.exists(self.index_path)
+                and os.path.getmtime(self.index_path) >= os.path.getmtime(self.graphs_path)):
+            entries = pd.read_csv(self.index_path, dtype={'track_id': str})
+            # l'indice è valido solo se copre esattamente il file attuale
+            if len(entries) == 0 or entries['offset'].iloc[-1] + entries['length'].iloc[-1] == size:
+                return entries
+        entries = build_index(self.graphs_path)
+        entries.to_csv(self.index_path, index=False)
+        return entries
+
+    def close(self):
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def position(self, track_id):
+        return self.positions[str(track_id)]
+
+    def positions_of(self, track_ids):
+        return sorted(self.positions[str(track_id)] for track_id in track_ids if str(track_id) in self.positions)
+
+    def read_bytes(self, start=0, stop=None):
+        # i blocchi sono contigui: un intervallo di grafi è un'unica fetta del file mappato
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return b''
+        return self.mmap[self.offsets[start]:self.offsets[stop - 1] + self.lengths[stop - 1]]
+
+    def read_graph_bytes(self, position):
+        return self.mmap[self.offsets[position]:self.offsets[position] + self.lengths[position]]
+
+    def graph(self, position, event_names=None):
+        event_names = EventNames() if event_names is None else event_names
+        return parse_graph(self.read_graph_bytes(position).decode().splitlines(), event_names)
+
+    def graphs(self, start=0, stop=None, event_names=None):
+        event_names = EventNames() if event_names is None else event_names
+        stop = len(self) if stop is None else min(stop, len(self))
+        for position in range(start, stop):
+            yield self.graph(position, event_names)
+
+    def select(self, track_ids, event_names=None):
+        event_names = EventNames() if event_names is None else event_names
+        for position in self.positions_of(track_ids):
+            yield self.graph(position, event_names)
+
+    def spans(self, positions):
+        # (offset, length) dei grafi nelle posizioni date, da passare ai worker al posto dell'indice
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.offsets[positions], self.lengths[positions]
+
+    def write_slice(self, target, start=0, stop=None):
+        with open(target, 'wb') as file:
+            file.write(self.read_bytes(start, stop))
+
+    def write_fraction(self, target, fraction):
+        # stesso criterio di get_some_prefixes_percentual: i primi int(n * fraction) grafi
+        self.write_slice(target, 0, int(len(self) * fraction))
+
+    def write_cases(self, target, track_ids):
+        with open(target, 'wb') as file:
+            for position in self.positions_of(track_ids):
+                file.write(self.read_graph_bytes(position))
+
+
+def read_spans(graphs_path, spans, event_names=None):
+    # grafi dati i loro (offset, length) nel .g: una sola lettura dell'intervallo che li contiene, senza aprire
+    # né ricostruire il file .idx
+    offsets, lengths = spans
+    event_names = EventNames() if event_names is None else event_names
+    if len(offsets) == 0:
+        return []
+    first = int(offsets.min())
+    with open(graphs_path, 'rb') as file:
+        file.seek(first)
+        data = file.read(int((offsets + lengths).max()) - first)
+    return [parse_graph(data[offset - first:offset - first + length].decode().splitlines(), event_names)
+            for offset, length in zip(offsets.tolist(), lengths.tolist())]
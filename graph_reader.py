@@ -0,0 +1,121 @@
+from array import array
+
+from timestamps import US_PER_MINUTE, parse_timestamp
+
+
+class EventNames:
+    # dizionario condiviso tra i grafi: nome evento <-> codice intero
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def encode(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def decode(self, code):
+        return self.names[code]
+
+
+class InstanceGraph:
+    # one XP block: node columns in arrays, edges as a flat int array [node1, node2, node1, node2, ...]
+    __slots__ = ('track_id', 'activity_id', 'event_code', 'finish', 'utc_offset', 'edges', 'event_names')
+
+    def __init__(self, event_names, track_id=None):
+        self.track_id = track_id
+        self.activity_id = array('i')
+        self.event_code = array('i')
+        self.finish = array('q')
+        self.utc_offset = array('h')
+        self.edges = array('i')
+        self.event_names = event_names
+
+    def __len__(self):
+        return len(self.activity_id)
+
+    def add_vertex(self, activity_id, event_name, finish, track_id):
+        # '2011-10-0108:11:07.866000+02:00' -> microsecondi UTC e offset in minuti
+        finish, utc_offset = parse_timestamp(finish)
+        self.track_id = track_id
+        self.activity_id.append(activity_id)
+        self.event_code.append(self.event_names.encode(event_name))
+        self.finish.append(finish)
+        self.utc_offset.append(utc_offset)
+
+    def add_edge(self, node1, node2):
+        self.edges.append(node1)
+        self.edges.append(node2)
+
+    def event_name(self, position):
+        return self.event_names.decode(self.event_code[position])
+
+    def local_finish(self, position):
+        # wall-clock time of the .g file (offset not applied), still in microseconds
+        return self.finish[position] + self.utc_offset[position] * US_PER_MINUTE
+
+    def vertices(self):
+        for position in range(len(self)):
+            yield self.activity_id[position], self.event_name(position), self.finish[position]
+
+    def edge_pairs(self):
+        return zip(self.edges[0::2], self.edges[1::2])
+
+    def reachable_from(self, activity_id):
+        # attività raggiungibili da activity_id con almeno un arco, ognuna una sola volta (visita in ampiezza)
+        successors = {}
+        for node1, node2 in self.edge_pairs():
+            successors.setdefault(node1, []).append(node2)
+        reached = []
+        seen = set()
+        frontier = [activity_id]
+        for node in frontier:
+            for successor in successors.get(node, []):
+                if successor not in seen:
+                    seen.add(successor)
+                    reached.append(successor)
+                    frontier.append(successor)
+        return reached
+
+    def edge_label(self, node1, node2):
+        # nei file .g l'etichetta dell'arco è sempre <nome nodo1>__<nome nodo2>
+        return self.event_name(node1 - 1) + "__" + self.event_name(node2 - 1)
+
+
+def read_graph_blocks(graphs_path):
+    # raw lines of one XP block at a time, XP line included
+    block = []
+    with open(graphs_path, 'r') as file:
+        for line in file:
+            if line.startswith('XP') and block:
+                yield block
+                block = []
+            block.append(line)
+    if block:
+        yield block
+
+
+def parse_graph(lines, event_names):
+    graph = InstanceGraph(event_names)
+    for line in lines:
+        if line.startswith('v'):
+            parts = line.split()
+            graph.add_vertex(int(parts[1]), parts[2], parts[3], parts[4])
+        elif line.startswith('e'):
+            parts = line.split()
+            graph.add_edge(int(parts[1]), int(parts[2]))
+    return graph
+
+
+def read_graphs(graphs_path='data/graphs.g', event_names=None):
+    event_names = EventNames() if event_names is None else event_names
+    for block in read_graph_blocks(graphs_path):
+        graph = parse_graph(block, event_names)
+        if len(graph):
+            yield graph
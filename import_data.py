@@ -3,18 +3,15 @@ import re
 import time
 
 import neo4j
-import psutil
-import threading
 
 import pandas as pd
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 
-if os.path.exists('data\output_files\memory_cpu.txt'):
-    os.remove('data\output_files\memory_cpu.txt')
-
-pid = 22188
-print(pid)
+from graph_index import GraphIndex
+from instrumentation import ResourceSampler, instrumented
+from log_partitioner import split_cumulative, split_fixed
+from neo4j_loader import Neo4jBulkLoader
 
 class ActiveCaseGeneration:
 
@@ -28,6 +25,7 @@ class ActiveCaseGeneration:
     def close(self):
         self.driver.close()
 
+    @instrumented('prefix')
     def create_prefixes(self, stop_event):
         start = time.time()
         max_len = self.driver.execute_query("MATCH (n:Event) RETURN max(n.activity_id) AS max_activity_id")[0][0][0]
@@ -50,7 +48,8 @@ class ActiveCaseGeneration:
         print(f"Time for prefix generation: {finish - start:.6f} seconds")
         return result
 
-    def import_data(self, stop_event):
+    # il record dello stadio import lo scrive Neo4jBulkLoader.load_events, uno per file
+    def import_data(self, stop_event, batch_size=5000):
         start_time = time.time()
         output_dir = 'data/output_files/500'
 
@@ -60,20 +59,10 @@ class ActiveCaseGeneration:
         )
         first_files = files[:2]
 
+        loader = Neo4jBulkLoader(self.driver, batch_size=batch_size)
         for file in first_files:
-            file_num = re.findall(r'\d+', file)[0]
-            file_path = f"file:///filtered_prefix_log_{file_num}_500.csv"
-
             start_time_file = time.time()
-            result = self.driver.execute_query(
-                f"LOAD CSV FROM '{file_path}' "
-                "AS row MERGE (:Event{activity_id:toInteger(row[0]), "
-                "event_name:row[1], track_id:row[2], "
-                "start_time:datetime(apoc.text.replace(apoc.text.replace(row[3], '\+\d{2}:\d{2}$', ''), ' ', 'T')), "
-                "finish_time:datetime(apoc.text.replace(apoc.text.replace(row[4], '\+\d{2}:\d{2}$', ''), ' ', 'T')), "
-                "resource:row[5]}) ",
-                database_="neo4j",
-            )
+            result = loader.load_events(os.path.join(output_dir, file))
             end_time_file = time.time()
             stop_event.set()
             elapsed_time = end_time_file - start_time_file
@@ -85,6 +74,7 @@ class ActiveCaseGeneration:
 
         return result
 
+    @instrumented('prefix')
     def create_prefixes(self, stop_event):
         start = time.time()
         prefixes = pd.DataFrame()
@@ -110,79 +100,21 @@ class ActiveCaseGeneration:
         return result
 
 
-def get_some_prefixes():
-    df = pd.read_csv('data/prefixes/prefix_log.csv', header=None)
-    df.columns = ['Index', 'Event', 'Case_ID', 'Start', 'Finish', 'Resource']
-
-    output_dir = 'data/output_files/1000'
-    os.makedirs(output_dir, exist_ok=True)
-
-    unique_case_ids = df['Case_ID'].unique()
-
-    for i in range(0, len(unique_case_ids), 1000):
-        case_ids_group = unique_case_ids[i:i + 1000]
-        filtered_df = df[df['Case_ID'].isin(case_ids_group)]
-
-        output_file = os.path.join(output_dir, f'filtered_prefix_log_{i // 1000 + 1}_1000.csv')
-        filtered_df.to_csv(output_file, index=False, header=False)
-
+def get_some_prefixes(log_path='data/prefixes/prefix_log.csv', output_dir='data/output_files/1000',
+                      cases_per_file=1000):
+    # una sola lettura del log: ogni riga va direttamente nel file del suo gruppo di casi
+    for output_file in split_fixed(log_path, output_dir, cases_per_file):
         print(f'Saved {output_file}')
 
 
-def get_some_prefixes_percentual():
-    df = pd.read_csv('data/prefixes/prefix_log.csv', header=None)
-    df.columns = ['Index', 'Event', 'Case_ID', 'Start', 'Finish', 'Resource']
-
-    output_dir = 'data/output_files'
-    os.makedirs(output_dir, exist_ok=True)
-
-    unique_case_ids = df['Case_ID'].unique()
-
-    total_case_ids = len(unique_case_ids)
-
-    log_file_path = os.path.join(output_dir, 'summary_log.txt')
-    with open(log_file_path, 'w') as log_file:
-        log_file.write(f'Filtered files info\n\n')
-
-    for i in range(1, 11):
-        percentage = i * 0.1  # Percentage of case_ids to include, from 10% to 100%
-        end_index = int(total_case_ids * percentage)
-
-        case_ids_group = unique_case_ids[:end_index]
-
-        filtered_df = df[df['Case_ID'].isin(case_ids_group)]
+def get_some_prefixes_percentual(log_path='data/prefixes/prefix_log.csv', output_dir='data/output_files'):
+    split_cumulative(log_path, output_dir, summary_path=os.path.join(output_dir, 'summary_log.txt'))
 
-        num_nodes = len(filtered_df)
-        avg_nodes_for_case = num_nodes / end_index
 
-        output_file = os.path.join(output_dir, f'filtered_prefix_log_{i * 10}percent.csv')
-        filtered_df.to_csv(output_file, index=False, header=False)
-
-        # Monitoring RAM and CPU usage
-        process = psutil.Process(os.getpid())
-        memory_usage = process.memory_info().rss / 1024 / 1024  # Conversione in MB
-        cpu_usage = psutil.cpu_percent(interval=1)
-
-        with open(log_file_path, 'a') as log_file:
-            log_file.write(f'File: filtered_prefix_log_{i * 10}percent.csv\n'
-                           f'Number of graphs: {end_index}\n'
-                           f'Number of nodes: {num_nodes}\n'
-                           f'Average number of nodes: {avg_nodes_for_case:.2f}\n'
-                           f'Memory usage: {memory_usage:.2f} MB, CPU usage: {cpu_usage:.2f}%\n\n')
-
-
-def trim_file_until_xp():
-    target_count = 201
-    xp_count = 0
-    trimmed_lines = []
-    with open("BPI12_with_SE_instance_graphs.g", 'r') as file:
-        for line in file:
-            trimmed_lines.append(line)
-            if "XP" in line:
-                xp_count += 1
-                if xp_count == target_count:
-                    break
-    return trimmed_lines
+def trim_file_until_xp(source="BPI12_with_SE_instance_graphs.g", target="timmed_200", target_count=200):
+    # l'indice (source + '.idx') si costruisce una volta sola, poi il taglio è una copia di byte
+    with GraphIndex(source) as index:
+        index.write_slice(target, 0, target_count)
 
 
 
@@ -197,22 +129,14 @@ def get_first_n_prefixes():
 
 
 # Define a function to monitor CPU and memory usage
-def monitor_resources(stop_event, interval=1):
-    process = psutil.Process(pid)
-    cpu_usage = []
-    memory_usage = []
-
-    while not stop_event.is_set():
-        cpu = process.cpu_percent(interval=interval)
-        memory = process.memory_info().rss / (1024 ** 2)  # Convert to MB
-        cpu_usage.append(cpu)
-        memory_usage.append(memory)
-
-        file_path = 'data\output_files\memory_cpu.txt'
-        with open(file_path, 'a') as log_file:
-            log_file.write(f"CPU: {cpu}% | Memory: {memory:.2f} MB\n")
-        print(f"CPU: {cpu}% | Memory: {memory:.2f} MB")
-    return cpu_usage, memory_usage
+def monitor_resources(stop_event, interval=1, stage_name='import'):
+    # server Neo4j trovato per porta/nome invece del pid fisso; i campioni finiscono in metrics.jsonl
+    sampler = ResourceSampler(stage_name, interval)
+    while not stop_event.wait(interval):
+        sampler.sample()
+    sampler.sample()
+    samples = sampler.samples.get('neo4j', sampler.samples['python'])
+    return samples['cpu_percent'], samples['rss_mb']
 
 
 if __name__ == "__main__":
@@ -243,7 +167,4 @@ if __name__ == "__main__":
     # get_first_n_prefixes()
     # get_some_prefixes()
 
-    trimmed_content = trim_file_until_xp()
-    with open("timmed_200", 'w') as file:
-        for line in trimmed_content:
-            file.write(line)
+    trim_file_until_xp()
@@ -0,0 +1,128 @@
+import os
+import time
+from bisect import insort
+
+import numpy as np
+import pandas as pd
+
+from graph_reader import read_graphs
+from instrumentation import instrumented
+from prefix_engine import LOG_COLUMNS, case_node, load_cases, parse_log_times
+from prefix_table import PrefixTableBuilder
+from timestamps import US_PER_MINUTE, from_epoch_us, instant_to_epoch_us, parse_timestamp
+
+ACTIVE_COLUMNS = ['track_id', 'index', 'start_time_prefix', 'finish_time_last_activity']
+FINAL_COLUMNS = ['track_id', 'index', 'event_name', 'finish', 'start']
+TIME_COLUMNS = ['start_time_prefix', 'finish_time_last_activity', 'finish', 'start']
+
+
+def parse_log_time(value):
+    # stesso trattamento di parse_log_times per un singolo valore: intero in microsecondi, ora locale come UTC
+    if isinstance(value, str):
+        utc, offset = parse_timestamp(value)
+        return utc + offset * US_PER_MINUTE
+    return instant_to_epoch_us(value)
+
+
+def graph_predecessors(graphs_path, track_ids=None):
+    # (track_id, node2) -> [node1] dagli archi del .g, nell'ordine del file
+    predecessors = {}
+    for graph in read_graphs(graphs_path):
+        if track_ids is not None and graph.track_id not in track_ids:
+            continue
+        for node1, node2 in graph.edge_pairs():
+            predecessors.setdefault((graph.track_id, int(node2)), []).append(int(node1))
+    return predecessors
+
+
+class CaseState:
+    __slots__ = ('nodes', 'edges')
+
+    def __init__(self, nodes=None, edges=None):
+        # nodes: [(start_time, resource, event_name, finish_time)] in ordine di activity_id
+        self.nodes = [] if nodes is None else nodes
+        self.edges = [] if edges is None else edges
+
+
+class IncrementalPrefixGenerator:
+    # mantiene DBp, DBs e DBf aggiornati evento per evento: ogni evento tocca solo il grafo del proprio caso
+
+    def __init__(self, prefixes_path='data/prefixes.csv', active_path='data/active_activities.csv',
+                 final_path='data/final_activities.csv', flush_every=1000):
+        self.cases = {}
+        self.prefixes = PrefixTableBuilder(prefixes_path, chunk_size=flush_every * 100, append=True)
+        self.active_path = active_path
+        self.final_path = final_path
+        self.flush_every = flush_every
+        self.active_rows = []
+        self.final_rows = []
+
+    def load_cases(self, graphs_path='data/graphs.g', log_path='data/prefixes/prefix_log_100.csv'):
+        # riparte dallo stato già presente nei file (grafi + proprietà dei nodi)
+        for track_id, nodes, edges in load_cases(graphs_path, log_path):
+            self.cases[track_id] = CaseState(nodes, edges)
+
+    def add_event(self, activity_id, event_name, track_id, start_time, finish_time, resource, predecessors):
+        # predecessors: nodi da cui parte un arco verso il nuovo evento, come le righe 'e' del .g. Obbligatori: con
+        # l'evento precedente come unico predecessore i casi con attività parallele diventerebbero catene
+        track_id = str(track_id)
+        activity_id = int(activity_id)
+        case = self.cases.setdefault(track_id, CaseState())
+        if activity_id != len(case.nodes) + 1:
+            raise ValueError(f"event {activity_id} of case {track_id} is out of order: "
+                             f"expected {len(case.nodes) + 1}")
+
+        start_time = parse_log_time(start_time)
+        finish_time = parse_log_time(finish_time)
+        case.nodes.append((start_time, resource, event_name, finish_time))
+        # archi ordinati per (node1, node2) come nei file .g
+        for node in predecessors:
+            insort(case.edges, (int(node), activity_id))
+
+        # DBs e DBf: una riga nuova per il caso, le altre restano valide
+        first_finish = case.nodes[0][3]
+        previous_finish = case.nodes[-2][3] if activity_id > 1 else finish_time
+        self.active_rows.append((track_id, activity_id, first_finish, finish_time))
+        self.final_rows.append((track_id, activity_id, event_name, finish_time, previous_finish))
+
+        prefix_id = self.emit_prefix(track_id, case, activity_id - 1) if activity_id > 1 else None
+        if len(self.active_rows) >= self.flush_every:
+            self.flush()
+        return prefix_id
+
+    def emit_prefix(self, track_id, case, k):
+        # il prefisso k diventa completo quando arriva la sua etichetta, l'attività k + 1
+        return self.prefixes.add_prefix(
+            track_id, k, [case_node(case.nodes, activity_id) for activity_id in range(1, k + 1)],
+            [(node1, node2) for node1, node2 in case.edges if node1 <= k and node2 <= k], case_node(case.nodes, k + 1))
+
+    @instrumented('prefix')
+    def add_events_from_csv(self, log_path, graphs_path='data/graphs.g'):
+        # righe nel formato di prefix_log.csv, in ordine di arrivo; gli archi entranti di ogni evento vengono dal .g
+        # (nessun arco per gli eventi che il .g non contiene)
+        start = time.time()
+        log = parse_log_times(pd.read_csv(log_path, header=None, names=LOG_COLUMNS, dtype=str))
+        predecessors = graph_predecessors(graphs_path, set(log['track_id']))
+        emitted = [self.add_event(*row, predecessors.get((str(row[2]), int(row[0])), []))
+                   for row in log[LOG_COLUMNS].itertuples(index=False, name=None)]
+        self.flush()
+        print(f"Incremental update of {len(log)} events: {time.time() - start:.6f} seconds")
+        return [prefix_id for prefix_id in emitted if prefix_id is not None]
+
+    def append_rows(self, rows, columns, path):
+        if not rows:
+            return
+        frame = pd.DataFrame(rows, columns=columns)
+        for column in frame.columns.intersection(TIME_COLUMNS):
+            frame[column] = from_epoch_us(frame[column].to_numpy(np.int64)).array
+        frame.to_csv(path, mode='a', index=False, header=not os.path.exists(path) or os.path.getsize(path) == 0)
+
+    def flush(self):
+        self.append_rows(self.active_rows, ACTIVE_COLUMNS, self.active_path)
+        self.append_rows(self.final_rows, FINAL_COLUMNS, self.final_path)
+        self.active_rows = []
+        self.final_rows = []
+        self.prefixes.flush()
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,235 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import psutil
+
+METRICS_PATH = os.getenv('PIPELINE_METRICS', os.path.join('data', 'output_files', 'metrics.jsonl'))
+# con PIPELINE_INSTRUMENTATION=0 (o dentro disabled()) le funzioni decorate girano senza record né campionamento
+ENABLED_VARIABLE = 'PIPELINE_INSTRUMENTATION'
+
+
+class JsonlWriter:
+    # scritture bufferizzate: il file viene aperto ogni flush_every record, alla fine di ogni stadio esterno
+    # (vedi stage) e all'uscita. atexit da solo non basta: i worker di ProcessPoolExecutor terminano senza
+    # eseguirlo
+
+    def __init__(self, path=METRICS_PATH, flush_every=1000):
+        self.path = path
+        self.flush_every = flush_every
+        self.records = []
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def write(self, record):
+        with self.lock:
+            self.records.append(record)
+            if len(self.records) < self.flush_every:
+                return
+            records, self.records = self.records, []
+        self._write(records)
+
+    def flush(self):
+        with self.lock:
+            records, self.records = self.records, []
+        self._write(records)
+
+    def _write(self, records):
+        if not records:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a') as file:
+            file.writelines(json.dumps(record) + '\n' for record in records)
+
+
+writer = JsonlWriter()
+# stadi aperti nel thread corrente: il buffer si svuota quando si chiude il più esterno
+open_stages = threading.local()
+
+
+neo4j_processes = {}
+# anche l'assenza del server resta in cache per MISS_TTL secondi: senza Neo4j ogni stadio farebbe due
+# scansioni complete dei processi
+MISS_TTL = 60.0
+
+
+def find_neo4j_process(name='neo4j', port=7687):
+    # il server si riconosce dalla porta bolt in ascolto oppure dal nome/riga di comando; il risultato resta in cache
+    process, checked = neo4j_processes.get((name, port), (None, None))
+    if process is not None and process.is_running():
+        return process
+    if process is None and checked is not None and time.time() - checked < MISS_TTL:
+        return None
+    process = None
+    for candidate in psutil.process_iter(['pid', 'name', 'cmdline']):
+        try:
+            connections = getattr(candidate, 'net_connections', candidate.connections)(kind='tcp')
+            if any(connection.laddr and connection.laddr.port == port and connection.status == psutil.CONN_LISTEN
+                   for connection in connections):
+                process = candidate
+                break
+        except psutil.Error:
+            pass
+    if process is None:
+        for candidate in psutil.process_iter(['pid', 'name', 'cmdline']):
+            command_line = ' '.join(candidate.info['cmdline'] or []).lower()
+            if name in (candidate.info['name'] or '').lower() or f'org.{name}' in command_line:
+                process = candidate
+                break
+    neo4j_processes[(name, port)] = (process, time.time())
+    return process
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values, dtype=float)
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+            'max': float(values.max())}
+
+
+class ResourceSampler(threading.Thread):
+    # campiona CPU e memoria del processo Python e del server Neo4j (se trovato) ogni interval secondi
+
+    def __init__(self, stage_name, interval=1.0, neo4j_process=None, keep_samples=True):
+        super().__init__(daemon=True)
+        self.stage_name = stage_name
+        self.interval = interval
+        self.keep_samples = keep_samples
+        self.stop_event = threading.Event()
+        self.processes = {'python': psutil.Process(os.getpid())}
+        neo4j_process = find_neo4j_process() if neo4j_process is None else neo4j_process
+        if neo4j_process is not None:
+            self.processes['neo4j'] = neo4j_process
+        self.samples = {name: {'cpu_percent': [], 'rss_mb': []} for name in self.processes}
+        for process in self.processes.values():
+            self._cpu_percent(process)
+
+    def _cpu_percent(self, process):
+        try:
+            return process.cpu_percent(interval=None)
+        except psutil.Error:
+            return None
+
+    def sample(self):
+        now = time.time()
+        for name, process in self.processes.items():
+            try:
+                cpu = process.cpu_percent(interval=None)
+                rss = process.memory_info().rss / (1024 ** 2)
+            except psutil.Error:
+                continue
+            self.samples[name]['cpu_percent'].append(cpu)
+            self.samples[name]['rss_mb'].append(rss)
+            if self.keep_samples:
+                writer.write({'type': 'sample', 'stage': self.stage_name, 'process': name, 'pid': process.pid,
+                              'time': now, 'cpu_percent': cpu, 'rss_mb': round(rss, 2)})
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        # un ultimo campione, così anche gli stadi più brevi dell'intervallo hanno dei valori
+        self.sample()
+
+    def summary(self):
+        return {name: {'pid': self.processes[name].pid, 'samples': len(values['rss_mb']),
+                       'cpu_percent': percentiles(values['cpu_percent']), 'rss_mb': percentiles(values['rss_mb'])}
+                for name, values in self.samples.items()}
+
+
+@contextmanager
+def stage(stage_name, label=None, sample=True, interval=1.0, **fields):
+    # registra durata e (se sample) l'uso di risorse di uno stadio della pipeline come record JSONL
+    sampler = ResourceSampler(stage_name, interval) if sample else None
+    if sampler is not None:
+        sampler.start()
+    open_stages.depth = getattr(open_stages, 'depth', 0) + 1
+    start = time.time()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        duration = time.time() - start
+        record = {'type': 'stage', 'stage': stage_name, 'label': label, 'start': start, 'duration_s': duration,
+                  'status': status}
+        record.update(fields)
+        if sampler is not None:
+            sampler.stop()
+            record['processes'] = sampler.summary()
+        else:
+            record['processes'] = {'python': {'rss_mb': psutil.Process(os.getpid()).memory_info().rss / (1024 ** 2)}}
+        writer.write(record)
+        open_stages.depth -= 1
+        if open_stages.depth == 0:
+            writer.flush()
+
+
+def enabled():
+    return os.getenv(ENABLED_VARIABLE, '1') != '0'
+
+
+@contextmanager
+def disabled():
+    # la variabile d'ambiente vale anche per i processi dei pool avviati nel blocco
+    previous = os.environ.get(ENABLED_VARIABLE)
+    os.environ[ENABLED_VARIABLE] = '0'
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ[ENABLED_VARIABLE]
+        else:
+            os.environ[ENABLED_VARIABLE] = previous
+
+
+def instrumented(stage_name, sample=True):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return function(*args, **kwargs)
+            with stage(stage_name, label=function.__qualname__, sample=sample):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_records(path=METRICS_PATH, record_type='stage'):
+    writer.flush()
+    with open(path, 'r') as file:
+        return [record for record in map(json.loads, file) if record.get('type') == record_type]
+
+
+def summarize(path=METRICS_PATH):
+    # p50/p95/max per stadio (e funzione) su tutte le esecuzioni registrate
+    groups = {}
+    for record in read_records(path):
+        group = groups.setdefault((record['stage'], record['label']), {'duration_s': [], 'rss_mb': []})
+        group['duration_s'].append(record['duration_s'])
+        python = record['processes'].get('python', {})
+        rss = python['rss_mb']['max'] if isinstance(python.get('rss_mb'), dict) else python.get('rss_mb')
+        if rss is not None:
+            group['rss_mb'].append(rss)
+    return [{'type': 'summary', 'stage': stage_name, 'label': label, 'runs': len(values['duration_s']),
+             'duration_s': percentiles(values['duration_s']), 'rss_mb': percentiles(values['rss_mb'])}
+            for (stage_name, label), values in groups.items()]
+
+
+if __name__ == "__main__":
+    for summary in summarize(sys.argv[1] if len(sys.argv) > 1 else METRICS_PATH):
+        print(json.dumps(summary))
@@ -0,0 +1,214 @@
+import os
+import shutil
+import tempfile
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import psutil
+
+from prefix_engine import LOG_COLUMNS
+
+
+def read_log_chunks(log_path, chunk_size=100000):
+    # testo invariato: nessuna conversione di tipo, i campi vuoti restano vuoti
+    return pd.read_csv(log_path, header=None, names=LOG_COLUMNS, dtype=str, keep_default_na=False,
+                       chunksize=chunk_size)
+
+
+class CaseRanks:
+    # posizione di ogni caso nell'ordine di prima apparizione (lo stesso di Series.unique()) e righe per caso
+
+    def __init__(self):
+        self.ranks = {}
+        self.rows = np.zeros(0, dtype=np.int64)
+        # False se le righe di un caso non sono consecutive nel log (un caso ricompare dopo un altro)
+        self.contiguous = True
+        self.last = None
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def update(self, track_ids):
+        if self.contiguous and len(track_ids):
+            values = track_ids.to_numpy()
+            starts = np.r_[values[0] != self.last, values[1:] != values[:-1]]
+            runs = values[starts]
+            if len(pd.unique(runs)) != len(runs) or any(track_id in self.ranks for track_id in runs):
+                self.contiguous = False
+            self.last = values[-1]
+        for track_id in pd.unique(track_ids):
+            if track_id not in self.ranks:
+                self.ranks[track_id] = len(self.ranks)
+        ranks = track_ids.map(self.ranks).to_numpy(np.int64)
+        counts = np.bincount(ranks, minlength=len(self.ranks))
+        counts[:len(self.rows)] += self.rows
+        self.rows = counts
+        return ranks
+
+
+class PartitionWriter:
+    # ogni chunk viene diviso con un solo groupby e accodato ai file delle partizioni che contiene
+
+    def __init__(self, path_of):
+        self.path_of = path_of
+        self.paths = {}
+
+    def create(self, partition):
+        path = self.paths[partition] = self.path_of(partition)
+        open(path, 'w').close()
+        return path
+
+    def write(self, chunk, partitions):
+        for partition, rows in chunk.groupby(partitions, sort=False):
+            path = self.paths.get(partition)
+            if path is None:
+                path = self.create(partition)
+            rows.to_csv(path, mode='a', header=False, index=False)
+
+    def outputs(self):
+        return [self.paths[partition] for partition in sorted(self.paths)]
+
+
+def split_fixed(log_path, output_dir='data/output_files/1000', cases_per_file=1000, chunk_size=100000):
+    # i primi cases_per_file casi nel primo file, i successivi nel secondo e così via
+    os.makedirs(output_dir, exist_ok=True)
+    ranks = CaseRanks()
+    writer = PartitionWriter(lambda partition: os.path.join(
+        output_dir, f'filtered_prefix_log_{partition + 1}_{cases_per_file}.csv'))
+    for chunk in read_log_chunks(log_path, chunk_size):
+        writer.write(chunk, ranks.update(chunk['track_id']) // cases_per_file)
+    return writer.outputs()
+
+
+def split_by_hash(log_path, output_dir='data/output_files/hash', partitions=8, chunk_size=100000):
+    # crc32 e non hash(): la partizione di un caso non cambia tra un'esecuzione e l'altra
+    os.makedirs(output_dir, exist_ok=True)
+    writer = PartitionWriter(lambda partition: os.path.join(
+        output_dir, f'hash_prefix_log_{partition}_of_{partitions}.csv'))
+    for partition in range(partitions):
+        writer.create(partition)
+    cache = {}
+    for chunk in read_log_chunks(log_path, chunk_size):
+        for track_id in pd.unique(chunk['track_id']):
+            if track_id not in cache:
+                cache[track_id] = zlib.crc32(track_id.encode()) % partitions
+        writer.write(chunk, chunk['track_id'].map(cache).to_numpy())
+    return writer.outputs()
+
+
+def partition_log(index, chunks, log_path, spill_dir, log_rows):
+    # una lettura del log a blocchi di log_rows righe: ogni riga finisce nel file del gruppo del suo caso,
+    # le righe di casi senza grafo vengono scartate come in cases_from_graphs
+    chunk_of = pd.Series({index.entries['track_id'].iat[position]: number for number, positions in enumerate(chunks)
+                          for position in positions}, dtype='int64')
+    writer = PartitionWriter(lambda number: os.path.join(spill_dir, f'log_{number:05d}.csv'))
+    for chunk in read_log_chunks(log_path, log_rows):
+        numbers = chunk['track_id'].map(chunk_of)
+        known = numbers.notna()
+        writer.write(chunk[known], numbers[known].astype('int64'))
+    # None per i gruppi senza eventi: i prefissi useranno i tempi del .g
+    return [writer.paths.get(number) for number in range(len(chunks))]
+
+
+def split_cumulative(log_path, output_dir='data/output_files', steps=10, block_cases=100, chunk_size=100000,
+                     summary_path=None):
+    # file cumulativi 10%, 20%, ...: il numero di casi si conosce solo alla fine della lettura, quindi le righe
+    # passano da blocchi temporanei di block_cases casi; ogni file parte dalla copia del precedente e riceve solo
+    # i casi nuovi. I blocchi conservano l'ordine del log solo se le righe di ogni caso sono consecutive: per un
+    # log con casi interlacciati si rilegge il log e ogni riga va, nell'ordine originale, in tutti i file che
+    # contengono il suo caso
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    spool_dir = tempfile.mkdtemp(prefix='spool_', dir=output_dir)
+    usage = []
+    try:
+        ranks = CaseRanks()
+        blocks = PartitionWriter(lambda block: os.path.join(spool_dir, f'block_{block:06d}.csv'))
+        for chunk in read_log_chunks(log_path, chunk_size):
+            blocks.write(chunk, ranks.update(chunk['track_id']) // block_cases)
+
+        total_case_ids = len(ranks)
+        # stessa aritmetica di get_some_prefixes_percentual (i * 0.1 per 10 passi)
+        cutoffs = np.array([int(total_case_ids * (i * (1 / steps))) for i in range(1, steps + 1)])
+        paths = [os.path.join(output_dir, f'filtered_prefix_log_{i * (100 // steps)}percent.csv')
+                 for i in range(1, steps + 1)]
+
+        if not ranks.contiguous:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+            write_interleaved(log_path, paths, cutoffs, ranks, chunk_size)
+            usage = [resource_usage() for _ in paths]
+        else:
+            segment = 0
+            output = open(paths[0], 'w', newline='')
+
+            def advance(target):
+                nonlocal segment, output
+                while segment < target:
+                    output.close()
+                    usage.append(resource_usage())
+                    shutil.copyfile(paths[segment], paths[segment + 1])
+                    segment += 1
+                    output = open(paths[segment], 'a', newline='')
+
+            for block in sorted(blocks.paths):
+                first = block * block_cases
+                last = min(first + block_cases, total_case_ids) - 1
+                # segmento di un caso di rango r: il primo con r < cutoff
+                first_segment, last_segment = np.searchsorted(cutoffs, [first, last], side='right')
+                if first_segment == last_segment:
+                    advance(first_segment)
+                    with open(blocks.paths[block], 'r', newline='') as rows:
+                        shutil.copyfileobj(rows, output)
+                    continue
+                frame = pd.read_csv(blocks.paths[block], header=None, names=LOG_COLUMNS, dtype=str,
+                                    keep_default_na=False)
+                segments = np.searchsorted(cutoffs, frame['track_id'].map(ranks.ranks).to_numpy(), side='right')
+                for target, rows in frame.groupby(segments, sort=True):
+                    advance(target)
+                    rows.to_csv(output, header=False, index=False)
+            advance(steps - 1)
+            output.close()
+            usage.append(resource_usage())
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    if summary_path is not None:
+        write_summary(summary_path, paths, cutoffs, np.cumsum(ranks.rows), usage)
+    print(f"Split of {log_path} in {steps} cumulative files: {time.time() - start_time:.6f} seconds")
+    return paths
+
+
+def write_interleaved(log_path, paths, cutoffs, ranks, chunk_size=100000):
+    # seconda lettura del log: la riga di un caso del segmento s va nei file s, s + 1, ...
+    outputs = [open(path, 'w', newline='') for path in paths]
+    try:
+        for chunk in read_log_chunks(log_path, chunk_size):
+            segments = np.searchsorted(cutoffs, chunk['track_id'].map(ranks.ranks).to_numpy(), side='right')
+            for target, output in enumerate(outputs):
+                rows = chunk[segments <= target]
+                if len(rows):
+                    rows.to_csv(output, header=False, index=False)
+    finally:
+        for output in outputs:
+            output.close()
+
+
+def resource_usage():
+    # memoria e CPU (dall'ultima lettura) nel momento in cui un file è completo, senza l'attesa di 1 s
+    # di cpu_percent(interval=1): i valori non coincidono con quelli della vecchia versione
+    return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024, psutil.cpu_percent(interval=None)
+
+
+def write_summary(summary_path, paths, cutoffs, cumulative_rows, usage):
+    with open(summary_path, 'w') as log_file:
+        log_file.write(f'Filtered files info\n\n')
+        for path, end_index, (memory_usage, cpu_usage) in zip(paths, cutoffs, usage):
+            num_nodes = int(cumulative_rows[end_index - 1]) if end_index else 0
+            avg_nodes_for_case = num_nodes / end_index if end_index else 0
+            log_file.write(f'File: {os.path.basename(path)}\n'
+                           f'Number of graphs: {end_index}\n'
+                           f'Number of nodes: {num_nodes}\n'
+                           f'Average number of nodes: {avg_nodes_for_case:.2f}\n'
+                           f'Memory usage: {memory_usage:.2f} MB, CPU usage: {cpu_usage:.2f}%\n\n')
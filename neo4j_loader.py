@@ -0,0 +1,146 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from graph_reader import read_graphs
+from instrumentation import instrumented
+from prefix_engine import LOG_COLUMNS, parse_log_times
+from timestamps import NAT, cypher_datetime
+
+SCHEMA_QUERIES = [
+    "CREATE CONSTRAINT event_key IF NOT EXISTS FOR (e:Event) REQUIRE (e.track_id, e.activity_id) IS UNIQUE",
+    "CREATE INDEX event_track_index IF NOT EXISTS FOR (e:Event) ON (e.track_id)",
+    "CREATE INDEX event_name_index IF NOT EXISTS FOR (e:Event) ON (e.event_name)",
+    "CREATE INDEX event_start_time_index IF NOT EXISTS FOR (e:Event) ON (e.start_time)",
+    "CREATE INDEX event_finish_time_index IF NOT EXISTS FOR (e:Event) ON (e.finish_time)",
+]
+
+# i tempi viaggiano come interi in microsecondi e diventano datetime sul server
+MERGE_EVENTS = ("UNWIND $rows AS row "
+                "MERGE (e:Event {{track_id: row.track_id, activity_id: row.activity_id}}) "
+                "SET e.event_name = row.event_name, e.start_time = {start_time}, "
+                "e.finish_time = {finish_time}, e.resource = row.resource").format(
+    start_time=cypher_datetime('row.start_time'), finish_time=cypher_datetime('row.finish_time'))
+
+# connection ha il formato letto da create_prefixes: "<node1>_<node2>:<label>"
+MERGE_EDGES = ("UNWIND $rows AS row "
+               "MATCH (a:Event {track_id: row.track_id, activity_id: row.node1}) "
+               "MATCH (b:Event {track_id: row.track_id, activity_id: row.node2}) "
+               "MERGE (a)-[r:NEXT]->(b) "
+               "SET r.connection = row.connection")
+
+# metadati del caso calcolati dal .g durante l'import: i nodi raggiungibili dall'evento START ricevono l'inizio
+# del caso, così le query sulle attività attive non devono espandere i cammini [*] a ogni esecuzione
+MERGE_CASE_METADATA = ("UNWIND $rows AS row "
+                       "MATCH (s:Event {track_id: row.track_id, activity_id: row.start}) "
+                       "UNWIND row.reached AS activity_id "
+                       "MATCH (e:Event {track_id: row.track_id, activity_id: activity_id}) "
+                       "SET e.case_start_time = s.start_time, e.reached_from_start = true")
+
+
+def case_metadata(graph):
+    # START compreso solo se ha almeno un successore, come nei cammini (START)-[*]->() della vecchia query
+    start = next((activity_id for activity_id, event_name, _ in graph.vertices() if event_name == 'START'), None)
+    reached = graph.reachable_from(start) if start is not None else []
+    if not reached:
+        return None
+    return {'track_id': graph.track_id, 'start': start,
+            'reached': [start] + [activity_id for activity_id in reached if activity_id != start]}
+
+
+class Neo4jBulkLoader:
+
+    def __init__(self, driver, database="neo4j", batch_size=5000):
+        self.driver = driver
+        self.database = database
+        self.batch_size = batch_size
+
+    def create_schema(self):
+        # il vincolo su (track_id, activity_id) crea anche l'indice usato da MERGE
+        for query in SCHEMA_QUERIES:
+            self.driver.execute_query(query, database_=self.database)
+        self.driver.execute_query("CALL db.awaitIndexes()", database_=self.database)
+
+    def read_batches(self, log_path):
+        for chunk in pd.read_csv(log_path, header=None, names=LOG_COLUMNS, dtype=str, chunksize=self.batch_size):
+            chunk = parse_log_times(chunk)
+            yield [{'activity_id': activity_id, 'event_name': event_name, 'track_id': track_id,
+                    'start_time': None if start_time == NAT else start_time,
+                    'finish_time': None if finish_time == NAT else finish_time, 'resource': resource}
+                   for activity_id, event_name, track_id, start_time, finish_time, resource
+                   in zip(chunk['activity_id'].astype(int).tolist(), chunk['event_name'], chunk['track_id'],
+                          chunk['start_time'].tolist(), chunk['finish_time'].tolist(), chunk['resource'])]
+
+    def write_batch(self, session, query, rows):
+        # una transazione esplicita per batch, ritentata dal driver in caso di errori transitori
+        session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+
+    @instrumented('import')
+    def load_events(self, log_path):
+        start_time = time.time()
+        self.create_schema()
+        loaded = 0
+        with self.driver.session(database=self.database) as session:
+            for rows in self.read_batches(log_path):
+                self.write_batch(session, MERGE_EVENTS, rows)
+                loaded += len(rows)
+        elapsed_time = time.time() - start_time
+        print(f"{elapsed_time:.6f} seconds ({loaded} events from {log_path})")
+        return loaded
+
+    def read_edge_batches(self, graphs_path):
+        # un grafo non viene mai diviso tra due batch, così batch diversi non toccano gli stessi nodi
+        rows = []
+        for graph in read_graphs(graphs_path):
+            rows.extend({'track_id': graph.track_id, 'node1': node1, 'node2': node2,
+                         'connection': f"{node1}_{node2}:{graph.edge_label(node1, node2)}"}
+                        for node1, node2 in graph.edge_pairs())
+            if len(rows) >= self.batch_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def read_case_batches(self, graphs_path):
+        rows = []
+        for graph in read_graphs(graphs_path):
+            metadata = case_metadata(graph)
+            if metadata is not None:
+                rows.append(metadata)
+            if len(rows) >= self.batch_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def load_case_metadata(self, graphs_path='data/graphs.g'):
+        # dopo eventi e archi: ogni riga tocca un solo caso, quindi batch diversi non si sovrappongono
+        loaded = 0
+        with self.driver.session(database=self.database) as session:
+            for rows in self.read_case_batches(graphs_path):
+                self.write_batch(session, MERGE_CASE_METADATA, rows)
+                loaded += len(rows)
+        return loaded
+
+    def write_edge_batch(self, rows):
+        with self.driver.session(database=self.database) as session:
+            self.write_batch(session, MERGE_EDGES, rows)
+        return len(rows)
+
+    @instrumented('import')
+    def load_edges(self, graphs_path='data/graphs.g', workers=4):
+        start_time = time.time()
+        loaded = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for rows in self.read_edge_batches(graphs_path):
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    loaded += sum(future.result() for future in done)
+                pending.add(executor.submit(self.write_edge_batch, rows))
+            loaded += sum(future.result() for future in wait(pending).done)
+        cases = self.load_case_metadata(graphs_path)
+        elapsed_time = time.time() - start_time
+        print(f"{elapsed_time:.6f} seconds ({loaded} edges, {cases} cases from {graphs_path})")
+        return loaded
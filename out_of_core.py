@@ -0,0 +1,189 @@
+import os
+import resource
+import shutil
+import tempfile
+import time
+from collections import deque
+
+import psutil
+
+from graph_index import GraphIndex, read_spans
+from instrumentation import instrumented
+from log_partitioner import partition_log
+from parallel_prefixes import copy_range, csv_header, prefix_shard
+from prefix_table import PREFIX_COLUMNS
+from queries import case_dbs
+
+# modalità out-of-core: i casi vengono elaborati a gruppi contigui del file .g (mai dividendo un track_id), i
+# risultati di ogni gruppo vanno su disco e in memoria resta un solo gruppo alla volta. La dimensione dei gruppi
+# deriva dal budget di memoria
+
+# stime prudenti della memoria Python (misurate sul log da 2000 casi): un nodo di un caso in lavorazione (grafo,
+# eventi del log, tuple dei nodi, righe di DBs/DBf), una riga nel buffer di PrefixTableBuilder, una riga del log
+# letta con pandas
+BYTES_PER_NODE = 4 * 1024
+BYTES_PER_PREFIX_ROW = 2 * 1024
+BYTES_PER_LOG_ROW = 2 * 1024
+
+
+def rss():
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def peak_rss():
+    # picco dell'intero processo, anche prima della modalità out-of-core (ru_maxrss è in KB su Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryBudget:
+    # il budget vale per l'intero processo: quello che è già occupato all'avvio non è disponibile per i gruppi
+
+    def __init__(self, budget_mb):
+        self.limit = int(budget_mb * 1024 ** 2)
+        self.baseline = rss()
+        if self.limit <= self.baseline:
+            raise ValueError(f"memory budget of {budget_mb} MB is below the current RSS "
+                             f"({self.baseline / 1024 ** 2:.1f} MB)")
+        self.available = self.limit - self.baseline
+
+    def chunk_nodes(self, share=0.5):
+        return max(int(self.available * share) // BYTES_PER_NODE, 1)
+
+    def builder_rows(self, share=0.25):
+        return max(int(self.available * share) // BYTES_PER_PREFIX_ROW, 1000)
+
+    def log_rows(self, share=0.25):
+        return max(int(self.available * share) // BYTES_PER_LOG_ROW, 1000)
+
+    def exceeded(self):
+        return rss() > self.limit
+
+    def report(self, label):
+        peak = peak_rss()
+        status = "within" if peak <= self.limit else "OVER"
+        print(f"{label}: peak RSS {peak / 1024 ** 2:.1f} MB, {status} the budget of {self.limit / 1024 ** 2:.1f} MB")
+        return peak
+
+
+def plan_chunks(index, max_nodes, positions=None):
+    # gruppi contigui di posizioni (tutte, o quelle date) con al più max_nodes nodi; un caso più grande del limite
+    # resta da solo
+    chunks = []
+    current = []
+    nodes = 0
+    counts = index.entries['nodes'].to_numpy()
+    positions = range(len(counts)) if positions is None else positions
+    for position, count in zip(positions, counts[list(positions)].tolist()):
+        if count == 0:
+            continue
+        if current and nodes + count > max_nodes:
+            chunks.append(current)
+            current = []
+            nodes = 0
+        current.append(position)
+        nodes += count
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def run_chunks(index, budget, chunks, max_nodes, process):
+    # process(positions, data) gruppo per gruppo, con data (ad esempio la parte di log) associato a ogni gruppo.
+    # Le stime per nodo possono sbagliare: dopo ogni gruppo si misura l'RSS e, se supera il budget, i gruppi
+    # restanti vengono divisi con metà dei nodi (ogni parte eredita data del gruppo da cui viene). Un gruppo di un
+    # solo caso non si può dividere: oltre il budget si interrompe con MemoryError. Restituisce i gruppi eseguiti
+    pending = deque(chunks)
+    done = []
+    while pending:
+        positions, data = pending.popleft()
+        process(positions, data)
+        done.append(positions)
+        if not budget.exceeded():
+            continue
+        current = rss() / 1024 ** 2
+        if len(positions) == 1:
+            raise MemoryError(f"case {index.entries['track_id'].iat[positions[0]]} took the RSS to {current:.1f} MB, "
+                              f"over the budget of {budget.limit / 1024 ** 2:.1f} MB")
+        max_nodes = max(max_nodes // 2, 1)
+        print(f"RSS {current:.1f} MB over the budget after a chunk of {len(positions)} cases: "
+              f"remaining chunks limited to {max_nodes} nodes")
+        pending = deque((part, data) for positions, data in pending
+                        for part in plan_chunks(index, max_nodes, positions))
+    return done
+
+
+@instrumented('prefix')
+def generate_prefixes_chunked(graphs_path='data/graphs.g', log_path='data/prefixes/prefix_log_100.csv',
+                              output_path='data/prefixes.csv', memory_budget_mb=1024, max_len=None, spill_dir=None):
+    # stesso file di prefix_engine.generate_prefixes: ogni gruppo scrive un file parziale con gli offset di ogni k,
+    # poi le sezioni vengono copiate nell'ordine (k, gruppo) come in generate_prefixes_parallel
+    start = time.time()
+    budget = MemoryBudget(memory_budget_mb)
+    spill_dir = tempfile.mkdtemp(prefix='prefix_chunks_', dir=spill_dir or os.path.dirname(output_path) or '.')
+    try:
+        with GraphIndex(graphs_path) as index:
+            max_nodes = budget.chunk_nodes()
+            chunks = plan_chunks(index, max_nodes)
+            if max_len is None:
+                max_len = int(index.entries['nodes'].max()) if len(index) else 0
+            log_paths = partition_log(index, chunks, log_path, spill_dir, budget.log_rows()) if log_path else \
+                [None] * len(chunks)
+
+            paths = []
+            offsets = []
+
+            def process(positions, chunk_log):
+                # le parti di un gruppo diviso rileggono il log del gruppo: cases_from_graphs tiene solo i loro casi
+                path = os.path.join(spill_dir, f'prefixes_{len(paths):05d}.csv')
+                offsets.append(prefix_shard(graphs_path, chunk_log, index.spans(positions), max_len, path,
+                                            budget.builder_rows()))
+                paths.append(path)
+
+            chunks = run_chunks(index, budget, zip(chunks, log_paths), max_nodes, process)
+
+        with open(output_path, 'wb') as output:
+            output.write(csv_header(PREFIX_COLUMNS))
+            # un file aperto alla volta: i gruppi possono essere migliaia
+            for k in range(max(max_len - 2, 0)):
+                for path, chunk_offsets in zip(paths, offsets):
+                    if chunk_offsets[k + 1] > chunk_offsets[k]:
+                        with open(path, 'rb') as part:
+                            copy_range(part, output, chunk_offsets[k], chunk_offsets[k + 1])
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    print(f"Time for chunked prefix generation ({len(chunks)} chunks): {time.time() - start:.6f} seconds")
+    budget.report("Chunked prefix generation")
+
+
+@instrumented('active_case')
+def active_case_and_final_activity_dbs_chunked(graphs_path='data/graphs.g', output_dir='data', memory_budget_mb=1024,
+                                               parallel_branches=False, exact_times=False):
+    # DBs e DBf gruppo per gruppo, accodati direttamente ai file finali
+    start_time = time.time()
+    budget = MemoryBudget(memory_budget_mb)
+    final_path = os.path.join(output_dir, 'final_activities.csv')
+    active_path = os.path.join(output_dir, 'active_activities.csv')
+    with open(final_path, 'wb') as file:
+        file.write(csv_header(['track_id', 'index', 'event_name', 'finish', 'start']))
+    with open(active_path, 'wb') as file:
+        file.write(csv_header(['track_id', 'index', 'start_time_prefix', 'finish_time_last_activity']))
+
+    with GraphIndex(graphs_path) as index:
+        def process(positions, data):
+            final_df, df = case_dbs(read_spans(graphs_path, index.spans(positions)), parallel_branches, exact_times)
+            final_df.to_csv(final_path, mode='a', index=False, header=False)
+            df.to_csv(active_path, mode='a', index=False, header=False)
+
+        max_nodes = budget.chunk_nodes(share=1.0)
+        chunks = run_chunks(index, budget, [(positions, None) for positions in plan_chunks(index, max_nodes)],
+                            max_nodes, process)
+
+    print(f"Active activities execution time without Neo4j ({len(chunks)} chunks): "
+          f"{time.time() - start_time:.6f} seconds")
+    budget.report("Chunked DBs/DBf")
+
+
+if __name__ == "__main__":
+    generate_prefixes_chunked(output_path='data/prefixes_python.csv', memory_budget_mb=512)
+    active_case_and_final_activity_dbs_chunked(memory_budget_mb=512)
@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from graph_index import GraphIndex, read_spans
+from instrumentation import instrumented
+from log_partitioner import partition_log
+from prefix_engine import add_prefixes, cases_from_graphs
+from prefix_table import PREFIX_COLUMNS, PrefixTableBuilder
+from queries import case_dbs
+
+# i casi sono indipendenti: ogni worker riceve un intervallo contiguo di grafi del file .g (offset e lunghezze
+# calcolati dall'indice nel processo principale, i grafi non passano tramite pickle) e la sola parte del log dei
+# suoi casi, scritta dal processo principale in una lettura; ogni worker scrive il proprio file parziale e i file
+# vengono poi concatenati a livello di byte
+
+
+def plan_shards(index, shards, cost='prefix'):
+    # intervalli [start, stop) di posizioni con costo simile: un caso di n nodi produce circa n^2 / 2 righe di
+    # prefissi, mentre DBs/DBf crescono linearmente
+    positions = np.flatnonzero(index.entries['nodes'].to_numpy() > 0)
+    if len(positions) == 0:
+        return []
+    nodes = index.entries['nodes'].to_numpy()[positions].astype(np.float64)
+    weights = nodes * nodes if cost == 'prefix' else nodes
+    cumulative = np.cumsum(weights)
+    shards = max(1, min(shards, len(positions)))
+    bounds = np.searchsorted(cumulative, cumulative[-1] * np.arange(1, shards) / shards, side='right')
+    bounds = np.unique(np.r_[0, bounds, len(positions)])
+    return [positions[first:last] for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+
+
+def prefix_shard(graphs_path, log_path, spans, max_len, shard_path, chunk_size=100000):
+    # scrive i prefissi del gruppo di casi un k alla volta e restituisce l'offset in byte dell'inizio di ogni k;
+    # spans: (offset, length) dei grafi del gruppo, da GraphIndex.spans
+    cases = cases_from_graphs(read_spans(graphs_path, spans), log_path)
+    builder = PrefixTableBuilder(shard_path, chunk_size, header=False)
+    offsets = [0]
+    active_cases = cases
+    for k in range(1, max_len - 1):
+        active_cases = [case for case in active_cases if len(case[1]) > k]
+        add_prefixes(builder, active_cases, k)
+        builder.flush()
+        offsets.append(os.path.getsize(shard_path) if os.path.exists(shard_path) else 0)
+    return offsets
+
+
+def case_db_shard(graphs_path, spans, final_path, active_path, parallel_branches=False, exact_times=False):
+    final_df, df = case_dbs(read_spans(graphs_path, spans), parallel_branches, exact_times)
+    final_df.to_csv(final_path, index=False, header=False)
+    df.to_csv(active_path, index=False, header=False)
+
+
+def copy_range(source, target, start, stop):
+    source.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        data = source.read(min(remaining, 1 << 20))
+        if not data:
+            break
+        target.write(data)
+        remaining -= len(data)
+
+
+def concatenate(output_path, header, paths):
+    with open(output_path, 'wb') as output:
+        output.write(header)
+        for path in paths:
+            with open(path, 'rb') as part:
+                shutil.copyfileobj(part, output)
+
+
+def csv_header(columns):
+    return pd.DataFrame(columns=columns).to_csv(index=False).encode()
+
+
+def default_workers(workers):
+    return workers if workers is not None else os.cpu_count() or 1
+
+
+@instrumented('prefix')
+def generate_prefixes_parallel(graphs_path='data/graphs.g', log_path='data/prefixes/prefix_log_100.csv',
+                               output_path='data/prefixes.csv', workers=None, shards=None, max_len=None,
+                               log_rows=100000):
+    # stesso file di prefix_engine.generate_prefixes: per ogni k le sezioni dei gruppi vengono copiate in ordine
+    start = time.time()
+    workers = default_workers(workers)
+    shard_dir = tempfile.mkdtemp(prefix='prefix_shards_', dir=os.path.dirname(output_path) or '.')
+    try:
+        with GraphIndex(graphs_path) as index:
+            # più gruppi che worker, così i casi lunghi non lasciano core inattivi alla fine
+            groups = plan_shards(index, shards if shards is not None else workers * 4)
+            spans = [index.spans(positions) for positions in groups]
+            if max_len is None:
+                max_len = int(index.entries['nodes'].max()) if len(index) else 0
+            # il log viene letto una volta sola qui, non una volta per gruppo
+            log_paths = partition_log(index, groups, log_path, shard_dir, log_rows) if log_path else \
+                [None] * len(groups)
+        paths = [os.path.join(shard_dir, f'shard_{number:05d}.csv') for number in range(len(groups))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            offsets = list(executor.map(prefix_shard, [graphs_path] * len(groups), log_paths, spans,
+                                        [max_len] * len(groups), paths))
+
+        with open(output_path, 'wb') as output:
+            output.write(csv_header(PREFIX_COLUMNS))
+            parts = [open(path, 'rb') if os.path.exists(path) else None for path in paths]
+            try:
+                for k in range(max(max_len - 2, 0)):
+                    for part, part_offsets in zip(parts, offsets):
+                        if part is not None:
+                            copy_range(part, output, part_offsets[k], part_offsets[k + 1])
+            finally:
+                for part in parts:
+                    if part is not None:
+                        part.close()
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    print(f"Time for parallel prefix generation ({workers} workers, {len(groups)} shards): "
+          f"{time.time() - start:.6f} seconds")
+
+
+@instrumented('active_case')
+def active_case_and_final_activity_dbs_parallel(graphs_path='data/graphs.g', output_dir='data', workers=None,
+                                                shards=None, parallel_branches=False, exact_times=False):
+    start = time.time()
+    workers = default_workers(workers)
+    with GraphIndex(graphs_path) as index:
+        groups = plan_shards(index, shards if shards is not None else workers * 2, cost='linear')
+        spans = [index.spans(positions) for positions in groups]
+
+    shard_dir = tempfile.mkdtemp(prefix='db_shards_', dir=output_dir)
+    try:
+        final_paths = [os.path.join(shard_dir, f'final_{number:05d}.csv') for number in range(len(groups))]
+        active_paths = [os.path.join(shard_dir, f'active_{number:05d}.csv') for number in range(len(groups))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(case_db_shard, [graphs_path] * len(groups), spans, final_paths, active_paths,
+                              [parallel_branches] * len(groups), [exact_times] * len(groups)))
+        concatenate(os.path.join(output_dir, 'final_activities.csv'),
+                    csv_header(['track_id', 'index', 'event_name', 'finish', 'start']), final_paths)
+        concatenate(os.path.join(output_dir, 'active_activities.csv'),
+                    csv_header(['track_id', 'index', 'start_time_prefix', 'finish_time_last_activity']),
+                    active_paths)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    print(f"Active activities execution time without Neo4j ({workers} workers): {time.time() - start:.6f} seconds")
+
+
+if __name__ == "__main__":
+    generate_prefixes_parallel(output_path='data/prefixes_python.csv')
+    active_case_and_final_activity_dbs_parallel()
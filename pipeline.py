@@ -0,0 +1,531 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import types
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from benchmark import connect, query_instants
+from columnar_store import store_active_activities, store_final_activities, store_prefixes
+from instrumentation import writer
+from graph_index import GraphIndex
+from log_partitioner import read_log_chunks, split_by_hash, split_cumulative, split_fixed
+from neo4j_loader import Neo4jBulkLoader
+from out_of_core import active_case_and_final_activity_dbs_chunked, generate_prefixes_chunked
+from parallel_prefixes import active_case_and_final_activity_dbs_parallel, generate_prefixes_parallel
+from prefix_engine import generate_prefixes
+from queries import ActiveCaseGeneration, active_case_and_final_activity_dbs
+from snapshot_query import SnapshotQueryService
+from tensor_export import build_tensors
+
+# la pipeline come DAG: split -> events (log e grafi dei file dello split scelti) -> import -> prefissi Neo4j /
+# DBs Neo4j, e sul lato Python events -> prefissi, tensori, DBs/DBf -> query. L'uscita di ogni stadio è una
+# cartella della cache, con chiave lo sha256 di file d'ingresso, parametri, chiavi degli stadi a monte e sorgenti
+# dei moduli usati (ricavati dagli import): uno stadio invariato non viene rieseguito
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join('data', 'cache')
+OUTPUT_DIR = os.path.join('data', 'pipeline')
+HASHES_FILE = 'file_hashes.json'
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_TARGETS = ['split', 'events', 'prefixes', 'tensors', 'dbs', 'query']
+NEO4J_TARGETS = ['import', 'neo4j_prefixes', 'neo4j_dbs']
+
+
+def module_path(name):
+    # None per i moduli che non sono file del repository (libreria standard, pacchetti installati)
+    path = os.path.join(SOURCE_DIR, *name.split('.')) + '.py'
+    return path if os.path.isfile(path) else None
+
+
+def import_closure(modules):
+    # i moduli del repository raggiunti dagli import, anche quelli dentro le funzioni, come percorsi relativi
+    seen = set()
+    pending = list(modules)
+    while pending:
+        name = pending.pop()
+        path = module_path(name)
+        if path is None or name in seen:
+            continue
+        seen.add(name)
+        with open(path, 'r') as file:
+            tree = ast.parse(file.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                pending.append(node.module)
+    return sorted(os.path.relpath(module_path(name), SOURCE_DIR) for name in seen)
+
+
+def stage_modules(function):
+    # i moduli da cui vengono i nomi globali usati dalla funzione dello stadio (anche nelle funzioni annidate e
+    # nelle funzioni di pipeline che chiama), più tutto quello che importano
+    modules = set()
+    seen = set()
+    codes = [function.__code__]
+    while codes:
+        code = codes.pop()
+        if code in seen:
+            continue
+        seen.add(code)
+        codes.extend(constant for constant in code.co_consts if isinstance(constant, types.CodeType))
+        for name in code.co_names:
+            value = function.__globals__.get(name)
+            module = value.__name__ if isinstance(value, types.ModuleType) else getattr(value, '__module__', None)
+            if module is None:
+                continue
+            if module != function.__module__:
+                modules.add(module)
+            elif isinstance(value, types.FunctionType):
+                codes.append(value.__code__)
+    return import_closure(modules)
+
+
+class Stage:
+    # params entrano nella chiave, settings no (modalità di esecuzione con lo stesso risultato: workers,
+    # budget di memoria, dimensione dei batch). Gli stadi local girano in un processo separato, gli altri
+    # (quelli che usano il driver Neo4j) in un thread del processo principale
+
+    def __init__(self, name, function, deps=(), files=None, params=None, settings=None, local=True,
+                 cacheable=True):
+        self.name = name
+        self.function = function
+        self.deps = list(deps)
+        self.files = files or {}
+        self.params = params or {}
+        self.settings = settings or {}
+        self.modules = stage_modules(function)
+        self.local = local
+        self.cacheable = cacheable
+
+    def arguments(self):
+        return dict(self.files, **self.params, **self.settings)
+
+
+class StageCache:
+
+    def __init__(self, path=CACHE_DIR, max_mb=4096):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        os.makedirs(path, exist_ok=True)
+        self.hashes_path = os.path.join(path, HASHES_FILE)
+        self.hashes = {}
+        if os.path.exists(self.hashes_path):
+            with open(self.hashes_path, 'r') as file:
+                self.hashes = json.load(file)
+
+    def file_hash(self, path):
+        # lo sha256 di un file si ricalcola solo se dimensione o mtime sono cambiati
+        path = os.path.realpath(path)
+        status = os.stat(path)
+        cached = self.hashes.get(path)
+        if cached is not None and cached[:2] == [status.st_size, status.st_mtime_ns]:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        self.hashes[path] = [status.st_size, status.st_mtime_ns, digest.hexdigest()]
+        return self.hashes[path][2]
+
+    def key(self, stage, upstream_keys):
+        content = {
+            'stage': stage.name,
+            'params': stage.params,
+            'files': {name: self.file_hash(path) for name, path in sorted(stage.files.items()) if path},
+            'upstream': {name: upstream_keys[name] for name in stage.deps},
+            # pipeline.py contiene le funzioni degli stadi: una sua modifica invalida tutte le entrate
+            'modules': {module: self.file_hash(os.path.join(SOURCE_DIR, module))
+                        for module in sorted(set(stage.modules + ['pipeline.py']))},
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def entry(self, stage_name, key):
+        return os.path.join(self.path, stage_name, key)
+
+    def lookup(self, stage_name, key):
+        # un'entrata vale solo se il manifest esiste e i file hanno ancora la dimensione registrata
+        entry = self.entry(stage_name, key)
+        manifest = self.read_manifest(entry)
+        if manifest is None:
+            return None
+        for name, size in manifest['files'].items():
+            path = os.path.join(entry, name)
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return None
+        manifest['used'] = time.time()
+        self.write_manifest(entry, manifest)
+        return entry
+
+    def reserve(self, stage_name, key):
+        # lo stadio scrive in una cartella temporanea, rinominata solo a fine esecuzione
+        temporary = os.path.join(self.path, stage_name, f'.tmp-{key}-{os.getpid()}')
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        return temporary
+
+    def commit(self, stage, key, temporary):
+        files = {os.path.relpath(os.path.join(root, name), temporary): os.path.getsize(os.path.join(root, name))
+                 for root, _, names in os.walk(temporary) for name in names}
+        now = time.time()
+        self.write_manifest(temporary, {'stage': stage.name, 'key': key, 'params': stage.params, 'files': files,
+                                        'bytes': sum(files.values()), 'created': now, 'used': now})
+        entry = self.entry(stage.name, key)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(temporary, entry)
+        return entry
+
+    def read_manifest(self, entry):
+        path = os.path.join(entry, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def write_manifest(self, entry, manifest):
+        with open(os.path.join(entry, MANIFEST_FILE), 'w') as file:
+            json.dump(manifest, file, indent=2, default=str)
+
+    def entries(self):
+        for stage_name in sorted(os.listdir(self.path)):
+            stage_dir = os.path.join(self.path, stage_name)
+            if not os.path.isdir(stage_dir):
+                continue
+            for key in os.listdir(stage_dir):
+                manifest = self.read_manifest(os.path.join(stage_dir, key))
+                if manifest is not None:
+                    yield os.path.join(stage_dir, key), manifest
+
+    def evict(self, keep=()):
+        # LRU: si eliminano le entrate usate meno di recente finché la cache non rientra nel limite;
+        # le entrate dell'esecuzione corrente restano
+        entries = sorted(self.entries(), key=lambda item: item[1]['used'])
+        total = sum(manifest['bytes'] for _, manifest in entries)
+        evicted = 0
+        for entry, manifest in entries:
+            if total <= self.max_bytes:
+                break
+            if entry in keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= manifest['bytes']
+            evicted += 1
+        return evicted, total
+
+    def save(self):
+        with open(self.hashes_path, 'w') as file:
+            json.dump(self.hashes, file)
+
+
+def run_split(output_dir, upstream, log_path, scheme, size):
+    if scheme == 'fixed':
+        split_fixed(log_path, output_dir, size)
+    elif scheme == 'hash':
+        split_by_hash(log_path, output_dir, size)
+    else:
+        split_cumulative(log_path, output_dir, steps=size, summary_path=os.path.join(output_dir, 'summary_log.txt'))
+
+
+def split_files(split_dir, partitions=None):
+    # i file dello split in ordine numerico (come import_data), i primi partitions
+    files = sorted((name for name in os.listdir(split_dir) if name.endswith('.csv')),
+                   key=lambda name: int(re.findall(r'\d+', name)[0]))
+    return files[:partitions] if partitions else files
+
+
+def run_events(output_dir, upstream, graphs_path, partitions, scheme):
+    # gli eventi dei file dello split scelti in un solo log, e i grafi dei loro casi: l'ingresso comune di tutti
+    # gli stadi a valle. I file cumulativi si contengono l'un l'altro, basta l'ultimo
+    files = split_files(upstream['split'], partitions)
+    if scheme == 'cumulative':
+        files = files[-1:]
+    track_ids = set()
+    with open(os.path.join(output_dir, 'events.csv'), 'wb') as output:
+        for name in files:
+            with open(os.path.join(upstream['split'], name), 'rb') as part:
+                shutil.copyfileobj(part, output)
+            for chunk in read_log_chunks(os.path.join(upstream['split'], name)):
+                track_ids.update(chunk['track_id'])
+    with GraphIndex(graphs_path) as index:
+        index.write_cases(os.path.join(output_dir, 'graphs.g'), track_ids)
+    # l'indice .g.idx fa parte dell'uscita: gli stadi a valle non lo ricostruiscono nella cartella in cache
+    GraphIndex(os.path.join(output_dir, 'graphs.g')).close()
+    with open(os.path.join(output_dir, 'events.json'), 'w') as file:
+        json.dump({'files': files, 'cases': len(track_ids)}, file, indent=2)
+
+
+def event_inputs(events_dir):
+    return os.path.join(events_dir, 'graphs.g'), os.path.join(events_dir, 'events.csv')
+
+
+def run_prefixes(output_dir, upstream, max_len, mode, workers, memory_budget_mb):
+    graphs_path, log_path = event_inputs(upstream['events'])
+    output_path = os.path.join(output_dir, 'prefixes.csv')
+    if mode == 'parallel':
+        generate_prefixes_parallel(graphs_path, log_path, output_path, workers, max_len=max_len)
+    elif mode == 'chunked':
+        generate_prefixes_chunked(graphs_path, log_path, output_path, memory_budget_mb, max_len)
+    else:
+        generate_prefixes(graphs_path, log_path, output_path, max_len)
+    # DBp anche come tabella colonnare, letta dallo stadio query
+    store_prefixes(output_path, os.path.join(output_dir, 'db', 'prefixes'))
+
+
+def run_tensors(output_dir, upstream, max_len, buckets):
+    graphs_path, log_path = event_inputs(upstream['events'])
+    build_tensors(graphs_path, log_path, output_dir, max_len, buckets)
+
+
+def run_dbs(output_dir, upstream, parallel_branches, exact_times, mode, workers, memory_budget_mb):
+    graphs_path, _ = event_inputs(upstream['events'])
+    if mode == 'parallel':
+        active_case_and_final_activity_dbs_parallel(graphs_path, output_dir, workers,
+                                                    parallel_branches=parallel_branches, exact_times=exact_times)
+    elif mode == 'chunked':
+        active_case_and_final_activity_dbs_chunked(graphs_path, output_dir, memory_budget_mb, parallel_branches,
+                                                   exact_times)
+    else:
+        active_case_and_final_activity_dbs(graphs_path, output_dir, parallel_branches, exact_times)
+    store_active_activities(os.path.join(output_dir, 'active_activities.csv'),
+                            os.path.join(output_dir, 'db', 'active_activities'))
+    store_final_activities(os.path.join(output_dir, 'final_activities.csv'),
+                           os.path.join(output_dir, 'db', 'final_activities'))
+
+
+def run_query(output_dir, upstream, queries, seed):
+    # prefissi massimali attivi in queries istanti casuali (gli stessi del benchmark a parità di seed)
+    # DBs, DBf e DBp dalle tabelle colonnari degli stadi a monte
+    service = SnapshotQueryService(os.path.join(upstream['dbs'], 'db', 'active_activities'),
+                                   os.path.join(upstream['dbs'], 'db', 'final_activities'),
+                                   os.path.join(upstream['prefixes'], 'db', 'prefixes'))
+    instants = query_instants(os.path.join(upstream['dbs'], 'active_activities.csv'), queries, seed)
+    rows = [(instant, prefix_id) for instant, prefix_ids in service.active_prefixes_at(instants).items()
+            for prefix_id in prefix_ids]
+    pd.DataFrame(rows, columns=['instant', 'prefix_id']).to_csv(os.path.join(output_dir, 'active_prefixes.csv'),
+                                                                index=False)
+
+
+def run_import(output_dir, upstream, driver, batch_size, reset_database):
+    # gli eventi e i grafi dello stadio events, poi archi e metadati
+    graphs_path, log_path = event_inputs(upstream['events'])
+    if reset_database:
+        driver.execute_query("MATCH (n:Event) DETACH DELETE n", database_="neo4j")
+    loader = Neo4jBulkLoader(driver, batch_size=batch_size)
+    events = loader.load_events(log_path)
+    loader.load_edges(graphs_path)
+    with open(os.path.join(output_dir, 'import.json'), 'w') as file:
+        json.dump({'events': events}, file, indent=2)
+
+
+def run_neo4j_prefixes(output_dir, upstream, driver):
+    ActiveCaseGeneration(driver=driver).create_prefixes(os.path.join(output_dir, 'prefixes_neo4j.csv'))
+
+
+def run_neo4j_dbs(output_dir, upstream, driver):
+    ActiveCaseGeneration(driver=driver).active_activity_neo4j(os.path.join(output_dir, 'active_activities_Neo4j.csv'))
+
+
+def pipeline_stages(args, driver=None):
+    # import e gli stadi Neo4j non vanno in cache: il loro risultato è lo stato del database, che la chiave non
+    # vede (un reset, un altro import o lo stand-in in memoria lo cambiano) e quindi girano sempre
+    graphs = {'graphs_path': args.graphs}
+    execution = {'mode': args.mode, 'workers': args.workers, 'memory_budget_mb': args.memory_budget}
+    return {stage.name: stage for stage in [
+        Stage('split', run_split, files={'log_path': args.log},
+              params={'scheme': args.split_scheme, 'size': args.split_size}),
+        Stage('events', run_events, deps=['split'], files=graphs,
+              params={'partitions': args.partitions, 'scheme': args.split_scheme}),
+        Stage('prefixes', run_prefixes, deps=['events'], params={'max_len': args.max_len}, settings=execution),
+        Stage('tensors', run_tensors, deps=['events'], params={'max_len': args.max_len, 'buckets': args.buckets}),
+        Stage('dbs', run_dbs, deps=['events'],
+              params={'parallel_branches': args.parallel_branches, 'exact_times': args.exact_times},
+              settings=execution),
+        Stage('query', run_query, deps=['prefixes', 'dbs'], params={'queries': args.queries, 'seed': args.seed}),
+        Stage('import', run_import, deps=['events'],
+              settings={'driver': driver, 'batch_size': args.batch_size, 'reset_database': args.reset_database},
+              local=False, cacheable=False),
+        Stage('neo4j_prefixes', run_neo4j_prefixes, deps=['import'], settings={'driver': driver}, local=False,
+              cacheable=False),
+        Stage('neo4j_dbs', run_neo4j_dbs, deps=['import'], settings={'driver': driver}, local=False,
+              cacheable=False),
+    ]}
+
+
+def topological_order(stages):
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"cycle in the pipeline at stage {name}")
+        visiting.add(name)
+        for dep in stages[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+
+def plan(stages, targets, cache, force=()):
+    # chiavi di tutti gli stadi (dipendono solo dalle chiavi a monte, non dalle uscite), poi a ritroso dai target:
+    # uno stadio in cache non richiede i suoi stadi a monte
+    order = topological_order(stages)
+    keys = {}
+    for name in order:
+        keys[name] = cache.key(stages[name], keys)
+    entries = {}
+    to_run = set()
+    needed = set(targets)
+    for name in reversed(order):
+        if name not in needed:
+            continue
+        stage = stages[name]
+        entry = cache.lookup(name, keys[name]) if stage.cacheable and name not in force else None
+        if entry is not None:
+            entries[name] = entry
+        else:
+            to_run.add(name)
+            needed.update(stage.deps)
+    return [name for name in order if name in to_run], keys, entries
+
+
+def execute(stage, output_dir, upstream):
+    # gli stadi local girano in un worker del pool, che termina senza atexit: i record vanno scritti qui
+    start = time.time()
+    try:
+        stage.function(output_dir, upstream, **stage.arguments())
+    finally:
+        writer.flush()
+    return time.time() - start
+
+
+def run_pipeline(stages, targets, cache, jobs=None, force=()):
+    start = time.time()
+    to_run, keys, entries = plan(stages, targets, cache, force)
+    cached = len(entries)
+    for name, entry in entries.items():
+        print(f"{name}: cached ({keys[name][:12]})")
+
+    # gli stadi indipendenti partono insieme: appena uno finisce si avviano quelli con tutte le dipendenze pronte
+    pending = list(to_run)
+    running = {}
+    processes = ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1)
+    threads = ThreadPoolExecutor(max_workers=2)
+    try:
+        while pending or running:
+            for name in [name for name in pending if all(dep in entries for dep in stages[name].deps)]:
+                pending.remove(name)
+                stage = stages[name]
+                output_dir = cache.reserve(name, keys[name])
+                upstream = {dep: entries[dep] for dep in stage.deps}
+                executor = processes if stage.local else threads
+                running[executor.submit(execute, stage, output_dir, upstream)] = (name, output_dir)
+            if not running:
+                raise ValueError(f"stages {pending} cannot run: missing upstream outputs")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, output_dir = running.pop(future)
+                try:
+                    elapsed = future.result()
+                except Exception:
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                    raise
+                entries[name] = cache.commit(stages[name], keys[name], output_dir)
+                print(f"{name}: {elapsed:.6f} seconds ({keys[name][:12]})")
+    finally:
+        threads.shutdown(wait=True)
+        processes.shutdown(wait=True)
+
+    evicted, total = cache.evict(keep=set(entries.values()))
+    cache.save()
+    print(f"Pipeline: {len(to_run)} stages run, {cached} from the cache, "
+          f"{evicted} entries evicted, cache {total / 1024 ** 2:.1f} MB, {time.time() - start:.6f} seconds")
+    return {name: entries[name] for name in targets}
+
+
+def link_or_copy(source, target):
+    # un hard link non costa spazio né tempo; i file pubblicati non vanno modificati sul posto, sono gli stessi
+    # della cache
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def publish(outputs, output_dir=OUTPUT_DIR):
+    for name, entry in outputs.items():
+        target = os.path.join(output_dir, name)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(entry, target, copy_function=link_or_copy, ignore=shutil.ignore_patterns(MANIFEST_FILE))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prefix pipeline with a content-hashed stage cache")
+    parser.add_argument('targets', nargs='*',
+                        help=f"stages to produce, with their dependencies, among {DEFAULT_TARGETS + NEO4J_TARGETS} "
+                             f"(default: the Python stages)")
+    parser.add_argument('--graphs', default='data/graphs.g')
+    parser.add_argument('--log', default='data/prefixes/prefix_log_100.csv')
+    parser.add_argument('--max-len', type=int)
+    parser.add_argument('--split-scheme', default='fixed', choices=['fixed', 'hash', 'cumulative'])
+    parser.add_argument('--split-size', type=int, default=1000,
+                        help="cases per file (fixed), partitions (hash) or steps (cumulative)")
+    parser.add_argument('--partitions', type=int,
+                        help="split files whose events feed every later stage (default: all)")
+    parser.add_argument('--buckets', type=int, nargs='*', help="upper bounds of k of the tensor buckets")
+    parser.add_argument('--parallel-branches', action='store_true')
+    parser.add_argument('--exact-times', action='store_true',
+                        help="DBs/DBf with the UTC instants of the .g in µs instead of the prefix_log wall-clock "
+                             "seconds (default, matches the existing files)")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', default='python', choices=['python', 'parallel', 'chunked'],
+                        help="how prefixes and DBs/DBf are computed (same output, not part of the cache key)")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--memory-budget', type=float, default=1024)
+    parser.add_argument('--driver', default='auto', choices=['auto', 'neo4j', 'standin'])
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--reset-database', action='store_true',
+                        help="delete the :Event nodes before the import")
+    parser.add_argument('--jobs', type=int, help="stages run at the same time (default: all the cores)")
+    parser.add_argument('--force', nargs='*', default=[], help="stages to run even if cached")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--cache-size', type=float, default=4096, help="MB kept in the cache (default: 4096)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    args = parser.parse_args(argv)
+    args.targets = args.targets or DEFAULT_TARGETS
+    unknown = set(args.targets + args.force) - set(DEFAULT_TARGETS + NEO4J_TARGETS)
+    if unknown:
+        parser.error(f"unknown stages: {sorted(unknown)}")
+
+    driver = None
+    if set(NEO4J_TARGETS) & set(args.targets):
+        driver, _ = connect(args.driver)
+    try:
+        stages = pipeline_stages(args, driver)
+        outputs = run_pipeline(stages, args.targets, StageCache(args.cache_dir, args.cache_size), args.jobs,
+                               args.force)
+    finally:
+        if driver is not None:
+            driver.close()
+    publish(outputs, args.output_dir)
+    for name, entry in outputs.items():
+        print(f"{name}: {os.path.join(args.output_dir, name)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
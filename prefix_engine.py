@@ -0,0 +1,95 @@
+import time
+
+import pandas as pd
+
+from graph_reader import read_graphs
+from instrumentation import instrumented
+from prefix_table import PrefixTableBuilder
+from timestamps import parse_wall_clock
+
+LOG_COLUMNS = ['activity_id', 'event_name', 'track_id', 'start_time', 'finish_time', 'resource']
+
+
+def parse_log_times(log):
+    # node properties as they are stored in Neo4j by import_data: offset dropped, time read as UTC.
+    # Both columns become int64 epoch microseconds
+    for column in ['start_time', 'finish_time']:
+        log[column] = parse_wall_clock(log[column])
+    return log
+
+
+def read_event_log(log_path, track_ids=None):
+    log = pd.read_csv(log_path, header=None, names=LOG_COLUMNS, dtype=str)
+    if track_ids is not None:
+        log = log[log['track_id'].isin(track_ids)]
+    log = parse_log_times(log)
+
+    events = {}
+    for track_id, activity_id, start_time, resource, event_name, finish_time in zip(
+            log['track_id'], log['activity_id'].astype(int).tolist(), log['start_time'].tolist(), log['resource'],
+            log['event_name'], log['finish_time'].tolist()):
+        events.setdefault(track_id, {})[activity_id] = (start_time, resource, event_name, finish_time)
+    return events
+
+
+def load_cases(graphs_path='data/graphs.g', log_path='data/prefixes/prefix_log_100.csv'):
+    return cases_from_graphs(read_graphs(graphs_path), log_path)
+
+
+def cases_from_graphs(graphs, log_path):
+    graphs = list(graphs)
+    events = read_event_log(log_path, {graph.track_id for graph in graphs}) if log_path else {}
+
+    cases = []
+    for graph in graphs:
+        track_events = events.get(graph.track_id, {})
+        nodes = []
+        previous_finish = None
+        for activity_id, event_name, finish in graph.vertices():
+            if activity_id in track_events:
+                nodes.append(track_events[activity_id])
+            else:
+                # senza log si usa il tempo del .g e la fine dell'attività precedente come inizio
+                nodes.append((previous_finish if previous_finish is not None else finish, None, event_name, finish))
+            previous_finish = nodes[-1][3]
+        cases.append((graph.track_id, nodes, list(graph.edge_pairs())))
+    return cases
+
+
+def add_prefixes(builder, cases, k):
+    # i prefissi di lunghezza k dei casi dati (tutti con più di k attività), nell'ordine dei casi
+    for track_id, nodes, edges in cases:
+        builder.add_prefix(track_id, k, [case_node(nodes, activity_id) for activity_id in range(1, k + 1)],
+                           [(node1, node2) for node1, node2 in edges if node1 <= k and node2 <= k],
+                           case_node(nodes, k + 1))
+
+
+def case_node(nodes, activity_id):
+    # dalle tuple (start_time, resource, event_name, finish_time) dei casi all'ordine di PrefixTableBuilder
+    start_time, resource, event_name, finish_time = nodes[activity_id - 1]
+    return activity_id, event_name, start_time, finish_time, resource
+
+
+@instrumented('prefix')
+def generate_prefixes(graphs_path='data/graphs.g', log_path='data/prefixes/prefix_log_100.csv',
+                      output_path='data/prefixes.csv', max_len=None, chunk_size=100000):
+    start = time.time()
+    cases = load_cases(graphs_path, log_path)
+    if max_len is None:
+        max_len = max(len(nodes) for _, nodes, _ in cases)
+
+    builder = PrefixTableBuilder(output_path, chunk_size)
+    # stesso ordine della versione Neo4j: prima per lunghezza k, poi per caso
+    active_cases = cases
+    for k in range(1, max_len - 1):
+        active_cases = [case for case in active_cases if len(case[1]) > k]
+        add_prefixes(builder, active_cases, k)
+    builder.close()
+
+    finish = time.time()
+    print(f"Time for prefix generation without Neo4j: {finish - start:.6f} seconds")
+    return builder.rows_written
+
+
+if __name__ == "__main__":
+    generate_prefixes(output_path='data/prefixes_python.csv')
@@ -0,0 +1,105 @@
+import os
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from timestamps import NAT, from_epoch_us, instant_to_epoch_us
+
+PREFIX_COLUMNS = ['e_v', 'start_time', 'resource', 'track_id', 'event_name', 'finish_time', 'node1', 'prefix_id',
+                  'node2']
+TIME_COLUMNS = ['start_time', 'finish_time']
+
+
+# Builds the DBp table (prefixes.csv) column by column: rows go to per-column buffers (int64 epoch microseconds for
+# the timestamps) and the DataFrame is materialised once by to_frame(), or streamed in chunks to output_path.
+class PrefixTableBuilder:
+
+    def __init__(self, output_path=None, chunk_size=100000, append=False, header=True):
+        self.output_path = output_path
+        self.chunk_size = chunk_size
+        self.event_names = {}
+        self.rows_written = 0
+        self._reset_buffers()
+        # in append le righe nuove vanno in coda a un prefixes.csv esistente, senza ripetere l'intestazione;
+        # header=False per i file parziali che vengono poi concatenati
+        self.header_written = not header or append and output_path is not None and os.path.exists(output_path) and \
+            os.path.getsize(output_path) > 0
+        if output_path is not None and os.path.exists(output_path) and not append:
+            os.remove(output_path)
+
+    def _reset_buffers(self):
+        self.columns = {column: [] for column in PREFIX_COLUMNS if column not in TIME_COLUMNS}
+        self.columns.update({column: array('q') for column in TIME_COLUMNS})
+
+    def __len__(self):
+        return len(self.columns['e_v'])
+
+    def _append(self, e_v, start_time=NAT, resource=None, track_id=None, event_name=None, finish_time=NAT,
+                node1=None, prefix_id=None, node2=None):
+        self.columns['e_v'].append(e_v)
+        self.columns['start_time'].append(start_time)
+        self.columns['resource'].append(resource)
+        self.columns['track_id'].append(track_id)
+        self.columns['event_name'].append(event_name)
+        self.columns['finish_time'].append(finish_time)
+        self.columns['node1'].append(node1)
+        self.columns['prefix_id'].append(prefix_id)
+        self.columns['node2'].append(node2)
+        if self.output_path is not None and len(self) >= self.chunk_size:
+            self.flush()
+
+    def add_separator(self):
+        # riga vuota + riga XP che precedono ogni prefisso
+        self._append(None)
+        self._append('XP')
+
+    def add_node(self, e_v, prefix_id, track_id, activity_id, event_name, start_time, finish_time, resource):
+        # il primo nome visto per (track_id, activity_id) è quello usato per gli archi
+        self.event_names.setdefault(track_id, {}).setdefault(activity_id, event_name)
+        # i tempi arrivano già come interi dal motore Python; oggetti datetime solo dai percorsi Neo4j
+        self._append(e_v, instant_to_epoch_us(start_time), resource, track_id, event_name,
+                     instant_to_epoch_us(finish_time), str(activity_id), prefix_id)
+
+    def add_edge(self, prefix_id, track_id, node1, node2):
+        names = self.event_names[track_id]
+        self._append('e', track_id=track_id, event_name=names[node1] + "__" + names[node2], node1=str(node1),
+                     prefix_id=prefix_id, node2=str(node2))
+
+    def add_prefix(self, track_id, k, nodes, edges, label):
+        # un prefisso completo, uguale per tutti i percorsi: separatore, nodi 'v' 1..k, archi tra questi nodi,
+        # etichetta 'l' (l'attività k + 1); nodes e label sono tuple (activity_id, event_name, start_time,
+        # finish_time, resource)
+        prefix_id = track_id + "_" + str(k)
+        self.add_separator()
+        for node in nodes:
+            self.add_node('v', prefix_id, track_id, *node)
+        for node1, node2 in edges:
+            self.add_edge(prefix_id, track_id, node1, node2)
+        self.add_node('l', prefix_id, track_id, *label)
+        return prefix_id
+
+    def _buffer_frame(self):
+        frame = pd.DataFrame({column: self.columns[column] for column in PREFIX_COLUMNS if column not in TIME_COLUMNS},
+                             columns=PREFIX_COLUMNS)
+        for column in TIME_COLUMNS:
+            frame[column] = from_epoch_us(np.frombuffer(self.columns[column], dtype=np.int64)).array
+        return frame
+
+    def flush(self):
+        if self.output_path is None or len(self) == 0:
+            return
+        self._buffer_frame().to_csv(self.output_path, mode='a', index=False, header=not self.header_written)
+        self.header_written = True
+        self.rows_written += len(self)
+        self._reset_buffers()
+
+    def to_frame(self):
+        return self._buffer_frame()
+
+    def close(self):
+        # scrive le righe rimaste; un file vuoto ha comunque l'intestazione
+        if self.output_path is not None and not self.header_written and len(self) == 0:
+            pd.DataFrame(columns=PREFIX_COLUMNS).to_csv(self.output_path, index=False)
+            self.header_written = True
+        self.flush()
@@ -1,29 +1,110 @@
 import os
-import random
 import time
 
 import numpy as np
 import pandas as pd
-import pytz
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 import neo4j
-from datetime import datetime
+
+from graph_csr import CaseGraphs
+from graph_reader import read_graphs
+from instrumentation import instrumented
+from neo4j_loader import Neo4jBulkLoader
+from prefix_table import PrefixTableBuilder
+from snapshot_query import SnapshotQueryService
+from timestamps import NAT, US_PER_SECOND, cypher_datetime, cypher_epoch_us, from_epoch_us, instant_to_epoch_us
+
+
+# proiezioni: solo le proprietà usate invece dei Node e Relationship completi, con i tempi già interi (µs UTC)
+def node_projection(variable):
+    return (f"{variable} {{.track_id, .activity_id, .event_name, .resource, "
+            f"start_time: {cypher_epoch_us(variable + '.start_time')}, "
+            f"finish_time: {cypher_epoch_us(variable + '.finish_time')}}}")
+
+
+def projected_prefix_query(track_filter=''):
+    return ("MATCH (e:Event) WHERE e.activity_id <= $k" + track_filter + " "
+            "WITH collect(e) AS p_nodes, e.track_id AS track_id "
+            "WHERE size(p_nodes) = $k "
+            "UNWIND p_nodes AS node1 "
+            "UNWIND p_nodes AS node2 "
+            "OPTIONAL MATCH (node1)-[r]-(node2) "
+            "WITH p_nodes, track_id, collect(DISTINCT r.connection) AS connections "
+            "MATCH (l:Event) WHERE l.activity_id = $k + 1 AND l.track_id = track_id "
+            "RETURN track_id, [n IN p_nodes | " + node_projection('n') + "] AS nodes, connections, " +
+            node_projection('l') + " AS label")
+
+
+STREAM_PREFIX_QUERY = projected_prefix_query()
+# i nodi raggiungibili da START hanno già l'inizio del caso (neo4j_loader.MERGE_CASE_METADATA): una scansione
+# lineare invece di tutti i cammini (START)-[*]->(); l'ordine (track_id, activity_id) è quello dell'indice del vincolo
+ACTIVE_QUERY = ("MATCH (node:Event) WHERE node.reached_from_start "
+                "RETURN node.track_id AS track_id, node.activity_id AS index, " +
+                cypher_epoch_us('node.case_start_time') + " AS start_time_prefix, " +
+                cypher_epoch_us('node.finish_time') + " AS finish_time_last_activity "
+                "ORDER BY track_id, index")
+# prefisso attivo di ogni caso all'istante $f_prefix (µs): ricerca sull'indice di finish_time, poi un'espansione
+# per nodo verso i successori già conclusi
+ACTIVE_CASE_QUERY = ("WITH " + cypher_datetime('$f_prefix') + " AS f_prefix "
+                     "MATCH (e:Event) WHERE e.finish_time <= f_prefix AND e.reached_from_start "
+                     "WITH f_prefix, e.track_id AS track_id, collect(e) AS nodes "
+                     "UNWIND nodes AS node "
+                     "OPTIONAL MATCH (node)-[r:NEXT]->(next:Event) WHERE next.finish_time <= f_prefix "
+                     "WITH track_id, nodes, collect(r.connection) AS connections "
+                     "RETURN track_id + '_' + size(nodes) AS prefix_id, track_id, "
+                     "[n IN nodes | " + node_projection('n') + "] AS nodes, connections "
+                     "ORDER BY track_id")
+ACTIVE_COLUMNS = ['track_id', 'index', 'start_time_prefix', 'finish_time_last_activity']
+
+
+def property_node(properties):
+    # proprietà di un nodo Event nell'ordine di PrefixTableBuilder.add_prefix
+    return (int(properties['activity_id']), properties['event_name'], properties['start_time'],
+            properties['finish_time'], properties['resource'])
+
+
+def connection_edge(connection):
+    # 'node1_node2:...' -> (node1, node2)
+    connected_nodes = connection.split(':')[0].split('_')
+    return int(connected_nodes[0]), int(connected_nodes[1])
+
+
+def add_prefix_record(prefixes, k, record):
+    # un record di STREAM_PREFIX_QUERY / async_neo4j.PREFIX_QUERY
+    prefixes.add_prefix(record['track_id'], k, [property_node(node) for node in record['nodes']],
+                        [connection_edge(connection) for connection in record['connections']],
+                        property_node(record['label']))
 
 
 class ActiveCaseGeneration:
 
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri=None, user=None, password=None, driver=None):
+        # driver già pronto (ad esempio standin_driver.StandInDriver) oppure connessione a uri
+        self.driver = GraphDatabase.driver(uri, auth=(user, password)) if driver is None else driver
 
     def close(self):
         self.driver.close()
 
-    def create_prefixes(self):
+    def stream_records(self, query, parameters=None, fetch_size=1000):
+        # i record arrivano dal server a blocchi di fetch_size man mano che vengono consumati
+        with self.driver.session(database="neo4j", fetch_size=fetch_size) as session:
+            yield from session.run(query, parameters)
+
+    @instrumented('prefix')
+    def create_prefixes(self, output_path='data/prefixes.csv', streaming=True, fetch_size=1000):
         start = time.time()
-        prefixes = pd.DataFrame()
+        prefixes = PrefixTableBuilder(output_path)
         max_len = self.driver.execute_query("MATCH (n:Event) RETURN max(n.activity_id) AS max_activity_id")[0][0][0]
-        # Concatenating the empty row to the existing DataFrame
+        if streaming:
+            # ogni record diventa subito righe del builder, che scrive su disco ogni chunk_size righe
+            for k in range(1, max_len - 1):
+                for record in self.stream_records(STREAM_PREFIX_QUERY, {'k': k}, fetch_size):
+                    add_prefix_record(prefixes, k, record)
+            prefixes.close()
+            print(f"Time for prefix generation: {time.time() - start:.6f} seconds")
+            return
+        # one query per prefix length k, rows go straight into the column buffers
         for k in range(1, max_len - 1):
             result = self.driver.execute_query(f"MATCH (e:Event) WHERE e.activity_id <= {k} "
                                                f"WITH collect(e) AS p_nodes, e.track_id as track_id "
@@ -39,195 +120,157 @@ class ActiveCaseGeneration:
                                                result_transformer_=neo4j.Result.to_df)
 
             for i in range(0, len(result)):
-                prefix_id = result['track_id'][i] + "_" + str(k)
-                prefixes = prefixes.reindex(range(len(prefixes) + 1))
-                prefixes = pd.concat([prefixes, pd.DataFrame({'e_v': ['XP']})], ignore_index=True)
-                for j in list(result.columns):
-                    if j != "track_id":
-                        flattened_data = result[j][i]
-                        data = [self.extract_properties(el) for el in flattened_data]
-                        if j == 'label':
-                            data[0]['node1'] = str(int(data[0].pop('activity_id')))
-                            data[0]['prefix_id'] = prefix_id
-                            data[0]['e_v'] = "l"
-                            prefixes = pd.concat([prefixes, pd.DataFrame(data)], ignore_index=True)
-                        if j == 'p_nodes':
-                            for node in data:
-                                node['node1'] = str(int(node.pop('activity_id')))
-                                node['prefix_id'] = prefix_id
-                                node['e_v'] = "v"
-                            prefixes = pd.concat([prefixes, pd.DataFrame(data)], ignore_index=True)
-                        if j == 'p_rels' and data != []:
-                            for rel in data:
-                                # for node 1 and node 2
-                                connnected_nodes = rel['connection'].split(':')[0].split('_')
-                                node1 = str(int(connnected_nodes[0]))
-                                node2 = str(int(connnected_nodes[1]))
-                                new_key1 = 'node1'
-                                new_key2 = 'node2'
-                                rel[new_key1] = str(int(node1))
-                                rel[new_key2] = str(int(node2))
-                                del rel['connection']
-                                # for track id
-                                rel['prefix_id'] = prefix_id
-                                rel['track_id'] = result['track_id'][i]
-                                rel['event_name'] = (
-                                        str(prefixes[(prefixes['node1'] == node1)
-                                                     & (prefixes['track_id'] == result['track_id'][i])]
-                                            ['event_name']).split()[1]
-                                        + "__" +
-                                        str(prefixes[(prefixes['node1'] == node2)
-                                                     & (prefixes['track_id'] == result['track_id'][i])]
-                                            ['event_name']).split()[1])
-                                rel['e_v'] = "e"
-                            prefixes = pd.concat([prefixes, pd.DataFrame(data)], ignore_index=True)
-        prefixes['start_time'] = pd.to_datetime(prefixes['start_time'].
-                                                apply(lambda x: x.to_native() if pd.notna(x) else None))
-        prefixes['finish_time'] = pd.to_datetime(prefixes['finish_time'].
-                                                 apply(lambda x: x.to_native() if pd.notna(x) else None))
-        prefixes.to_csv('data/prefixes.csv', index=False)
+                prefixes.add_prefix(
+                    result['track_id'][i], k,
+                    [property_node(self.extract_properties(node)) for node in result['p_nodes'][i]],
+                    [connection_edge(self.extract_properties(rel)['connection']) for rel in result['p_rels'][i]],
+                    property_node(self.extract_properties(result['label'][i][0])))
+        prefixes.close()
         finish = time.time()
         print(f"Time for prefix generation: {finish - start:.6f} seconds")
 
     def extract_properties(self, node):
         return node._properties
 
+    @instrumented('query', sample=False)
     def generate_active_case(self, s_prefix, f_prefix):
+        # s_prefix resta nella firma: la vecchia condizione (start <= s_prefix OR start >= s_prefix) chiedeva solo
+        # che il caso avesse un inizio, cioè che i nodi fossero raggiungibili da START
         start = time.time()
-        print(start)
 
         # se ci sono due attività parallele finali, viene ritornato solo il prefisso di lunghezza maggiore
-        result = self.driver.execute_query(
-            f"MATCH (s:Event), (e:Event) "
-            f"WHERE s.event_name='START' s.track_id = e.track_id AND (s.start_time <= {s_prefix} OR "
-            f"s.start_time >= {s_prefix}) AND e.finish_time <= {f_prefix} AND e.track_id='173715' "
-            f"WITH COLLECT(e) as nodes, s "
-            f"UNWIND nodes as node1 "
-            f"UNWIND nodes as node2 "
-            f"OPTIONAL MATCH (node1)-[r]-(node2) "
-            f"RETURN DISTINCT nodes, COLLECT(DISTINCT r), s.track_id+'_'+size(nodes) as prefix_id",
-            database_="neo4j")
+        result = self.driver.execute_query(ACTIVE_CASE_QUERY, parameters_={'f_prefix': instant_to_epoch_us(f_prefix)},
+                                           database_="neo4j")
 
         end = time.time()
         time_taken = end - start
         return result, time_taken
 
-    def active_activity_neo4j(self):
+    @instrumented('active_case')
+    def active_activity_neo4j(self, output_path='data/active_activities_Neo4j.csv', streaming=True,
+                              batch_size=10000):
         start_time = time.time()
-        result = self.driver.execute_query(
-            "MATCH p = (activity: Event{event_name:'START'})-[*]->(track: Event) "
-            "WITH apoc.coll.flatten(collect(nodes(p))) as nodes, activity.start_time AS start_time_prefix, activity "
-            "UNWIND nodes as node "
-            "RETURN DISTINCT node.track_id as track_id, node.activity_id as index, start_time_prefix, "
-            "node.finish_time as finish_time_last_activity ",
-            database_="neo4j",
-            result_transformer_=neo4j.Result.to_df
-        )
-        result['start_time_prefix'] = pd.to_datetime(result['start_time_prefix'].
-                                                     apply(lambda x: x.to_native() if pd.notna(x) else None))
-        result['finish_time_last_activity'] = pd.to_datetime(result['finish_time_last_activity'].
-                                                             apply(lambda x: x.to_native() if pd.notna(x) else None))
-        result.to_csv('data/active_activities_Neo4j.csv', index=False)
+        if streaming:
+            rows = []
+            written = 0
+            for record in self.stream_records(ACTIVE_QUERY, fetch_size=batch_size):
+                rows.append(tuple(record))
+                if len(rows) >= batch_size:
+                    written += self.write_active_batch(rows, output_path, header=written == 0)
+                    rows = []
+            written += self.write_active_batch(rows, output_path, header=written == 0)
+            print(f"Active activities execution time with Neo4j: {time.time() - start_time:.6f} seconds")
+            return written
+
+        result = self.driver.execute_query(ACTIVE_QUERY, database_="neo4j", result_transformer_=neo4j.Result.to_df)
+        for column in ['start_time_prefix', 'finish_time_last_activity']:
+            result[column] = epoch_us_column(result[column])
+        result.to_csv(output_path, index=False)
 
         end = time.time()
         elapsed_time = end - start_time
         print(f"Active activities execution time with Neo4j: {elapsed_time:.6f} seconds")
         return result
 
-    def import_data(self):
-        start_time = time.time()
-        result = self.driver.execute_query(
-            "LOAD CSV FROM 'file:///prefix_log_2000.csv' "
-            "AS row MERGE (:Event{activity_id:toInteger(row[0]), "
-            "event_name:row[1], track_id:row[2], "
-            "start_time:datetime(apoc.text.replace(apoc.text.replace(row[3], '\+\d{2}:\d{2}$', ''), ' ', 'T')), "
-            "finish_time:datetime(apoc.text.replace(apoc.text.replace(row[4], '\+\d{2}:\d{2}$', ''), ' ', 'T')), "
-            "resource:row[5]}) ",
-            database_="neo4j",
-        )
-        end = time.time()
-        elapsed_time = end - start_time
-        print(f"{elapsed_time:.6f} seconds (2000)")
-        return result
-
-
-def active_case_and_final_activity_dbs():
+    def write_active_batch(self, rows, output_path, header):
+        # conversione dei tempi una volta per batch; l'intestazione solo con il primo
+        if not rows and not header:
+            return 0
+        batch = pd.DataFrame(rows, columns=ACTIVE_COLUMNS)
+        for column in ['start_time_prefix', 'finish_time_last_activity']:
+            batch[column] = epoch_us_column(batch[column])
+        batch.to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+        return len(batch)
+
+    def import_data(self, log_path='data/prefixes/prefix_log_2000.csv', batch_size=5000):
+        return Neo4jBulkLoader(self.driver, batch_size=batch_size).load_events(log_path)
+
+    def import_edges(self, graphs_path='data/graphs.g', batch_size=5000, workers=4):
+        return Neo4jBulkLoader(self.driver, batch_size=batch_size).load_edges(graphs_path, workers)
+
+
+def epoch_us_column(values):
+    # interi µs restituiti dalla query (null per i tempi mancanti) -> colonna datetime UTC
+    return from_epoch_us(pd.to_numeric(values).fillna(NAT).to_numpy(np.int64)).array
+
+
+def effective_start_times(graphs, finish, parallel_branches=False):
+    # calculates effective start times: la fine dell'attività precedente nel file, la propria per l'attività 1.
+    # Tempi int64 in microsecondi, NAT se mancanti
+    node_counts = np.diff(graphs.node_offsets)
+    first = graphs.node_offsets[:-1][node_counts > 0]
+    previous = np.r_[NAT, finish[:-1]]
+    # prima del primo nodo di un caso c'erano le righe degli archi del caso precedente (senza tempo)
+    edges_before = np.r_[0, np.diff(graphs.edge_offsets)][:-1][node_counts > 0] > 0
+    previous[first[edges_before | (first == 0)]] = NAT
+    start = np.where(graphs.activity_id == 1, finish, previous)
+    if not parallel_branches:
+        return start, finish
+
+    # archi che partono da un nodo con più di un successore (attività parallele): riduzione vettoriale sul CSR
+    parallel = graphs.parallel_edges()
+    sources = graphs.node_positions(graphs.case_of_edge[parallel], graphs.node1[parallel])
+    targets = graphs.node_positions(graphs.case_of_edge[parallel], graphs.node2[parallel])
+    valid = (sources >= 0) & (targets >= 0)
+    sources, targets = sources[valid], targets[valid]
+    if len(targets) == 0:
+        return start, finish
+    # l'attività parallela inizia quando finisce il nodo da cui parte la biforcazione
+    start = start.copy()
+    start[targets] = finish[sources]
+
+    # la sua fine diventa il minimo tempo di inizio tra i nodi di destinazione dei suoi archi (NAT esclusi)
+    edge_sources = graphs.node_positions(graphs.case_of_edge, graphs.node1)
+    edge_targets = graphs.node_positions(graphs.case_of_edge, graphs.node2)
+    successors = np.isin(edge_sources, targets) & (edge_targets >= 0)
+    has_successors = np.bincount(edge_sources[successors], minlength=len(finish)) > 0
+    successors &= start[np.maximum(edge_targets, 0)] != NAT
+    minimum = np.full(len(finish), np.iinfo(np.int64).max)
+    np.minimum.at(minimum, edge_sources[successors], start[edge_targets[successors]])
+    has_times = np.bincount(edge_sources[successors], minlength=len(finish)) > 0
+    finish = np.where(has_successors, np.where(has_times, minimum, NAT), finish)
+    return start, finish
+
+
+def case_dbs(graphs, parallel_branches=False, exact_times=False):
+    # DBs e DBf dei grafi dati: (final_df, df) con le colonne di final_activities.csv e active_activities.csv.
+    # parallel_branches=False riproduce i file esistenti, in cui la correzione delle attività parallele non è
+    # mai stata applicata (le righe degli archi non avevano track_id).
+    # I tempi seguono la convenzione dei prefix_log (ora locale del .g letta come UTC, al secondo), così DBs/DBf
+    # restano confrontabili con DBp e uguali ai file esistenti; exact_times=True usa l'istante UTC del .g con i
+    # microsecondi. In entrambi i casi i valori passano dal codec µs di timestamps, cambia solo la risoluzione
+    graphs = CaseGraphs(graphs)
+    cases = np.repeat(np.arange(len(graphs)), np.diff(graphs.node_offsets))
+    track_ids = graphs.track_ids[cases]
+    finish = graphs.finish if exact_times else graphs.local_finish() // US_PER_SECOND * US_PER_SECOND
+
+    # inizio del caso: la fine dell'attività 1, per i nodi che la seguono nel file
+    first_activity = graphs.node_positions(np.arange(len(graphs)), np.ones(len(graphs)))[cases]
+    positions = np.arange(len(finish))
+    start_time_prefix = np.where((first_activity >= 0) & (positions >= first_activity),
+                                 finish[np.maximum(first_activity, 0)], NAT)
+
+    start, final_finish = effective_start_times(graphs, finish, parallel_branches)
+    event_names = np.array(graphs.event_names.names, dtype=object)
+    final_df = pd.DataFrame({'track_id': track_ids, 'index': graphs.activity_id,
+                             'event_name': event_names[graphs.event_code] if len(event_names) else [],
+                             'finish': from_epoch_us(final_finish).array,
+                             'start': from_epoch_us(start).array})
+
+    df = pd.DataFrame({'track_id': track_ids, 'index': graphs.activity_id,
+                       'start_time_prefix': from_epoch_us(start_time_prefix).array,
+                       'finish_time_last_activity': from_epoch_us(finish).array})
+    return final_df, df
+
+
+@instrumented('active_case')
+def active_case_and_final_activity_dbs(graphs_path='data/graphs.g', output_dir='data', parallel_branches=False,
+                                       exact_times=False):
     start_time = time.time()
 
-    with open('data/graphs.g', 'r') as file:
-        lines = file.readlines()
-
-    case_data = []
-    final_activities = []
-    start_time_prefix = None
-
-    for line in lines:
-        if line.startswith('v'):
-            parts = line.split()
-            if parts[1] == '1':
-                start_time_prefix = parts[3]
-
-            v = parts[0]
-            case_id = parts[4]
-            index = int(parts[1])
-            index2 = float('nan')
-            finish_time_activity = parts[3]
-            event_name = parts[2]
-            case_data.append((case_id, index, start_time_prefix, finish_time_activity))
-            final_activities.append((v, case_id, index, index2, event_name, finish_time_activity))
-
-        if line.startswith('e'):
-            parts = line.split()
-            e = parts[0]
-            case_id = float('nan')
-            event_name = parts[3]
-            finish_time_activity = float('nan')
-            index = int(parts[1])
-            index2 = int(parts[2])
-            final_activities.append((e, case_id, index, index2, event_name, finish_time_activity))
-
-    # create dataframe and make conversions
-    final_df = pd.DataFrame(final_activities, columns=['e_v', 'track_id', 'node1', 'node2', 'event_name', 'finish'])
-    final_df['finish'] = final_df['finish'].apply(lambda x: str(x)[:18])
-    final_df['finish'] = (final_df['finish'].apply
-                          (lambda x: pd.to_datetime(x, format='%Y-%m-%d%H:%M:%S', utc=True) if not pd.isna(x) else x))
-
-    # calculates effective start times
-    final_df['start'] = final_df['finish'].shift(periods=1)
-    final_df['start'] = final_df.apply(lambda x: x['finish'] if x['node1'] == 1 else x['start'], axis=1)
-    parallel_df = final_df[final_df['e_v'] == 'e'].groupby(['node1', 'track_id']).filter(lambda x: len(x) > 1)
-    for index, row in parallel_df.iterrows():
-        # si prende il vertice corrispondente al nodo di partenza delle attività parallele correnti
-        mask = ((final_df[final_df['e_v'] == 'v']['node1'] == row['node1']) &
-                (final_df[final_df['e_v'] == 'v']['track_id'] == row['track_id']))
-        # si prende il tempo di fine di questo vertice
-        finish_time = final_df[final_df['e_v'] == 'v'].loc[mask, 'finish']
-        # si modifica il tempo di inizio dell'attività parallela con il tempo di fine dell'attività precedente
-        row_index = final_df[(final_df['track_id'] == row['track_id']) &
-                             (final_df['node1'] == row['node2']) & (final_df['e_v'] == 'v')].index
-        final_df.loc[row_index, 'start'] = finish_time.iloc[0]
-
-        # si crea una lista dei nodi di destinazione delle attività parallele correnti
-        node2_name = list(final_df[(final_df['track_id'] == row['track_id']) &
-                                   (final_df['node1'] == row['node2']) & (final_df['e_v'] == 'e')]['node2'])
-        node2_info = final_df[(final_df['track_id'] == row['track_id']) &
-                              (final_df['node1'].isin(node2_name)) & (final_df['e_v'] == 'v')]
-        # si calcola il tempo di inizio minimo tra i nodi di destinazione identificati
-        min_time = node2_info['start'].min()
-        final_df.loc[row_index, 'finish'] = node2_info[node2_info['start'] == min_time]['start'].iloc[0]
-
-    final_df = final_df[final_df['e_v'] != 'e']
-    final_df = final_df.drop(columns=['node2', 'e_v'])
-    final_df = final_df.rename(columns={"node1": "index"})
-    final_df.to_csv('data/final_activities.csv', index=False)
-
-    df = pd.DataFrame(case_data, columns=['track_id', 'index', 'start_time_prefix', 'finish_time_last_activity'])
-    df['start_time_prefix'] = df['start_time_prefix'].apply(lambda x: str(x)[:18])
-    df['start_time_prefix'] = pd.to_datetime(df['start_time_prefix'], format='%Y-%m-%d%H:%M:%S', utc=True)
-    df['finish_time_last_activity'] = df['finish_time_last_activity'].apply(lambda x: str(x)[:18])
-    df['finish_time_last_activity'] = pd.to_datetime(df['finish_time_last_activity'], format='%Y-%m-%d%H:%M:%S',
-                                                     utc=True)
-    df.to_csv('data/active_activities.csv', index=False)
+    final_df, df = case_dbs(read_graphs(graphs_path), parallel_branches, exact_times)
+    final_df.to_csv(os.path.join(output_dir, 'final_activities.csv'), index=False)
+    df.to_csv(os.path.join(output_dir, 'active_activities.csv'), index=False)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
@@ -235,35 +278,8 @@ def active_case_and_final_activity_dbs():
 
 
 def get_prefix_information(s_prefix, f_prefix):
-    # read file DBs
-    active_activities = pd.read_csv('data/active_activities.csv')
-    active_activities['start_time_prefix'] = (active_activities['start_time_prefix'].
-                                              apply(lambda x: str(x).replace(" ", "")[:18]))
-    active_activities['start_time_prefix'] = pd.to_datetime(active_activities['start_time_prefix'],
-                                                            format='%Y-%m-%d%H:%M:%S', utc=True)
-    active_activities['finish_time_last_activity'] = (active_activities['finish_time_last_activity'].
-                                                      apply(lambda x: str(x).replace(" ", "")[:18]))
-    active_activities['finish_time_last_activity'] = pd.to_datetime(active_activities['finish_time_last_activity'],
-                                                                    format='%Y-%m-%d%H:%M:%S', utc=True)
-
-    # read file DBf
-    final_activities = pd.read_csv('data/final_activities.csv')
-    final_activities['start'] = (final_activities['start'].
-                                 apply(lambda x: str(x).replace(" ", "")[:18]))
-    final_activities['start'] = pd.to_datetime(final_activities['start'], format='%Y-%m-%d%H:%M:%S', utc=True)
-    final_activities['finish'] = (final_activities['finish'].
-                                  apply(lambda x: str(x).replace(" ", "")[:18]))
-    final_activities['finish'] = pd.to_datetime(final_activities['finish'], format='%Y-%m-%d%H:%M:%S', utc=True)
-
-    # read file DBp
-    prefixes = pd.read_csv('data/prefixes.csv')
-
-    active_prefixes = active_activities[((active_activities['start_time_prefix'] <= s_prefix) |
-                                         (active_activities['start_time_prefix'] >= s_prefix)) &
-                                        (active_activities['finish_time_last_activity'] <= f_prefix)]
-    active_prefixes_keys = active_prefixes.loc[active_prefixes.groupby('track_id')['finish_time_last_activity'].idxmax()][['track_id', 'index']]
-    maximal_active_prefixes = list(active_prefixes_keys['track_id'].astype(str) + '_' + active_prefixes_keys['index'].astype(str))
-    complete_prefixes = prefixes[prefixes['prefix_id'].isin(maximal_active_prefixes)]
+    # una sola query: per molte query conviene tenere in vita SnapshotQueryService
+    return SnapshotQueryService().get_prefix_information(s_prefix, f_prefix)
 
 
 if __name__ == "__main__":
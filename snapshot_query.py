@@ -0,0 +1,178 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar_store import ColumnarTable, is_table
+from instrumentation import instrumented
+from prefix_table import PREFIX_COLUMNS
+from timestamps import NAT, instant_to_epoch_us, instants_to_epoch_us, to_epoch_us
+
+
+class ActivePrefixes:
+    # risultato compatto di active_prefixes_at: per l'istante i gli id sono prefix_ids[offsets[i]:offsets[i + 1]]
+
+    def __init__(self, instants, offsets, prefix_ids):
+        self.instants = instants
+        self.offsets = offsets
+        self.prefix_ids = prefix_ids
+
+    def __len__(self):
+        return len(self.instants)
+
+    def __getitem__(self, position):
+        return list(self.prefix_ids[self.offsets[position]:self.offsets[position + 1]])
+
+    def items(self):
+        for position, instant in enumerate(self.instants):
+            yield instant, self[position]
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+class SnapshotQueryService:
+    # DBs, DBf e DBp caricati una volta sola; le query usano ricerche binarie invece di scansioni complete.
+    # Ogni percorso può essere un CSV o una tabella di columnar_store: dalla tabella si leggono solo le colonne
+    # usate, senza parsing dei tempi
+
+    @instrumented('query')
+    def __init__(self, active_path='data/active_activities.csv', final_path='data/final_activities.csv',
+                 prefixes_path='data/prefixes.csv'):
+        start = time.time()
+        self.load_active_activities(active_path)
+        self.load_final_activities(final_path)
+        self.load_prefixes(prefixes_path)
+        print(f"Snapshot query service startup: {time.time() - start:.6f} seconds")
+
+    def load_active_activities(self, active_path):
+        if is_table(active_path):
+            table = ColumnarTable(active_path)
+            arrays = table.read_arrays(['track_id', 'index', 'start_time_prefix', 'finish_time_last_activity'])
+            started = np.asarray(arrays['start_time_prefix']) != NAT
+            track_codes = np.asarray(arrays['track_id'])[started]
+            self.track_ids = pd.Index(table.decode('track_id', np.arange(len(table.dictionaries['track_id']))))
+            index = np.asarray(arrays['index'])[started]
+            finish = np.asarray(arrays['finish_time_last_activity'])[started]
+        else:
+            active_activities = pd.read_csv(active_path, dtype={'track_id': str})
+            # (start <= s_prefix OR start >= s_prefix) di get_prefix_information esclude solo gli inizi mancanti
+            active_activities = active_activities[active_activities['start_time_prefix'].notna()]
+            track_codes, self.track_ids = pd.factorize(active_activities['track_id'])
+            index = active_activities['index'].to_numpy()
+            finish = to_epoch_us(active_activities['finish_time_last_activity'])
+
+        # ordinamento stabile per (track, finish): a parità di finish resta la prima riga del file, come idxmax
+        order = np.lexsort((finish, track_codes))
+        self.track_code = track_codes[order]
+        self.finish = finish[order]
+        self.index = index[order]
+        self.track_offsets = np.searchsorted(self.track_code, np.arange(len(self.track_ids) + 1))
+
+        # chiave unica (track, rango del finish) per cercare in tutti i casi con una sola searchsorted
+        self.finish_values = np.unique(self.finish)
+        self.rank_base = len(self.finish_values) + 1
+        self.keys = self.track_code.astype(np.int64) * self.rank_base + np.searchsorted(self.finish_values,
+                                                                                        self.finish)
+        self.build_intervals()
+
+    def build_intervals(self):
+        # indice a intervalli: la riga r è il prefisso massimale del suo caso per finish_r <= t < finish successivo;
+        # l'ultima attività chiude il caso, quindi il suo intervallo è vuoto
+        first_of_ties = np.r_[True, self.keys[1:] != self.keys[:-1]]
+        rows = np.flatnonzero(first_of_ties)
+        same_track_next = np.r_[self.track_code[rows][1:] == self.track_code[rows][:-1], False]
+        self.interval_start = self.finish[rows]
+        self.interval_end = np.where(same_track_next, np.r_[self.finish[rows][1:], 0], self.finish[rows])
+        self.interval_prefix_id = np.array([f"{self.track_ids[track]}_{index}" for track, index in
+                                            zip(self.track_code[rows], self.index[rows])], dtype=object)
+
+    def load_final_activities(self, final_path):
+        if is_table(final_path):
+            table = ColumnarTable(final_path)
+            arrays = table.read_arrays()
+            final_activities = pd.DataFrame({'track_id': table.decode('track_id', arrays['track_id']),
+                                             'index': np.asarray(arrays['index']),
+                                             'event_name': table.decode('event_name', arrays['event_name']),
+                                             'finish': np.asarray(arrays['finish']),
+                                             'start': np.asarray(arrays['start'])})
+        else:
+            final_activities = pd.read_csv(final_path, dtype={'track_id': str})
+            final_activities['start'] = to_epoch_us(final_activities['start'])
+            final_activities['finish'] = to_epoch_us(final_activities['finish'])
+        self.final_activities = final_activities.sort_values(['track_id', 'index'], kind='stable')
+        self.final_offsets = {track_id: (rows[0], rows[-1] + 1) for track_id, rows in
+                              self.final_activities.groupby('track_id', sort=False).indices.items()}
+        self.final_activities = self.final_activities.reset_index(drop=True)
+
+    def load_prefixes(self, prefixes_path):
+        # ogni prefisso occupa un intervallo contiguo di righe: (prima riga, ultima riga + 1)
+        self.prefix_table = None
+        self.prefix_ranges = {}
+        if is_table(prefixes_path):
+            # solo la colonna prefix_id: le altre si leggono dalla tabella per le righe richieste
+            self.prefix_table = ColumnarTable(prefixes_path)
+            codes = np.asarray(self.prefix_table.read_arrays(['prefix_id'])['prefix_id'])
+            rows = np.flatnonzero(codes != -1)
+            prefix_ids = self.prefix_table.decode('prefix_id', codes[rows])
+        else:
+            self.prefixes = pd.read_csv(prefixes_path)
+            rows = np.flatnonzero(self.prefixes['prefix_id'].notna().to_numpy())
+            prefix_ids = self.prefixes['prefix_id'].to_numpy()[rows]
+        if len(rows) == 0:
+            return
+        changes = prefix_ids[1:] != prefix_ids[:-1]
+        first = np.r_[True, changes]
+        last = np.r_[changes, True]
+        self.prefix_ranges = dict(zip(prefix_ids[first], zip(rows[first], rows[last] + 1)))
+
+    def prefix_rows(self, rows):
+        if self.prefix_table is not None:
+            return self.prefix_table.take(rows, PREFIX_COLUMNS)
+        return self.prefixes.iloc[rows]
+
+    def maximal_positions(self, f_prefix):
+        # per ogni caso, l'ultima attività con finish <= f_prefix (la prima riga se ci sono pari merito)
+        bound = np.searchsorted(self.finish_values, instant_to_epoch_us(f_prefix), side='right')
+        tracks = np.arange(len(self.track_ids), dtype=np.int64)
+        last = np.searchsorted(self.keys, tracks * self.rank_base + bound, side='left') - 1
+        valid = last >= self.track_offsets[:-1]
+        last = last[valid]
+        return np.searchsorted(self.keys, self.keys[last], side='left')
+
+    def maximal_prefix_ids(self, s_prefix, f_prefix):
+        positions = self.maximal_positions(f_prefix)
+        return [f"{self.track_ids[track]}_{index}" for track, index in
+                zip(self.track_code[positions], self.index[positions])]
+
+    @instrumented('query', sample=False)
+    def active_prefixes_at(self, instants):
+        # casi in corso e loro prefisso massimale per tutti gli istanti insieme: ogni intervallo copre un
+        # blocco contiguo degli istanti ordinati, quindi bastano due searchsorted per intervallo
+        instants = list(instants)
+        queries = instants_to_epoch_us(instants)
+        order = np.argsort(queries, kind='stable')
+        sorted_queries = queries[order]
+        first = np.searchsorted(sorted_queries, self.interval_start, side='left')
+        last = np.searchsorted(sorted_queries, self.interval_end, side='left')
+        counts = np.maximum(last - first, 0)
+
+        intervals = np.repeat(np.arange(len(counts)), counts)
+        steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        query_positions = order[np.repeat(first, counts) + steps]
+        by_query = np.argsort(query_positions, kind='stable')
+        offsets = np.r_[0, np.cumsum(np.bincount(query_positions, minlength=len(instants)))]
+        return ActivePrefixes(instants, offsets, self.interval_prefix_id[intervals[by_query]])
+
+    def final_activities_of(self, track_id):
+        first, last = self.final_offsets.get(str(track_id), (0, 0))
+        return self.final_activities.iloc[first:last]
+
+    @instrumented('query', sample=False)
+    def get_prefix_information(self, s_prefix, f_prefix):
+        ranges = sorted(self.prefix_ranges[prefix_id] for prefix_id in self.maximal_prefix_ids(s_prefix, f_prefix)
+                        if prefix_id in self.prefix_ranges)
+        if not ranges:
+            return self.prefix_rows(np.empty(0, dtype=np.int64))
+        rows = np.concatenate([np.arange(first, last) for first, last in ranges])
+        return self.prefix_rows(rows)
@@ -0,0 +1,344 @@
+import asyncio
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+from neo4j import Record
+from neo4j.exceptions import TransientError
+from neo4j.time import DateTime
+
+from neo4j_loader import MERGE_CASE_METADATA, MERGE_EDGES, MERGE_EVENTS
+from queries import ACTIVE_CASE_QUERY, ACTIVE_QUERY
+from timestamps import instant_to_epoch_us
+
+# sostituto in-process del driver Neo4j per prove senza server (test e benchmark --driver standin). Riconosce solo
+# le query della pipeline (schema, import, prefissi, attività attive, casi attivi) e ne riscrive la semantica su
+# dizionari Python: non verifica la sintassi Cypher, per quella c'è tests/test_cypher.py
+
+PREFIX_QUERY = re.compile(r"MATCH \(e:Event\) WHERE e\.activity_id <= (\$k|\d+)")
+
+
+class StandInEntity:
+    # stessa interfaccia usata da create_prefixes per nodi e relazioni (node._properties)
+    __slots__ = ('_properties',)
+
+    def __init__(self, properties):
+        self._properties = properties
+
+    def __getitem__(self, key):
+        return self._properties[key]
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+
+class StandInGraph:
+
+    def __init__(self, transient_failures=0):
+        # transient_failures: le prime n query falliscono con un deadlock, per provare i tentativi ripetuti
+        self.lock = threading.Lock()
+        self.transient_failures = transient_failures
+        self.clear()
+
+    def clear(self):
+        # tracks: track_id -> {activity_id: nodo}; relationships: track_id -> {(node1, node2): relazione}
+        self.tracks = {}
+        self.relationships = {}
+
+    def node_count(self):
+        return sum(len(nodes) for nodes in self.tracks.values())
+
+    def merge_events(self, rows):
+        with self.lock:
+            for row in rows:
+                nodes = self.tracks.setdefault(row['track_id'], {})
+                node = nodes.get(row['activity_id'])
+                if node is None:
+                    node = nodes[row['activity_id']] = StandInEntity({'track_id': row['track_id'],
+                                                                      'activity_id': row['activity_id']})
+                node._properties.update(event_name=row['event_name'], start_time=to_neo4j_time(row['start_time']),
+                                        finish_time=to_neo4j_time(row['finish_time']), resource=row['resource'])
+
+    def merge_edges(self, rows):
+        with self.lock:
+            for row in rows:
+                nodes = self.tracks.get(row['track_id'], {})
+                # come i due MATCH di MERGE_EDGES: senza entrambi i nodi l'arco non viene creato
+                if row['node1'] not in nodes or row['node2'] not in nodes:
+                    continue
+                relationships = self.relationships.setdefault(row['track_id'], {})
+                relationship = relationships.setdefault((row['node1'], row['node2']), StandInEntity({}))
+                relationship._properties['connection'] = row['connection']
+
+    def max_activity_id(self):
+        return max((max(nodes) for nodes in self.tracks.values() if nodes), default=None)
+
+    def prefixes(self, k, track_ids=None):
+        # righe di create_prefixes: casi con tutte le attività 1..k e con l'attività k + 1 come etichetta
+        records = []
+        for track_id, nodes in self.tracks.items():
+            if track_ids is not None and track_id not in track_ids:
+                continue
+            if k + 1 not in nodes or any(activity_id not in nodes for activity_id in range(1, k + 1)):
+                continue
+            p_nodes = [nodes[activity_id] for activity_id in range(1, k + 1)]
+            p_rels = [relationship for (node1, node2), relationship in self.relationships.get(track_id, {}).items()
+                      if node1 <= k and node2 <= k]
+            records.append((p_nodes, p_rels, track_id, [nodes[k + 1]]))
+        return records, ['p_nodes', 'p_rels', 'track_id', 'label']
+
+    def projected_prefixes(self, k, track_ids=None):
+        # stessa query con le proiezioni di STREAM_PREFIX_QUERY: dizionari di proprietà (tempi in µs) e stringhe
+        # connection
+        records, _ = self.prefixes(k, track_ids)
+        return [(track_id, [projection(node) for node in p_nodes],
+                 [relationship['connection'] for relationship in p_rels], projection(label[0]))
+                for p_nodes, p_rels, track_id, label in records], ['track_id', 'nodes', 'connections', 'label']
+
+    def merge_case_metadata(self, rows):
+        with self.lock:
+            for row in rows:
+                nodes = self.tracks.get(row['track_id'], {})
+                if row['start'] not in nodes:
+                    continue
+                for activity_id in row['reached']:
+                    if activity_id in nodes:
+                        nodes[activity_id]._properties.update(case_start_time=nodes[row['start']]['start_time'],
+                                                              reached_from_start=True)
+
+    def reached_nodes(self, track_id):
+        return [node for _, node in sorted(self.tracks[track_id].items()) if node.get('reached_from_start')]
+
+    def active_activities(self):
+        # ACTIVE_QUERY: i nodi con i metadati del caso, in ordine (track_id, activity_id)
+        records = []
+        for track_id in sorted(self.tracks):
+            records.extend((track_id, node['activity_id'], epoch_us_or_none(node['case_start_time']),
+                            epoch_us_or_none(node['finish_time'])) for node in self.reached_nodes(track_id))
+        return records, ['track_id', 'index', 'start_time_prefix', 'finish_time_last_activity']
+
+    def active_cases(self, f_prefix):
+        # ACTIVE_CASE_QUERY: per caso i nodi conclusi entro f_prefix e gli archi tra questi
+        records = []
+        for track_id in sorted(self.tracks):
+            nodes = [node for node in self.reached_nodes(track_id) if node['finish_time'] is not None and
+                     instant_to_epoch_us(node['finish_time']) <= f_prefix]
+            if not nodes:
+                continue
+            finished = {node['activity_id'] for node in nodes}
+            connections = [relationship['connection'] for (node1, node2), relationship in
+                           self.relationships.get(track_id, {}).items() if node1 in finished and node2 in finished]
+            records.append((f"{track_id}_{len(nodes)}", track_id, [projection(node) for node in nodes], connections))
+        return records, ['prefix_id', 'track_id', 'nodes', 'connections']
+
+    def run(self, query, parameters):
+        query = query.strip()
+        with self.lock:
+            if self.transient_failures > 0:
+                self.transient_failures -= 1
+                raise TransientError("Neo.TransientError.Transaction.DeadlockDetected")
+        if query.startswith(('CREATE CONSTRAINT', 'CREATE INDEX', 'CALL db.awaitIndexes')):
+            return [], []
+        if query == MERGE_EVENTS:
+            self.merge_events(parameters['rows'])
+            return [], []
+        if query == MERGE_EDGES:
+            self.merge_edges(parameters['rows'])
+            return [], []
+        if query == MERGE_CASE_METADATA:
+            self.merge_case_metadata(parameters['rows'])
+            return [], []
+        if query == ACTIVE_QUERY:
+            return self.active_activities()
+        if query == ACTIVE_CASE_QUERY:
+            return self.active_cases(parameters['f_prefix'])
+        if 'DETACH DELETE' in query:
+            with self.lock:
+                self.clear()
+            return [], []
+        if 'max(n.activity_id)' in query:
+            return [(self.max_activity_id(),)], ['max_activity_id']
+        if query.startswith('MATCH (e:Event) RETURN DISTINCT e.track_id'):
+            return [(track_id,) for track_id in sorted(self.tracks)], ['track_id']
+        match = PREFIX_QUERY.match(query)
+        if match:
+            k = parameters['k'] if match.group(1) == '$k' else int(match.group(1))
+            track_ids = set(parameters['track_ids']) if '$track_ids' in query else None
+            if 'AS connections' in query:
+                return self.projected_prefixes(k, track_ids)
+            return self.prefixes(k, track_ids)
+        raise NotImplementedError(f"query not supported by the stand-in driver: {query[:80]}")
+
+
+def to_neo4j_time(value):
+    # il driver vero restituisce neo4j.time.DateTime per le proprietà datetime; gli interi sono µs UTC, come in
+    # timestamps.cypher_datetime
+    if value is None or isinstance(value, DateTime):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return DateTime.from_native(pd.Timestamp(int(value), unit='us', tz='UTC').to_pydatetime())
+    return DateTime.from_native(pd.Timestamp(value).to_pydatetime())
+
+
+def epoch_us_or_none(value):
+    # cypher_epoch_us su una proprietà mancante restituisce null
+    return None if value is None else instant_to_epoch_us(value)
+
+
+def projection(node):
+    # queries.node_projection: solo le proprietà elencate, con i tempi in µs
+    properties = {name: node.get(name) for name in ['track_id', 'activity_id', 'event_name', 'resource']}
+    for name in ['start_time', 'finish_time']:
+        properties[name] = epoch_us_or_none(node.get(name))
+    return properties
+
+
+class StandInResult:
+
+    def __init__(self, records, keys):
+        # neo4j.Record come il driver vero: accesso per posizione e per nome
+        self.records = [Record(zip(keys, values)) for values in records]
+        self.keys = keys
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def consume(self):
+        return None
+
+    def to_df(self):
+        return pd.DataFrame([tuple(record) for record in self.records], columns=self.keys)
+
+
+class StandInTransaction:
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def run(self, query, parameters=None, **kwargs):
+        return StandInResult(*self.graph.run(query, dict(parameters or {}, **kwargs)))
+
+
+class StandInSession:
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **kwargs):
+        return StandInTransaction(self.graph).run(query, parameters, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        return work(StandInTransaction(self.graph), *args, **kwargs)
+
+    def execute_read(self, work, *args, **kwargs):
+        return work(StandInTransaction(self.graph), *args, **kwargs)
+
+
+class StandInDriver:
+
+    def __init__(self, graph=None):
+        self.graph = StandInGraph() if graph is None else graph
+
+    def session(self, database=None, **kwargs):
+        return StandInSession(self.graph)
+
+    def execute_query(self, query, parameters_=None, database_=None, result_transformer_=None, **kwargs):
+        result = StandInTransaction(self.graph).run(query, parameters_, **kwargs)
+        if result_transformer_ is not None:
+            # neo4j.Result.to_df e simili: si applica il metodo omonimo del risultato locale
+            return getattr(result, result_transformer_.__name__)()
+        return result.records, None, result.keys
+
+    def verify_connectivity(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class AsyncStandInSession:
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        pass
+
+    async def run(self, query, parameters=None, **kwargs):
+        await self.driver.round_trip()
+        return StandInTransaction(self.driver.graph).run(query, parameters, **kwargs)
+
+    async def execute_write(self, work, *args, **kwargs):
+        return await work(AsyncStandInTransaction(self.driver), *args, **kwargs)
+
+    async def execute_read(self, work, *args, **kwargs):
+        return await work(AsyncStandInTransaction(self.driver), *args, **kwargs)
+
+
+class AsyncStandInTransaction:
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def run(self, query, parameters=None, **kwargs):
+        await self.driver.round_trip()
+        return AsyncStandInResult(StandInTransaction(self.driver.graph).run(query, parameters, **kwargs))
+
+
+class AsyncStandInResult:
+
+    def __init__(self, result):
+        self.result = result
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for record in self.result.records:
+            yield record
+
+    async def consume(self):
+        return None
+
+
+class AsyncStandInDriver:
+    # versione asyncio: latency simula il tempo di andata e ritorno verso il server, senza occupare il loop
+
+    def __init__(self, graph=None, latency=0.0):
+        self.graph = StandInGraph() if graph is None else graph
+        self.latency = latency
+
+    async def round_trip(self):
+        await asyncio.sleep(self.latency)
+
+    def session(self, database=None, **kwargs):
+        return AsyncStandInSession(self)
+
+    async def execute_query(self, query, parameters_=None, database_=None, result_transformer_=None, **kwargs):
+        await self.round_trip()
+        result = StandInTransaction(self.graph).run(query, parameters_, **kwargs)
+        if result_transformer_ is not None:
+            return getattr(result, result_transformer_.__name__)()
+        return result.records, None, result.keys
+
+    async def verify_connectivity(self):
+        return None
+
+    async def close(self):
+        pass
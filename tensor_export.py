@@ -0,0 +1,264 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from compact_prefixes import NO_RESOURCE, load_store_arrays, store_arrays
+from instrumentation import instrumented
+from prefix_engine import load_cases
+from timestamps import NAT, US_PER_SECOND
+
+# i prefissi di prefixes.csv come tensori pronti per l'addestramento: per ogni gruppo di lunghezze (bucket) un
+# file .npy per array, scritto con open_memmap e letto con mmap_mode='r' senza parsing né copie.
+# Codici: 0 è il padding (e "nessuna risorsa"), i valori dei dizionari partono da 1.
+# Tempi in secondi (float32): per ogni nodo tempo dall'inizio del caso, dalla fine dell'attività precedente e
+# durata; per l'etichetta tempo alla prossima fine e tempo residuo del caso. Tempi mancanti -> 0
+
+NODE_TIME_COLUMNS = ['elapsed', 'since_previous', 'duration']
+LABEL_TIME_COLUMNS = ['next', 'remaining']
+
+
+def default_buckets(max_k):
+    # limiti superiori di k a potenze di due: il padding spreca al più metà di ogni riga
+    bounds = [1]
+    while bounds[-1] < max_k:
+        bounds.append(bounds[-1] * 2)
+    return bounds
+
+
+def vocabulary(values, previous=None):
+    # dizionario con '' al codice 0; con previous (il dizionario di un export precedente) i codici già assegnati
+    # restano uguali e i valori nuovi vengono aggiunti in coda
+    names = [''] if previous is None else [str(name) for name in previous]
+    known = {name: code for code, name in enumerate(names)}
+    for value in values:
+        if str(value) not in known:
+            known[str(value)] = len(names)
+            names.append(str(value))
+    return np.array(names, dtype=str), known
+
+
+def recode(codes, values, known):
+    # codici dello store (da 0, NO_RESOURCE se mancante) -> codici del dizionario dei tensori
+    mapping = np.array([known[str(value)] for value in values] + [0], dtype=np.int32)
+    codes = np.asarray(codes, dtype=np.int64)
+    return mapping[np.where(codes == NO_RESOURCE, len(values), codes)]
+
+
+def seconds(later, earlier):
+    missing = (later == NAT) | (earlier == NAT)
+    return np.where(missing, 0, (later - earlier) / US_PER_SECOND).astype(np.float32)
+
+
+def node_times(arrays):
+    # le tre caratteristiche temporali di ogni nodo non dipendono da k: si calcolano una volta sola
+    node_offsets = np.asarray(arrays['node_offsets'])
+    start = np.asarray(arrays['start_time'])
+    finish = np.asarray(arrays['finish_time'])
+    counts = np.diff(node_offsets)
+    first = np.repeat(node_offsets[:-1], counts)
+    previous = np.r_[NAT, finish[:-1]]
+    # il primo nodo di ogni caso non ha un'attività precedente: si usa il suo inizio
+    previous[node_offsets[:-1][counts > 0]] = start[node_offsets[:-1][counts > 0]]
+    times = np.empty((len(finish), len(NODE_TIME_COLUMNS)), dtype=np.float32)
+    times[:, 0] = seconds(finish, start[first])
+    times[:, 1] = seconds(finish, previous)
+    times[:, 2] = seconds(finish, start)
+    return times
+
+
+def per_k(first, last, max_k):
+    # quanti intervalli [first, last] contengono ogni k = 1 .. max_k (somma di differenze)
+    valid = first <= last
+    counts = np.zeros(max_k + 2, dtype=np.int64)
+    np.add.at(counts, first[valid], 1)
+    np.add.at(counts, last[valid] + 1, -1)
+    return np.cumsum(counts)[1:max_k + 1]
+
+
+def open_array(path, name, dtype, shape):
+    return np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+
+
+def export_tensors(arrays, max_k, path='data/tensors', buckets=None, previous=None):
+    # arrays: gli array di compact_prefixes (store_arrays o load_store_arrays); stessi prefissi di prefixes.csv,
+    # nello stesso ordine (per k, poi per caso) dentro ogni bucket
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    node_offsets = np.asarray(arrays['node_offsets'])
+    edge_offsets = np.asarray(arrays['edge_offsets'])
+    node1 = np.asarray(arrays['node1'], dtype=np.int64)
+    node2 = np.asarray(arrays['node2'], dtype=np.int64)
+    finish = np.asarray(arrays['finish_time'])
+
+    previous_events = previous_resources = None
+    if previous is not None:
+        previous_events = np.load(os.path.join(previous, 'event_names.npy'))
+        previous_resources = np.load(os.path.join(previous, 'resources.npy'))
+    event_names, event_known = vocabulary(arrays['event_names'], previous_events)
+    resources, resource_known = vocabulary(arrays['resources'], previous_resources)
+    event_code = recode(arrays['event_name'], arrays['event_names'], event_known)
+    resource_code = recode(arrays['resource'], arrays['resources'], resource_known)
+    times = node_times(arrays)
+    np.save(os.path.join(path, 'event_names.npy'), event_names)
+    np.save(os.path.join(path, 'resources.npy'), resources)
+    np.save(os.path.join(path, 'track_id.npy'), np.asarray(arrays['track_id']))
+
+    # un caso di n nodi ha i prefissi k = 1 .. min(n - 1, max_k); l'arco (node1, node2) compare nei prefissi
+    # k >= max(node1, node2) del suo caso
+    prefix_counts = np.minimum(np.diff(node_offsets) - 1, max_k).clip(min=0)
+    case_of_edge = np.repeat(np.arange(len(prefix_counts)), np.diff(edge_offsets))
+    edge_max = np.maximum(node1, node2)
+    prefixes_per_k = per_k(np.ones(len(prefix_counts), dtype=np.int64), prefix_counts, max_k)
+    edges_per_k = per_k(edge_max, prefix_counts[case_of_edge], max_k)
+
+    bounds = sorted(buckets) if buckets is not None else default_buckets(max_k)
+    if not bounds or bounds[-1] < max_k:
+        # i prefissi oltre l'ultimo limite finiscono in un bucket a parte
+        bounds.append(max_k)
+    meta = {'max_k': int(max_k), 'node_time_columns': NODE_TIME_COLUMNS, 'label_time_columns': LABEL_TIME_COLUMNS,
+            'buckets': []}
+    low = 1
+    for bound in bounds:
+        high = min(bound, max_k)
+        if high < low:
+            continue
+        ks = np.arange(low, high + 1)
+        rows = int(prefixes_per_k[ks - 1].sum())
+        edges = int(edges_per_k[ks - 1].sum())
+        low = high + 1
+        if rows == 0:
+            continue
+        width = int(ks[prefixes_per_k[ks - 1] > 0].max())
+        name = f'bucket_{width:03d}'
+        bucket_path = os.path.join(path, name)
+        os.makedirs(bucket_path)
+        # file nuovi: il padding a zero è già presente
+        tensors = {
+            'prefix_case': open_array(bucket_path, 'prefix_case', np.int32, (rows,)),
+            'length': open_array(bucket_path, 'length', np.int32, (rows,)),
+            'node_event': open_array(bucket_path, 'node_event', np.int32, (rows, width)),
+            'node_resource': open_array(bucket_path, 'node_resource', np.int32, (rows, width)),
+            'node_time': open_array(bucket_path, 'node_time', np.float32, (rows, width, len(NODE_TIME_COLUMNS))),
+            'edge_index': open_array(bucket_path, 'edge_index', np.int32, (2, edges)),
+            'edge_offsets': open_array(bucket_path, 'edge_offsets', np.int64, (rows + 1,)),
+            'label_event': open_array(bucket_path, 'label_event', np.int32, (rows,)),
+            'label_resource': open_array(bucket_path, 'label_resource', np.int32, (rows,)),
+            'label_time': open_array(bucket_path, 'label_time', np.float32, (rows, len(LABEL_TIME_COLUMNS))),
+        }
+
+        row = 0
+        edge = 0
+        for k in ks.tolist():
+            cases = np.flatnonzero(prefix_counts >= k)
+            if len(cases) == 0:
+                continue
+            stop = row + len(cases)
+            positions = node_offsets[cases][:, None] + np.arange(k)
+            tensors['prefix_case'][row:stop] = cases
+            tensors['length'][row:stop] = k
+            tensors['node_event'][row:stop, :k] = event_code[positions]
+            tensors['node_resource'][row:stop, :k] = resource_code[positions]
+            tensors['node_time'][row:stop, :k] = times[positions]
+
+            # archi dei prefissi k nell'ordine del file .g, con indici dei nodi locali al prefisso (da 0)
+            inside = (edge_max <= k) & (prefix_counts[case_of_edge] >= k)
+            counts = np.bincount(case_of_edge[inside], minlength=len(prefix_counts))[cases]
+            edge_stop = edge + int(counts.sum())
+            tensors['edge_index'][0, edge:edge_stop] = node1[inside] - 1
+            tensors['edge_index'][1, edge:edge_stop] = node2[inside] - 1
+            tensors['edge_offsets'][row + 1:stop + 1] = edge + np.cumsum(counts)
+
+            labels = node_offsets[cases] + k
+            last = node_offsets[cases + 1] - 1
+            tensors['label_event'][row:stop] = event_code[labels]
+            tensors['label_resource'][row:stop] = resource_code[labels]
+            tensors['label_time'][row:stop, 0] = seconds(finish[labels], finish[labels - 1])
+            tensors['label_time'][row:stop, 1] = seconds(finish[last], finish[labels - 1])
+            row, edge = stop, edge_stop
+
+        for tensor in tensors.values():
+            tensor.flush()
+        del tensors
+        meta['buckets'].append({'name': name, 'min_k': int(ks[0]), 'max_k': width, 'prefixes': rows, 'edges': edges})
+
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(meta, file, indent=2)
+    return meta
+
+
+@instrumented('tensors')
+def build_tensors(graphs_path='data/graphs.g', log_path='data/prefixes/prefix_log_100.csv', path='data/tensors',
+                  max_len=None, buckets=None, previous=None):
+    # stessi casi e stesso max_len di prefix_engine.generate_prefixes, senza passare da prefixes.csv
+    start = time.time()
+    cases = load_cases(graphs_path, log_path)
+    if max_len is None:
+        max_len = max((len(nodes) for _, nodes, _ in cases), default=0)
+    meta = export_tensors(store_arrays(cases), max(max_len - 2, 0), path, buckets, previous)
+    print(f"Tensor export of {sum(bucket['prefixes'] for bucket in meta['buckets'])} prefixes "
+          f"({len(meta['buckets'])} buckets): {time.time() - start:.6f} seconds")
+    return meta
+
+
+@instrumented('tensors')
+def build_tensors_from_store(store_path='data/db/prefix_store', path='data/tensors', buckets=None, previous=None):
+    # gli stessi tensori di build_tensors a partire dall'archivio di compact_prefixes.build_store, senza rileggere
+    # il .g e il log
+    start = time.time()
+    arrays, max_k = load_store_arrays(store_path)
+    meta = export_tensors(arrays, max_k, path, buckets, previous)
+    print(f"Tensor export of {sum(bucket['prefixes'] for bucket in meta['buckets'])} prefixes "
+          f"({len(meta['buckets'])} buckets) from {store_path}: {time.time() - start:.6f} seconds")
+    return meta
+
+
+class TensorDataset:
+    # lettura dei tensori senza copie: ogni array è un np.memmap in sola lettura, ogni batch una vista contigua
+
+    def __init__(self, path='data/tensors'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            self.meta = json.load(file)
+        self.event_names = np.load(os.path.join(path, 'event_names.npy'))
+        self.resources = np.load(os.path.join(path, 'resources.npy'))
+        self.track_ids = np.load(os.path.join(path, 'track_id.npy'), mmap_mode='r')
+        self.buckets = {bucket['name']: bucket for bucket in self.meta['buckets']}
+        self._arrays = {}
+
+    def __len__(self):
+        return sum(bucket['prefixes'] for bucket in self.meta['buckets'])
+
+    def bucket(self, name):
+        if name not in self._arrays:
+            bucket_path = os.path.join(self.path, name)
+            self._arrays[name] = {file[:-4]: np.load(os.path.join(bucket_path, file), mmap_mode='r')
+                                  for file in os.listdir(bucket_path) if file.endswith('.npy')}
+        return self._arrays[name]
+
+    def batch(self, name, first, last):
+        # righe [first, last) del bucket; gli archi sono la fetta corrispondente di edge_index, con offset da 0
+        arrays = self.bucket(name)
+        edge_first, edge_last = int(arrays['edge_offsets'][first]), int(arrays['edge_offsets'][last])
+        batch = {key: values[first:last] for key, values in arrays.items()
+                 if key not in ('edge_index', 'edge_offsets')}
+        batch['edge_index'] = arrays['edge_index'][:, edge_first:edge_last]
+        batch['edge_offsets'] = arrays['edge_offsets'][first:last + 1] - edge_first
+        return batch
+
+    def batches(self, batch_size=256, shuffle=False, seed=None):
+        # un batch contiene prefissi dello stesso bucket; con shuffle si mescola l'ordine dei batch, non le righe
+        spans = [(name, first, min(first + batch_size, bucket['prefixes']))
+                 for name, bucket in self.buckets.items() for first in range(0, bucket['prefixes'], batch_size)]
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(len(spans))
+            spans = [spans[position] for position in order]
+        for name, first, last in spans:
+            yield self.batch(name, first, last)
+
+
+if __name__ == "__main__":
+    build_tensors()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+from neo4j.exceptions import TransientError
+
+from async_neo4j import AsyncActiveCaseGeneration
+from instrumentation import disabled
+from neo4j_loader import Neo4jBulkLoader
+from queries import ActiveCaseGeneration
+from standin_driver import AsyncStandInDriver, StandInDriver, StandInGraph
+
+# import e prefissi di async_neo4j sullo stand-in asyncio con due deadlock iniziali: stesso prefixes.csv del
+# percorso sincrono di queries, errori transitori ritentati e al più concurrency query in volo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'data')
+LOG_PATH = os.path.join(DATA, 'prefixes', 'prefix_log_100.csv')
+CONCURRENCY = 3
+
+
+class CountingDriver(AsyncStandInDriver):
+    # conta le query in volo nello stesso momento
+
+    def __init__(self, graph, latency):
+        super().__init__(graph, latency)
+        self.in_flight = 0
+        self.peak = 0
+
+    async def execute_query(self, query, parameters_=None, database_=None, result_transformer_=None, **kwargs):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            return await super().execute_query(query, parameters_, database_, result_transformer_, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture(scope='module', autouse=True)
+def no_metrics():
+    with disabled():
+        yield
+
+
+@pytest.fixture(scope='module')
+def graphs_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('graphs') / 'graphs.g'
+    shutil.copyfile(os.path.join(DATA, 'graphs.g'), path)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def sync_prefixes(graphs_path, tmp_path_factory):
+    driver = StandInDriver()
+    loader = Neo4jBulkLoader(driver)
+    loader.load_events(LOG_PATH)
+    loader.load_edges(graphs_path)
+    output_path = str(tmp_path_factory.mktemp('sync') / 'prefixes.csv')
+    ActiveCaseGeneration(driver=driver).create_prefixes(output_path)
+    with open(output_path) as file:
+        return file.read()
+
+
+def run_async(driver, graphs_path, output_path, fan_out):
+    async def main():
+        async with AsyncActiveCaseGeneration(driver=driver, concurrency=CONCURRENCY, backoff=0.001,
+                                             batch_size=200) as connection:
+            loaded = await connection.import_files([LOG_PATH])
+            await connection.import_edges(graphs_path)
+            rows = await connection.create_prefixes(output_path, fan_out, shards=4)
+            return loaded, rows
+    return asyncio.run(asyncio.wait_for(main(), timeout=60))
+
+
+@pytest.mark.parametrize('fan_out', ['k', 'track'])
+def test_async_prefixes_match_sync(fan_out, graphs_path, sync_prefixes, tmp_path, capsys):
+    graph = StandInGraph(transient_failures=2)
+    driver = CountingDriver(graph, latency=0.001)
+    output_path = str(tmp_path / 'prefixes.csv')
+    loaded, rows = run_async(driver, graphs_path, output_path, fan_out)
+
+    assert loaded == [2385]
+    assert graph.transient_failures == 0
+    printed = capsys.readouterr().out
+    assert "TransientError, retry 1/5" in printed and "TransientError, retry 2/5" in printed
+    assert 1 < driver.peak <= CONCURRENCY
+    assert driver.in_flight == 0
+
+    with open(output_path) as file:
+        produced = file.read()
+    assert rows > 0
+    if fan_out == 'k':
+        assert produced == sync_prefixes
+    else:
+        # una query per gruppo di casi: stesse righe, casi in un altro ordine dentro ogni k
+        assert sorted(produced.splitlines()) == sorted(sync_prefixes.splitlines())
+
+
+def test_retries_exhausted(graphs_path, tmp_path):
+    # più errori dei tentativi: il TransientError arriva al chiamante
+    driver = AsyncStandInDriver(StandInGraph(transient_failures=3))
+
+    async def main():
+        async with AsyncActiveCaseGeneration(driver=driver, retries=2, backoff=0) as connection:
+            await connection.create_prefixes(str(tmp_path / 'prefixes.csv'))
+
+    with pytest.raises(TransientError):
+        asyncio.run(main())
@@ -0,0 +1,108 @@
+import os
+import re
+
+import pytest
+
+import async_neo4j
+import neo4j_loader
+import queries
+
+# tutte le query Cypher della pipeline: controllo sintattico locale sul testo finale e, se NEO4J_TEST_URI è
+# impostata, EXPLAIN su un server vero (nessuna esecuzione, solo il piano)
+
+QUERIES = {
+    'queries.STREAM_PREFIX_QUERY': queries.STREAM_PREFIX_QUERY,
+    'queries.ACTIVE_QUERY': queries.ACTIVE_QUERY,
+    'queries.ACTIVE_CASE_QUERY': queries.ACTIVE_CASE_QUERY,
+    'neo4j_loader.MERGE_EVENTS': neo4j_loader.MERGE_EVENTS,
+    'neo4j_loader.MERGE_EDGES': neo4j_loader.MERGE_EDGES,
+    'neo4j_loader.MERGE_CASE_METADATA': neo4j_loader.MERGE_CASE_METADATA,
+    'async_neo4j.MAX_ACTIVITY_QUERY': async_neo4j.MAX_ACTIVITY_QUERY,
+    'async_neo4j.TRACKS_QUERY': async_neo4j.TRACKS_QUERY,
+    'async_neo4j.PREFIX_QUERY': async_neo4j.PREFIX_QUERY,
+    'async_neo4j.TRACK_PREFIX_QUERY': async_neo4j.TRACK_PREFIX_QUERY,
+}
+SCHEMA_QUERIES = {f'neo4j_loader.SCHEMA_QUERIES[{number}]': query
+                  for number, query in enumerate(neo4j_loader.SCHEMA_QUERIES)}
+PARAMETERS = {'k': 1, 'rows': [], 'f_prefix': 0, 'track_ids': []}
+CLAUSES = ('MATCH', 'OPTIONAL MATCH', 'WITH', 'UNWIND', 'MERGE', 'CREATE', 'RETURN', 'CALL')
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+# un segnaposto di str.format rimasto nel testo: {nome} senza ':' né '.'
+PLACEHOLDER = re.compile(r"\{\s*[A-Za-z_]\w*\s*\}")
+
+
+def lint(query):
+    problems = []
+    text = STRING_LITERAL.sub("''", query)
+    if '{{' in text:
+        problems.append("doubled braces '{{' (format string escaped twice or not formatted)")
+    problems.extend(f"format placeholder {match.group(0)}" for match in PLACEHOLDER.finditer(text))
+    pairs = {')': '(', ']': '[', '}': '{'}
+    stack = []
+    for position, character in enumerate(text):
+        if character in '([{':
+            stack.append(character)
+        elif character in pairs:
+            if not stack or stack.pop() != pairs[character]:
+                problems.append(f"unbalanced {character!r} at {position}")
+                break
+    if stack:
+        problems.append(f"unclosed {stack[-1]!r}")
+    if not text.lstrip().upper().startswith(CLAUSES + ('EXPLAIN',)):
+        problems.append("does not start with a clause")
+    problems.extend(f"bad parameter {match.group(0)}" for match in re.finditer(r"\$(?![A-Za-z_]\w*)", text))
+    return problems
+
+
+@pytest.mark.parametrize('name', sorted(QUERIES) + sorted(SCHEMA_QUERIES))
+def test_query_text_is_well_formed(name):
+    query = QUERIES.get(name, SCHEMA_QUERIES.get(name))
+    assert lint(query) == [], f"{name}: {query}"
+
+
+def test_lint_catches_doubled_braces():
+    # il difetto del primo STREAM_PREFIX_QUERY: la proiezione passata due volte da str.format
+    broken = "MATCH (n) RETURN n {{.track_id, .activity_id}} AS node"
+    assert lint(broken)
+    assert lint("MATCH (n) SET n.time = {start_time}")
+    assert lint("MATCH (n RETURN n")
+
+
+# proiezione map di Cypher con parentesi singole: n {.track_id, ..., start_time: <espr>, finish_time: <espr>}
+PROJECTION = re.compile(r"(?<![{\w])(?P<variable>[nl]) \{\.track_id, \.activity_id, \.event_name, \.resource, "
+                        r"start_time: (?P<start>[^,{}]+), finish_time: (?P<finish>[^,{}]+)\}(?!\})")
+
+
+@pytest.mark.parametrize('query', [queries.STREAM_PREFIX_QUERY, async_neo4j.PREFIX_QUERY,
+                                   async_neo4j.TRACK_PREFIX_QUERY])
+def test_prefix_query_projections(query):
+    # testo finale delle query dei prefissi (user-017): proiezioni di n e l con le proprietà lette da
+    # queries.property_node e colonne restituite nell'ordine atteso
+    projections = {match.group('variable'): match for match in PROJECTION.finditer(query)}
+    assert sorted(projections) == ['l', 'n'], query
+    for variable, match in projections.items():
+        assert match.group('start').strip() == f"{variable}.start_time.epochSeconds * 1000000 + " \
+                                               f"{variable}.start_time.microsecond"
+        assert match.group('finish').strip() == f"{variable}.finish_time.epochSeconds * 1000000 + " \
+                                                f"{variable}.finish_time.microsecond"
+    returned = re.search(r"\bRETURN (.*)$", query).group(1)
+    assert re.fullmatch(r"track_id, \[n IN p_nodes \| n \{[^{}]*\}\] AS nodes, connections, l \{[^{}]*\} AS label",
+                        returned), returned
+
+
+@pytest.fixture(scope='module')
+def server():
+    uri = os.getenv('NEO4J_TEST_URI')
+    if not uri:
+        pytest.skip("NEO4J_TEST_URI not set")
+    from neo4j import GraphDatabase
+    driver = GraphDatabase.driver(uri, auth=(os.getenv('NEO4J_TEST_USER', 'neo4j'),
+                                             os.getenv('NEO4J_TEST_PASSWORD', 'neo4j')))
+    yield driver
+    driver.close()
+
+
+@pytest.mark.parametrize('name', sorted(QUERIES))
+def test_query_is_accepted_by_server(server, name):
+    # EXPLAIN compila e pianifica la query senza eseguirla
+    server.execute_query("EXPLAIN " + QUERIES[name], parameters_=PARAMETERS, database_="neo4j")
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from graph_csr import CaseGraphs
+from graph_reader import read_graphs
+from queries import case_dbs
+
+# CaseGraphs e la correzione vettoriale delle attività parallele di queries.case_dbs, confrontata con il ciclo
+# pandas originale di active_case_and_final_activity_dbs in cui le righe degli archi hanno il loro track_id
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAPHS_PATH = os.path.join(ROOT, 'data', 'graphs.g')
+
+
+@pytest.fixture(scope='module')
+def graphs():
+    return list(read_graphs(GRAPHS_PATH))
+
+
+def test_prefix_edges_stay_inside_the_case(graphs):
+    case_graphs = CaseGraphs(graphs)
+    per_case = np.diff(case_graphs.edge_offsets)
+    for k in [case_graphs.key_base, 2 * case_graphs.key_base + 1]:
+        np.testing.assert_array_equal(case_graphs.prefix_edge_counts(k), per_case)
+        for case in range(len(case_graphs)):
+            assert len(case_graphs.prefix_edges(case, k)) == per_case[case]
+    # con k entro il caso: gli archi (node1, node2) del .g con entrambi i nodi <= k, nello stesso ordine
+    for case, graph in enumerate(graphs):
+        pairs = np.frombuffer(graph.edges, dtype=np.int32).reshape(-1, 2).tolist()
+        for k in range(1, len(graph) + 1):
+            assert case_graphs.prefix_edges(case, k) == [tuple(pair) for pair in pairs if max(pair) <= k]
+
+
+def reference_final_activities():
+    # il ciclo pandas del codice originale, con il track_id del caso anche sulle righe 'e'
+    rows = []
+    track_id = None
+    with open(GRAPHS_PATH, 'r') as file:
+        for line in file:
+            parts = line.split()
+            if line.startswith('v'):
+                track_id = parts[4]
+                rows.append(('v', track_id, int(parts[1]), float('nan'), parts[2], parts[3]))
+            elif line.startswith('e'):
+                rows.append(('e', track_id, int(parts[1]), int(parts[2]), parts[3], float('nan')))
+    final_df = pd.DataFrame(rows, columns=['e_v', 'track_id', 'node1', 'node2', 'event_name', 'finish'])
+    final_df['finish'] = final_df['finish'].apply(
+        lambda x: pd.to_datetime(str(x)[:18], format='%Y-%m-%d%H:%M:%S', utc=True) if not pd.isna(x) else x)
+    final_df['start'] = final_df['finish'].shift(periods=1)
+    final_df['start'] = final_df.apply(lambda x: x['finish'] if x['node1'] == 1 else x['start'], axis=1)
+    vertices = final_df['e_v'] == 'v'
+    parallel_df = final_df[final_df['e_v'] == 'e'].groupby(['node1', 'track_id']).filter(lambda x: len(x) > 1)
+    for _, row in parallel_df.iterrows():
+        same_case = final_df['track_id'] == row['track_id']
+        finish_time = final_df.loc[vertices & same_case & (final_df['node1'] == row['node1']), 'finish']
+        row_index = final_df[vertices & same_case & (final_df['node1'] == row['node2'])].index
+        final_df.loc[row_index, 'start'] = finish_time.iloc[0]
+        node2_name = list(final_df[same_case & (final_df['node1'] == row['node2']) & ~vertices]['node2'])
+        node2_info = final_df[vertices & same_case & final_df['node1'].isin(node2_name)]
+        min_time = node2_info['start'].min()
+        final_df.loc[row_index, 'finish'] = node2_info[node2_info['start'] == min_time]['start'].iloc[0]
+    final_df = final_df[vertices].drop(columns=['node2', 'e_v']).rename(columns={'node1': 'index'})
+    return final_df.to_csv(index=False)
+
+
+def test_parallel_branches_match_reference(graphs):
+    final_df, _ = case_dbs(graphs, parallel_branches=True)
+    produced = final_df.to_csv(index=False)
+    assert produced == reference_final_activities()
+    # la correzione cambia davvero qualcosa rispetto ai file esistenti
+    assert produced != case_dbs(graphs)[0].to_csv(index=False)
@@ -0,0 +1,50 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from graph_reader import read_graphs
+from incremental import IncrementalPrefixGenerator
+from instrumentation import disabled
+from prefix_engine import LOG_COLUMNS, generate_prefixes
+
+# replay evento per evento dei casi di data/graphs.g, con gli archi del .g (anche quelli delle attività
+# parallele): stesso prefixes.csv di prefix_engine.generate_prefixes, riga per riga
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'data')
+LOG_PATH = os.path.join(DATA, 'prefixes', 'prefix_log_100.csv')
+
+
+@pytest.fixture(scope='module', autouse=True)
+def no_metrics():
+    with disabled():
+        yield
+
+
+def test_replay_matches_generate_prefixes(tmp_path):
+    graphs_path = str(tmp_path / 'graphs.g')
+    shutil.copyfile(os.path.join(DATA, 'graphs.g'), graphs_path)
+    graphs = list(read_graphs(graphs_path))
+    case_order = {graph.track_id: position for position, graph in enumerate(graphs)}
+
+    # eventi dei casi del .g in ordine (activity_id, caso): i prefissi escono per k e poi per caso, come in
+    # generate_prefixes
+    log = pd.read_csv(LOG_PATH, header=None, names=LOG_COLUMNS, dtype=str)
+    log = log[log['track_id'].isin(case_order)]
+    log = log.assign(activity=log['activity_id'].astype(int), case=log['track_id'].map(case_order))
+    replay_path = str(tmp_path / 'replay.csv')
+    log.sort_values(['activity', 'case'])[LOG_COLUMNS].to_csv(replay_path, header=False, index=False)
+
+    generator = IncrementalPrefixGenerator(str(tmp_path / 'prefixes.csv'), str(tmp_path / 'active.csv'),
+                                           str(tmp_path / 'final.csv'))
+    emitted = generator.add_events_from_csv(replay_path, graphs_path)
+    generator.close()
+
+    # il replay emette anche l'ultimo prefisso (k = n - 1) dei casi più lunghi, escluso dal max_len di default
+    expected_path = str(tmp_path / 'expected.csv')
+    generate_prefixes(graphs_path, LOG_PATH, expected_path, max_len=max(len(graph) for graph in graphs) + 1)
+    assert len(emitted) == sum(len(graph) - 1 for graph in graphs)
+    with open(tmp_path / 'prefixes.csv') as produced, open(expected_path) as expected:
+        assert produced.read().splitlines() == expected.read().splitlines()
@@ -0,0 +1,117 @@
+import itertools
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import out_of_core
+from instrumentation import disabled
+from neo4j_loader import Neo4jBulkLoader
+from out_of_core import MemoryBudget, active_case_and_final_activity_dbs_chunked, generate_prefixes_chunked, rss
+from parallel_prefixes import active_case_and_final_activity_dbs_parallel, generate_prefixes_parallel
+from prefix_engine import generate_prefixes
+from queries import ActiveCaseGeneration, active_case_and_final_activity_dbs
+from standin_driver import StandInDriver
+
+# DBp, DBs e DBf di prefix_log_100 + graphs.g confrontati con i file di riferimento in data/, per ogni percorso:
+# python, parallelo, a gruppi (anche con gruppi ridotti dopo il controllo dell'RSS) e Neo4j tramite lo stand-in
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'data')
+LOG_PATH = os.path.join(DATA, 'prefixes', 'prefix_log_100.csv')
+PATHS = ['python', 'parallel', 'chunked', 'chunked_shrink']
+
+
+@pytest.fixture(scope='module', autouse=True)
+def no_metrics():
+    # nessun record in data/output_files/metrics.jsonl, anche dai worker dei pool
+    with disabled():
+        yield
+
+
+@pytest.fixture(scope='module')
+def graphs_path(tmp_path_factory):
+    # una copia del .g: l'indice .g.idx viene scritto accanto a questa e non in data/
+    path = tmp_path_factory.mktemp('graphs') / 'graphs.g'
+    shutil.copyfile(os.path.join(DATA, 'graphs.g'), path)
+    return str(path)
+
+
+def same_bytes(path, reference):
+    with open(path, 'rb') as file, open(reference, 'rb') as expected:
+        return file.read() == expected.read()
+
+
+def chunked_budget(monkeypatch, shrink):
+    # stime per nodo alte: più gruppi anche su 29 casi; con shrink il primo controllo dell'RSS fallisce e i gruppi
+    # restanti vengono divisi
+    monkeypatch.setattr(out_of_core, 'BYTES_PER_NODE', 256 * 1024)
+    if shrink:
+        checks = itertools.count()
+        monkeypatch.setattr(MemoryBudget, 'exceeded', lambda self: next(checks) == 0)
+    return rss() / 1024 ** 2 + 64
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_prefixes_match_reference(path, graphs_path, tmp_path, monkeypatch):
+    output_path = str(tmp_path / 'prefixes.csv')
+    if path == 'python':
+        generate_prefixes(graphs_path, LOG_PATH, output_path)
+    elif path == 'parallel':
+        generate_prefixes_parallel(graphs_path, LOG_PATH, output_path, workers=2, shards=5)
+    else:
+        generate_prefixes_chunked(graphs_path, LOG_PATH, output_path,
+                                  chunked_budget(monkeypatch, path == 'chunked_shrink'))
+    assert same_bytes(output_path, os.path.join(DATA, 'prefixes.csv'))
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_dbs_match_reference(path, graphs_path, tmp_path, monkeypatch):
+    output_dir = str(tmp_path)
+    if path == 'python':
+        active_case_and_final_activity_dbs(graphs_path, output_dir)
+    elif path == 'parallel':
+        active_case_and_final_activity_dbs_parallel(graphs_path, output_dir, workers=2, shards=4)
+    else:
+        active_case_and_final_activity_dbs_chunked(graphs_path, output_dir,
+                                                   chunked_budget(monkeypatch, path == 'chunked_shrink'))
+    for name in ['active_activities.csv', 'final_activities.csv']:
+        assert same_bytes(os.path.join(output_dir, name), os.path.join(DATA, name)), name
+
+
+@pytest.fixture(scope='module')
+def standin(graphs_path):
+    driver = StandInDriver()
+    loader = Neo4jBulkLoader(driver)
+    loader.load_events(LOG_PATH)
+    loader.load_edges(graphs_path)
+    return ActiveCaseGeneration(driver=driver)
+
+
+def prefix_rows(frame, prefix_ids):
+    # righe dei prefissi dati, senza le righe vuote e XP, in un ordine indipendente dal percorso
+    frame = frame[frame['prefix_id'].isin(prefix_ids)]
+    return frame.sort_values(['prefix_id', 'e_v', 'node1', 'node2']).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_standin_prefixes_match_reference(standin, streaming, tmp_path):
+    # il percorso Neo4j ordina i casi in un altro modo e, con max_len preso da tutti i casi del log, aggiunge
+    # prefissi più lunghi di quelli di prefixes.csv: i prefissi di riferimento devono esserci tutti, identici
+    output_path = str(tmp_path / 'prefixes_neo4j.csv')
+    standin.create_prefixes(output_path, streaming=streaming)
+    produced = pd.read_csv(output_path, dtype=str)
+    expected = pd.read_csv(os.path.join(DATA, 'prefixes.csv'), dtype=str)
+    prefix_ids = set(expected['prefix_id'].dropna())
+    assert prefix_ids <= set(produced['prefix_id'].dropna())
+    pd.testing.assert_frame_equal(prefix_rows(produced, prefix_ids), prefix_rows(expected, prefix_ids))
+
+
+def test_standin_dbs_match_reference(standin, tmp_path):
+    output_path = str(tmp_path / 'active_activities_Neo4j.csv')
+    standin.active_activity_neo4j(output_path)
+    order = lambda frame: frame.sort_values(['track_id', 'index'], key=lambda column: column.astype(int)) \
+        .reset_index(drop=True)
+    pd.testing.assert_frame_equal(order(pd.read_csv(output_path, dtype=str)),
+                                  order(pd.read_csv(os.path.join(DATA, 'active_activities_Neo4j.csv'), dtype=str)))
@@ -0,0 +1,49 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from compact_prefixes import build_store
+from instrumentation import disabled
+from tensor_export import build_tensors, build_tensors_from_store
+
+# tensori costruiti dall'archivio salvato di compact_prefixes: stessi file, byte per byte, di quelli costruiti
+# dal .g e dal log
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'data')
+LOG_PATH = os.path.join(DATA, 'prefixes', 'prefix_log_100.csv')
+
+
+@pytest.fixture(scope='module', autouse=True)
+def no_metrics():
+    with disabled():
+        yield
+
+
+def npy_files(path):
+    return sorted(os.path.relpath(os.path.join(directory, file), path)
+                  for directory, _, files in os.walk(path) for file in files if file.endswith('.npy'))
+
+
+@pytest.mark.parametrize('buckets', [None, [2, 5]])
+def test_tensors_from_store_match_build_tensors(buckets, tmp_path):
+    graphs_path = str(tmp_path / 'graphs.g')
+    shutil.copyfile(os.path.join(DATA, 'graphs.g'), graphs_path)
+    direct = str(tmp_path / 'direct')
+    from_store = str(tmp_path / 'from_store')
+    store = str(tmp_path / 'prefix_store')
+    build_tensors(graphs_path, LOG_PATH, direct, buckets=buckets)
+    build_store(graphs_path, LOG_PATH, store)
+    build_tensors_from_store(store, from_store, buckets=buckets)
+
+    with open(os.path.join(direct, 'meta.json')) as file, open(os.path.join(from_store, 'meta.json')) as other:
+        assert json.load(file) == json.load(other)
+    files = npy_files(direct)
+    assert files and files == npy_files(from_store)
+    for name in files:
+        expected, produced = np.load(os.path.join(direct, name)), np.load(os.path.join(from_store, name))
+        assert expected.dtype == produced.dtype, name
+        np.testing.assert_array_equal(produced, expected, err_msg=name)
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+# un solo formato interno per tutti i tempi della pipeline: int64 microsecondi dall'epoca in UTC, NAT se mancante.
+# In ingresso: il formato dei file .g ('2011-10-0108:11:07.866000+02:00'), quello dei CSV
+# ('2011-10-01 00:38:43+00:00'), datetime/pd.Timestamp e neo4j.time.DateTime
+
+NAT = np.iinfo(np.int64).min
+US_PER_SECOND = 1000000
+US_PER_MINUTE = 60 * US_PER_SECOND
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_timestamp(value):
+    # un solo valore testuale -> (microsecondi UTC, offset in minuti); l'ora senza offset è UTC
+    value = value.strip()
+    if value[10:11] not in ('T', ' '):
+        value = value[:10] + 'T' + value[10:]
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // timedelta(microseconds=1), moment.utcoffset() // timedelta(minutes=1)
+
+
+def parse_timestamps(values):
+    # colonna di stringhe (anche con formati misti) -> (int64 µs UTC, int16 offset in minuti); NA -> (NAT, 0)
+    text = pd.Series(values, dtype='string').str.strip().reset_index(drop=True)
+    # i suffissi distinti sono pochissimi: ogni offset si interpreta una volta sola. L'ultimo elemento serve ai
+    # valori mancanti (codice -1)
+    codes, suffixes = pd.factorize(text.str[-6:])
+    cut = np.zeros(len(suffixes) + 1, dtype=np.int64)
+    minutes = np.zeros(len(suffixes) + 1, dtype=np.int64)
+    for position, suffix in enumerate(suffixes):
+        if len(suffix) == 6 and suffix[0] in '+-' and suffix[3] == ':':
+            cut[position] = 6
+            minutes[position] = (-1 if suffix[0] == '-' else 1) * (int(suffix[1:3]) * 60 + int(suffix[4:6]))
+        elif suffix.endswith('Z'):
+            cut[position] = 1
+    cut = cut[codes]
+    offset = minutes[codes]
+
+    # l'ora locale senza offset, con il separatore che manca nel formato .g, si legge con il parser ISO di pandas
+    local = text
+    for length in np.unique(cut[cut > 0]):
+        rows = cut == length
+        if rows.all():
+            local = text.str[:-length]
+        else:
+            local = local.copy() if local is text else local
+            local[rows] = text[rows].str[:-length]
+    joined = (~local.str[10:11].isin(['T', ' '])).fillna(False).to_numpy(bool)
+    if joined.all():
+        local = local.str[:10] + 'T' + local.str[10:]
+    elif joined.any():
+        local = local.copy() if local is text else local
+        local[joined] = local[joined].str[:10] + 'T' + local[joined].str[10:]
+    local = pd.to_datetime(local, format='ISO8601').to_numpy('datetime64[us]').view(np.int64)
+
+    missing = local == NAT
+    return np.where(missing, NAT, local - offset * US_PER_MINUTE), np.where(missing, 0, offset).astype(np.int16)
+
+
+def wall_clock_us(utc, offset):
+    # ora locale letta come UTC: la convenzione dei prefix_log, dei DBs/DBf e dei nodi importati in Neo4j
+    utc = np.asarray(utc, dtype=np.int64)
+    return np.where(utc == NAT, NAT, utc + np.asarray(offset, dtype=np.int64) * US_PER_MINUTE)
+
+
+def parse_wall_clock(values):
+    return wall_clock_us(*parse_timestamps(values))
+
+
+def to_epoch_us(values):
+    # colonna di stringhe o di datetime -> int64 µs UTC
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        return values.to_numpy('datetime64[us]').view(np.int64)
+    if pd.api.types.is_integer_dtype(values.dtype):
+        # già in µs (come instant_to_epoch_us per gli interi)
+        return values.to_numpy(np.int64)
+    if all(isinstance(value, str) for value in values.dropna().head(10)):
+        return parse_timestamps(values)[0]
+    return np.array([instant_to_epoch_us(value) for value in values], dtype=np.int64)
+
+
+def instant_to_epoch_us(value):
+    # un singolo istante: interi già in µs, stringhe, datetime, pd.Timestamp, neo4j.time.DateTime; naive = UTC
+    if value is None or value is pd.NaT or value is pd.NA:
+        return NAT
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        return parse_timestamp(value)[0]
+    if hasattr(value, 'to_native'):
+        value = value.to_native()
+    instant = pd.Timestamp(value)
+    if instant is pd.NaT:
+        return NAT
+    if instant.tzinfo is None:
+        instant = instant.tz_localize('UTC')
+    return instant.value // 1000
+
+
+def instants_to_epoch_us(values):
+    instants = pd.DatetimeIndex(pd.to_datetime(values))
+    if instants.tz is None:
+        instants = instants.tz_localize('UTC')
+    return instants.tz_convert('UTC').tz_localize(None).to_numpy('datetime64[us]').view(np.int64)
+
+
+def from_epoch_us(values):
+    # int64 µs -> colonna datetime UTC, usata solo quando si scrive un CSV
+    values = np.ascontiguousarray(values, dtype=np.int64)
+    return pd.Series(pd.to_datetime(values.view('datetime64[us]')).tz_localize('UTC'))
+
+
+def cypher_epoch_us(expression):
+    # una proprietà datetime di Neo4j restituita come intero: il driver non crea oggetti DateTime
+    return f"{expression}.epochSeconds * {US_PER_SECOND} + {expression}.microsecond"
+
+
+def cypher_datetime(expression):
+    # l'inverso per l'import: da intero µs a datetime di Neo4j
+    return (f"CASE WHEN {expression} IS NULL THEN null ELSE datetime({{epochSeconds: {expression} / {US_PER_SECOND}, "
+            f"nanosecond: {expression} % {US_PER_SECOND} * 1000}}) END")